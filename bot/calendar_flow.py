@@ -1,16 +1,175 @@
 # bot/calendar_flow.py
+"""
+Общий движок календарных действий для всех дочерних ботов.
+
+Экземпляр не хранит состояние конкретного бота: ожидающие подтверждения лежат
+в подключаемом хранилище (bot/services/pending_store.py), владелец передаётся в каждый вызов.
+Поэтому достаточно одного экземпляра на процесс (см. openrouter/worker.py: CALENDAR_FLOW).
+"""
 from __future__ import annotations
 
+import html
 import json
+import os
 import re
 import secrets
-from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Callable, Tuple
 
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from bot.calendar_match import (
+    MatchQuery, rank_events, confident_choice, get_event_index, invalidate_event_index,
+)
+
+PLAN_RE = re.compile(r"<calendar_plan>\s*(\{.*?\})\s*</calendar_plan>", re.S)
+
+CAL_ACTIONS = frozenset({"list", "create", "update", "delete"})
+
+CAL_PLAN_SYSTEM_TEMPLATE = """
+Дополнение: ты должен определить, требуется ли действие с Google Calendar.
+В конце ответа ОБЯЗАТЕЛЬНО добавь блок:
+
+<calendar_plan>{{JSON}}</calendar_plan>
+
+JSON строго валидный (без комментариев). Схема:
+{{
+"action": "none" | "list" | "create" | "update" | "delete",
+"needs_confirmation": true|false,
+"missing_fields": [строки],
+
+"range": {{"start": "...", "end": "..."}},  // для list (опционально)
+"event": {{"summary": "...", "start": "...", "end": "...", "location": null, "description": null}}, // create
+"match": {{"strategy": "nearest", "range_days": 14, "query": "токены|поиска", "around": "...", "location": null, "attendee": null}}, // update/delete
+"patch": {{
+    "start": "...",
+    "end": "...",
+    "shift_minutes": 60,
+    "summary": "...",
+    "location": "...",
+    "description": "..."
+}} // update
+}}
+
+Правила:
+- Если пользователь не просит показать/создать/перенести/удалить запись — action="none".
+- Для create/update/delete: needs_confirmation=true.
+- Времена указывай ISO-8601 с таймзоной {tz}. Сейчас: {now}.
+- Если пользователь говорит "на час позже/раньше" — используй patch.shift_minutes (например 60 или -60).
+- В match.around укажи время искомого события, если пользователь его назвал; location/attendee — место и участника, если названы.
+- Если не хватает данных — заполни missing_fields и НЕ выдумывай.
+"""
+
+
+# Основной режим — нативный tool calling (OpenRouter tools=). CAL_USE_TOOLS=0 возвращает
+# текстовый блок <calendar_plan> для моделей без поддержки инструментов.
+CAL_USE_TOOLS = os.getenv("CAL_USE_TOOLS", "1") != "0"
+
+# календарность предыдущей реплики наследует только короткое уточнение («давай в 15», «да, на завтра»)
+CAL_FOLLOWUP_MAX_WORDS = int(os.getenv("CAL_FOLLOWUP_MAX_WORDS", "6"))
+
+CAL_TOOLS_SYSTEM_TEMPLATE = """
+Дополнение: у тебя есть инструменты Google Calendar (list_events, create_event, update_event, delete_event).
+- Вызывай инструмент, только если пользователь явно просит показать/создать/перенести/удалить запись.
+- Времена указывай ISO-8601 с таймзоной {tz}. Сейчас: {now}.
+- "На час позже/раньше" — shift_minutes (например 60 или -60).
+- Если не хватает данных — спроси у пользователя и НЕ выдумывай.
+- Перед create/update/delete пользователь подтвердит действие кнопкой — коротко опиши, что будет сделано.
+"""
+
+_MATCH_PROPS = {
+    "query": {"type": "string", "description": "Слова из названия искомого события"},
+    "around": {"type": "string", "description": "Время искомого события, ISO-8601"},
+    "location": {"type": "string", "description": "Место искомого события"},
+    "attendee": {"type": "string", "description": "Участник искомого события"},
+    "range_days": {"type": "integer", "description": "Сколько дней вперёд искать (по умолчанию 14)"},
+}
+
+CAL_TOOLS: List[Dict[str, Any]] = [
+    {"type": "function", "function": {
+        "name": "list_events",
+        "description": "Показать события календаря за период.",
+        "parameters": {"type": "object", "properties": {
+            "start": {"type": "string", "description": "Начало периода, ISO-8601"},
+            "end": {"type": "string", "description": "Конец периода, ISO-8601"},
+        }},
+    }},
+    {"type": "function", "function": {
+        "name": "create_event",
+        "description": "Создать запись/событие в календаре.",
+        "parameters": {"type": "object", "properties": {
+            "summary": {"type": "string"},
+            "start": {"type": "string", "description": "ISO-8601"},
+            "end": {"type": "string", "description": "ISO-8601"},
+            "location": {"type": "string"},
+            "description": {"type": "string"},
+        }, "required": ["summary", "start", "end"]},
+    }},
+    {"type": "function", "function": {
+        "name": "update_event",
+        "description": "Изменить существующее событие: найти по признакам и применить изменения.",
+        "parameters": {"type": "object", "properties": {
+            **_MATCH_PROPS,
+            "new_start": {"type": "string", "description": "Новое начало, ISO-8601"},
+            "new_end": {"type": "string", "description": "Новый конец, ISO-8601"},
+            "shift_minutes": {"type": "integer", "description": "Сдвиг во времени в минутах"},
+            "new_summary": {"type": "string"},
+            "new_location": {"type": "string"},
+            "new_description": {"type": "string"},
+        }},
+    }},
+    {"type": "function", "function": {
+        "name": "delete_event",
+        "description": "Удалить существующее событие, найденное по признакам.",
+        "parameters": {"type": "object", "properties": dict(_MATCH_PROPS)},
+    }},
+]
+
+_TOOL_ACTIONS = {
+    "list_events": "list",
+    "create_event": "create",
+    "update_event": "update",
+    "delete_event": "delete",
+}
+
+_PATCH_ARGS = {
+    "new_start": "start",
+    "new_end": "end",
+    "shift_minutes": "shift_minutes",
+    "new_summary": "summary",
+    "new_location": "location",
+    "new_description": "description",
+}
+
+
+def plan_from_tool_call(name: str, args: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Переводит вызов инструмента в тот же plan-словарь, что и текстовый <calendar_plan>."""
+    action = _TOOL_ACTIONS.get(name)
+    if action is None:
+        return None
+    if action == "list":
+        return {"action": "list", "range": {"start": args.get("start"), "end": args.get("end")}}
+    if action == "create":
+        keys = ("summary", "start", "end", "location", "description")
+        return {"action": "create", "needs_confirmation": True, "event": {k: args.get(k) for k in keys}}
+    plan: Dict[str, Any] = {
+        "action": action,
+        "needs_confirmation": True,
+        "match": {k: args[k] for k in _MATCH_PROPS if args.get(k) is not None},
+    }
+    if action == "update":
+        plan["patch"] = {dst: args[src] for src, dst in _PATCH_ARGS.items() if args.get(src) is not None}
+    return plan
+
+
+@lru_cache(maxsize=64)
+def _render_template(template: str, tz_name: str, now_minute: str) -> str:
+    # с точностью до минуты — одна и та же строка для всех ботов и стабильный хэш system-промпта
+    return template.format(now=now_minute, tz=tz_name)
+
 
 @dataclass
 class PendingCalendar:
@@ -18,8 +177,26 @@ class PendingCalendar:
     uid: int
     cal_id: str
     chat_id: int
-    expires_at: datetime
-    candidates: Optional[List[Dict[str, Any]]] = None
+    candidates: Optional[List[Dict[str, Any]]] = field(default=None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "plan": self.plan,
+            "uid": self.uid,
+            "cal_id": self.cal_id,
+            "chat_id": self.chat_id,
+            "candidates": self.candidates,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "PendingCalendar":
+        return cls(
+            plan=d.get("plan") or {},
+            uid=int(d["uid"]),
+            cal_id=d.get("cal_id") or "primary",
+            chat_id=int(d["chat_id"]),
+            candidates=d.get("candidates"),
+        )
 
 
 class CalendarFlow:
@@ -27,65 +204,81 @@ class CalendarFlow:
         self,
         *,
         default_tz,
+        pending,  # PendingStore: put/get/update/pop
         parse_range_ru: Callable,
         fmt_events: Callable,
-        reply: Callable,  # ваш reply(message, ...)
-        get_user_timezone_oauth: Callable,
+        reply: Callable,  # reply(message, ...) с учётом business-чатов
+        get_timezone: Callable,
+        is_connected: Callable,  # async (uid) -> bool: подключён ли Google Calendar
+        looks_calendar: Callable,  # (text) -> bool: быстрый локальный классификатор
         list_events_between_oauth: Callable,
         create_event_oauth: Callable,
         update_event_oauth: Callable,
         delete_event_oauth: Callable,
+        use_tools: bool = CAL_USE_TOOLS,
     ):
         self.default_tz = default_tz
+        self.pending = pending
         self.parse_range_ru = parse_range_ru
         self.fmt_events = fmt_events
         self.reply = reply
 
-        self.get_user_timezone_oauth = get_user_timezone_oauth
+        self.get_timezone = get_timezone
+        self.is_connected = is_connected
+        self.looks_calendar = looks_calendar
         self.list_events_between_oauth = list_events_between_oauth
         self.create_event_oauth = create_event_oauth
         self.update_event_oauth = update_event_oauth
         self.delete_event_oauth = delete_event_oauth
+        self.use_tools = use_tools
 
-        self.pending: Dict[str, PendingCalendar] = {}
-
-        self._plan_re = re.compile(r"<calendar_plan>\s*(\{.*?\})\s*</calendar_plan>", re.S)
-
-        self.CAL_PLAN_SYSTEM_TEMPLATE = (
-            "Дополнение: ты должен определить, требуется ли действие с Google Calendar.\n"
-            "В конце ответа ОБЯЗАТЕЛЬНО добавь блок:\n\n"
-            "<calendar_plan>{JSON}</calendar_plan>\n\n"
-            "JSON строго валидный (без комментариев). Схема:\n"
-            "{\n"
-            '  "action": "none" | "list" | "create" | "update" | "delete",\n'
-            '  "needs_confirmation": true|false,\n'
-            '  "missing_fields": [строки],\n'
-            '  "range": {"start": "...", "end": "..."},\n'
-            '  "event": {"summary": "...", "start": "...", "end": "...", "location": null, "description": null},\n'
-            '  "match": {"strategy": "nearest", "range_days": 14, "query": "токены|поиска"},\n'
-            '  "patch": {"start": "...", "end": "...", "shift_minutes": 60, "summary": "...", "location": "...", "description": "..."}\n'
-            "}\n\n"
-            "Правила:\n"
-            "- Если пользователь не просит показать/создать/перенести/удалить запись — action=\"none\".\n"
-            "- Для create/update/delete: needs_confirmation=true.\n"
-            "- Времена указывай ISO-8601 с таймзоной {tz}. Сейчас: {now}.\n"
-            "- Если пользователь говорит \"на час позже/раньше\" — используй patch.shift_minutes (60 или -60).\n"
-            "- Если не хватает данных — заполни missing_fields и НЕ выдумывай.\n"
-        )
+    @property
+    def tools(self) -> Optional[List[Dict[str, Any]]]:
+        return CAL_TOOLS if self.use_tools else None
+
+    async def should_plan(self, uid: int, text: str, history: Optional[List[Tuple[str, str]]] = None) -> bool:
+        """
+        Гейт перед LLM: добавлять ли календарные инструкции в промпт.
+        Сообщение должно походить на календарный запрос, а у владельца должен быть подключён Calendar.
+        Короткое уточнение (не длиннее CAL_FOLLOWUP_MAX_WORDS слов) наследует календарность реплики
+        пользователя из непосредственно предыдущего обмена — для ответов вроде «давай в 15».
+        """
+        if not self.looks_calendar(text):
+            if len((text or "").split()) > CAL_FOLLOWUP_MAX_WORDS:
+                return False
+            last_user = next((msg for role, msg in reversed((history or [])[-2:]) if role == "user"), "")
+            if not self.looks_calendar(last_user):
+                return False
+        return bool(await self.is_connected(uid))
 
     def build_extra_system(self) -> str:
-        now = datetime.now(self.default_tz).isoformat()
-        return self.CAL_PLAN_SYSTEM_TEMPLATE.format(now=now, tz=str(self.default_tz))
+        now = datetime.now(self.default_tz).replace(second=0, microsecond=0).isoformat()
+        template = CAL_TOOLS_SYSTEM_TEMPLATE if self.use_tools else CAL_PLAN_SYSTEM_TEMPLATE
+        return _render_template(template, str(self.default_tz), now)
 
-    def extract_plan(self, raw: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    def parse_reply(self, reply: Any) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        (текст ответа, plan) из ответа LLM: сначала структурированные tool_calls,
+        иначе — текстовый блок <calendar_plan> (режим без инструментов).
+        """
+        text = str(reply or "")
+        for call in getattr(reply, "tool_calls", None) or []:
+            plan = plan_from_tool_call(call.name, call.arguments)
+            if plan is not None:
+                return text.strip(), plan
+        return self.extract_plan(text)
+
+    @staticmethod
+    def extract_plan(raw: str) -> Tuple[str, Optional[Dict[str, Any]]]:
         txt = str(raw or "")
-        matches = list(self._plan_re.finditer(txt))
+        if "<calendar_plan>" not in txt:
+            return txt.strip(), None
+        matches = list(PLAN_RE.finditer(txt))
         if not matches:
             return txt.strip(), None
-        m = matches[-1]
-        plan_raw = m.group(1)
+        m = matches[-1]  # берём последний блок
         try:
-            plan = json.loads(plan_raw)
+            plan = json.loads(m.group(1))
         except Exception:
             plan = None
         cleaned = (txt[:m.start()] + txt[m.end():]).strip()
@@ -118,6 +311,7 @@ class CalendarFlow:
         e_iso = e.get("dateTime") or e.get("date")
         start = self.parse_iso(s_iso) if s_iso else None
         end = self.parse_iso(e_iso) if e_iso else None
+        # all-day date -> трактуем как 00:00
         if start and start.tzinfo is None:
             start = start.replace(tzinfo=tz)
         if end and end.tzinfo is None:
@@ -149,58 +343,135 @@ class CalendarFlow:
         """
         assistant_text = bot_reply or ""
 
-        if not (isinstance(plan, dict) and plan.get("action") in {"list", "create", "update", "delete"}):
+        if not (isinstance(plan, dict) and plan.get("action") in CAL_ACTIONS):
             return False, assistant_text
 
         action = plan.get("action")
 
         if action == "list":
-            try:
-                try:
-                    tz = await self.get_user_timezone_oauth(uid)
-                except Exception:
-                    tz = self.default_tz
+            tz = await self.get_timezone(uid)
 
-                r = plan.get("range") or {}
-                start = self.parse_iso(r.get("start")) if isinstance(r, dict) else None
-                end = self.parse_iso(r.get("end")) if isinstance(r, dict) else None
-                if not start or not end:
-                    start, end, _ = self.parse_range_ru(text, tz)
+            r = plan.get("range") or {}
+            start = self.parse_iso(r.get("start")) if isinstance(r, dict) else None
+            end = self.parse_iso(r.get("end")) if isinstance(r, dict) else None
+            if not start or not end:
+                start, end, _ = self.parse_range_ru(text, tz)
 
+            try:
                 events = await self.list_events_between_oauth(uid, cal_id, start, end)
-                out = self.fmt_events(events)
-                msg = (bot_reply + "\n\n" if bot_reply else "") + out
-                await self.reply(message, msg, disable_web_page_preview=True)
-                return True, msg
             except Exception:
-                msg = "⚠️ Не удалось обратиться к Календарю. Проверьте подключение Google и права Calendar."
-                await self.reply(message, msg, disable_web_page_preview=True)
-                return True, msg
+                await self.reply(message, "⚠️ Не удалось обратиться к Календарю. Проверьте подключение Google и права Calendar.")
+                return True, "⚠️ Не удалось обратиться к Календарю."
+            msg = (bot_reply + "\n\n" if bot_reply else "") + self.fmt_events(events)
+            await self.reply(message, msg, disable_web_page_preview=True)
+            return True, msg
 
         # create/update/delete -> confirm
         token = secrets.token_urlsafe(8)
-        self.pending[token] = PendingCalendar(
+        await self.pending.put(token, PendingCalendar(
             plan=plan,
             uid=uid,
             cal_id=cal_id,
             chat_id=message.chat.id,
-            expires_at=datetime.now(timezone.utc) + timedelta(minutes=15),
-        )
-        prompt = (bot_reply or "").strip() or "Подтвердите действие с календарём."
+        ).to_dict())
+        prompt = (bot_reply or "").strip() or self._describe_plan(plan)
         await self.reply(message, prompt, reply_markup=self.kbd_confirm(token), disable_web_page_preview=True)
         return True, prompt
 
-    async def handle_callback(self, callback: types.CallbackQuery) -> None:
+    @staticmethod
+    def _describe_plan(plan: Dict[str, Any]) -> str:
+        """Текст подтверждения, если модель вызвала инструмент без сопроводительного текста."""
+        action = plan.get("action")
+        if action == "create":
+            ev = plan.get("event") or {}
+            title = html.escape(ev.get("summary") or "Без названия")
+            return f"Создать запись «{title}» ({ev.get('start') or '?'} — {ev.get('end') or '?'})?"
+        what = html.escape((plan.get("match") or {}).get("query") or "событие")
+        if action == "update":
+            return f"Изменить «{what}»?"
+        if action == "delete":
+            return f"Удалить «{what}»?"
+        return "Подтвердите действие с календарём."
+
+    async def _apply_to_event(self, callback: types.CallbackQuery, token: str, item: PendingCalendar, chosen: Dict[str, Any]) -> None:
+        """Выполняет update/delete над выбранным событием и отвечает в чат."""
+        uid = item.uid
+        cal_id = item.cal_id
+        act = item.plan.get("action")
+        event_id = chosen.get("id")
+
+        tz = await self.get_timezone(uid)
+
+        if act == "delete":
+            ok = await self.delete_event_oauth(uid, event_id=event_id, calendar_id=cal_id)
+            await self.pending.pop(token)
+            invalidate_event_index(uid, cal_id)
+            await callback.message.answer("✅ Событие удалено." if ok else "⚠️ Не удалось удалить событие.")
+            await callback.answer()
+            return
+
+        if act == "update":
+            patch = item.plan.get("patch") or {}
+            patch_body: Dict[str, Any] = {}
+
+            # 1) shift_minutes (универсально для "на час позже")
+            shift = patch.get("shift_minutes")
+            if isinstance(shift, (int, float)):
+                old_s, old_e = self._event_bounds(chosen, tz)
+                if old_s and old_e and old_e > old_s:
+                    new_s = old_s + timedelta(minutes=float(shift))
+                    new_e = old_e + timedelta(minutes=float(shift))
+                    patch_body["start"] = {"dateTime": new_s.isoformat(), "timeZone": tz.key}
+                    patch_body["end"] = {"dateTime": new_e.isoformat(), "timeZone": tz.key}
+
+            # 2) абсолютные start/end (если заданы)
+            new_start = self.parse_iso(patch.get("start")) if patch.get("start") else None
+            new_end = self.parse_iso(patch.get("end")) if patch.get("end") else None
+            if new_start:
+                old_s, old_e = self._event_bounds(chosen, tz)
+                if new_end is None and old_s and old_e and old_e > old_s:
+                    new_end = new_start + (old_e - old_s)
+                if new_end:
+                    patch_body["start"] = {"dateTime": new_start.isoformat(), "timeZone": tz.key}
+                    patch_body["end"] = {"dateTime": new_end.isoformat(), "timeZone": tz.key}
+
+            for k in ("summary", "location", "description"):
+                if k in patch and patch[k] is not None:
+                    patch_body[k] = patch[k]
+
+            if not patch_body:
+                await self.pending.pop(token)
+                await callback.message.answer("Не вижу, что именно менять. Уточните новые детали.")
+                await callback.answer()
+                return
+
+            updated = await self.update_event_oauth(uid, event_id=event_id, patch=patch_body, calendar_id=cal_id)
+            await self.pending.pop(token)
+            invalidate_event_index(uid, cal_id)
+            link = updated.get("htmlLink")
+            msg = "✅ Событие обновлено."
+            if link:
+                msg += f"\n{link}"
+            await callback.message.answer(msg, disable_web_page_preview=True)
+            await callback.answer()
+            return
+
+        await callback.answer()
+
+    async def handle_callback(self, callback: types.CallbackQuery, *, owner_id: int) -> None:
         data = callback.data or ""
         parts = data.split(":")
         if len(parts) < 3:
             await callback.answer()
             return
 
-        op = parts[1]
+        op = parts[1]  # ok/no/pick
         token = parts[2]
-        item = self.pending.get(token)
-        if not item:
+
+        raw = await self.pending.get(token)
+        item = PendingCalendar.from_dict(raw) if raw else None
+        # хранилище общее для всех ботов — чужие токены считаем несуществующими
+        if item is None or item.uid != int(owner_id):
             await callback.answer("Операция устарела", show_alert=True)
             return
 
@@ -208,13 +479,8 @@ class CalendarFlow:
             await callback.answer("Недоступно в этом чате", show_alert=True)
             return
 
-        if datetime.now(timezone.utc) > item.expires_at:
-            self.pending.pop(token, None)
-            await callback.answer("Истекло время подтверждения", show_alert=True)
-            return
-
         if op == "no":
-            self.pending.pop(token, None)
+            await self.pending.pop(token)
             if callback.message:
                 await callback.message.answer("Ок, отменено.")
             await callback.answer()
@@ -225,83 +491,27 @@ class CalendarFlow:
         plan = item.plan
         act = plan.get("action")
 
-        # pick
+        # pick: пользователь выбирает одно событие из кандидатов
         if op == "pick" and len(parts) == 4:
             idx = int(parts[3])
             cands = item.candidates or []
             if idx < 0 or idx >= len(cands):
                 await callback.answer("Неверный выбор", show_alert=True)
                 return
-            chosen = cands[idx]
-            event_id = chosen.get("id")
-
-            try:
-                tz = await self.get_user_timezone_oauth(uid)
-            except Exception:
-                tz = self.default_tz
-
-            if act == "delete":
-                ok = await self.delete_event_oauth(uid, event_id=event_id, calendar_id=cal_id)
-                self.pending.pop(token, None)
-                await callback.message.answer("✅ Событие удалено." if ok else "⚠️ Не удалось удалить событие.")
-                await callback.answer()
-                return
-
-            if act == "update":
-                patch = plan.get("patch") or {}
-                patch_body: Dict[str, Any] = {}
-
-                shift = patch.get("shift_minutes")
-                if isinstance(shift, (int, float)):
-                    old_s, old_e = self._event_bounds(chosen, tz)
-                    if old_s and old_e and old_e > old_s:
-                        new_s = old_s + timedelta(minutes=float(shift))
-                        new_e = old_e + timedelta(minutes=float(shift))
-                        patch_body["start"] = {"dateTime": new_s.isoformat(), "timeZone": tz.key}
-                        patch_body["end"] = {"dateTime": new_e.isoformat(), "timeZone": tz.key}
-
-                new_start = self.parse_iso(patch.get("start")) if patch.get("start") else None
-                new_end = self.parse_iso(patch.get("end")) if patch.get("end") else None
-                if new_start:
-                    old_s, old_e = self._event_bounds(chosen, tz)
-                    if new_end is None and old_s and old_e and old_e > old_s:
-                        new_end = new_start + (old_e - old_s)
-                    if new_end:
-                        patch_body["start"] = {"dateTime": new_start.isoformat(), "timeZone": tz.key}
-                        patch_body["end"] = {"dateTime": new_end.isoformat(), "timeZone": tz.key}
-
-                for k in ("summary", "location", "description"):
-                    if k in patch and patch[k] is not None:
-                        patch_body[k] = patch[k]
-
-                if not patch_body:
-                    self.pending.pop(token, None)
-                    await callback.message.answer("Не вижу, что именно менять. Уточните новые детали.")
-                    await callback.answer()
-                    return
-
-                updated = await self.update_event_oauth(uid, event_id=event_id, patch=patch_body, calendar_id=cal_id)
-                self.pending.pop(token, None)
-                link = updated.get("htmlLink")
-                msg = "✅ Событие обновлено."
-                if link:
-                    msg += f"\n{link}"
-                await callback.message.answer(msg, disable_web_page_preview=True)
-                await callback.answer()
-                return
-
-            await callback.answer()
+            await self._apply_to_event(callback, token, item, cands[idx])
             return
 
-        # ok
+        # ok: подтверждение операции
         if op == "ok":
+            # CREATE
             if act == "create":
                 ev = plan.get("event") or {}
                 summary = (ev.get("summary") or "").strip()
                 start = self.parse_iso(ev.get("start"))
                 end = self.parse_iso(ev.get("end"))
+
                 if not summary or not start or not end:
-                    self.pending.pop(token, None)
+                    await self.pending.pop(token)
                     await callback.message.answer("Не хватает данных для записи. Уточните дату/время/услугу.")
                     await callback.answer()
                     return
@@ -315,7 +525,8 @@ class CalendarFlow:
                     description=ev.get("description"),
                     location=ev.get("location"),
                 )
-                self.pending.pop(token, None)
+                await self.pending.pop(token)
+                invalidate_event_index(uid, cal_id)
                 link = created.get("htmlLink")
                 msg = "✅ Запись создана."
                 if link:
@@ -324,42 +535,34 @@ class CalendarFlow:
                 await callback.answer()
                 return
 
+            # UPDATE/DELETE -> ранжируем кандидатов; если лидер однозначен — применяем сразу
             if act in {"update", "delete"}:
-                try:
-                    tz = await self.get_user_timezone_oauth(uid)
-                except Exception:
-                    tz = self.default_tz
-
+                tz = await self.get_timezone(uid)
                 match = plan.get("match") or {}
                 range_days = int(match.get("range_days") or 14)
-                q = str(match.get("query") or "").lower().strip()
-                tokens = [t for t in re.split(r"[|,\s]+", q) if t]
-
-                start = datetime.now(tz)
-                end = start + timedelta(days=range_days)
-                events = await self.list_events_between_oauth(uid, cal_id, start, end)
 
-                def _fits(ev: Dict[str, Any]) -> bool:
-                    if not tokens:
-                        return True
-                    title = (ev.get("summary") or "").lower()
-                    return any(t in title for t in tokens)
+                index = await get_event_index(uid, cal_id, tz, range_days, self.list_events_between_oauth)
+                query = MatchQuery.from_plan(plan, tz)
+                ranked = rank_events(index, query, limit=5)
 
-                cands = [ev for ev in (events or []) if _fits(ev)]
-                cands.sort(key=lambda ev: self._event_bounds(ev, tz)[0] or datetime.max.replace(tzinfo=timezone.utc))
-                cands = cands[:5]
-
-                if not cands:
-                    self.pending.pop(token, None)
+                if not ranked:
+                    await self.pending.pop(token)
                     await callback.message.answer("Не нашёл подходящее событие. Уточните дату/время/название.")
                     await callback.answer()
                     return
 
-                item.candidates = cands
-                self.pending[token] = item
+                chosen = confident_choice(ranked, query)
+                if chosen is not None:
+                    title = chosen.get("summary") or "Без названия"
+                    await callback.message.answer(f"Нашёл событие «{title}», применяю…", disable_web_page_preview=True)
+                    await self._apply_to_event(callback, token, item, chosen)
+                    return
+
+                item.candidates = [ev for _, ev in ranked]
+                await self.pending.update(token, item.to_dict())
                 await callback.message.answer(
-                    "Какое событие выбрать?\n\n" + self._format_candidates(cands),
-                    reply_markup=self.kbd_pick(token, len(cands)),
+                    "Какое событие выбрать?\n\n" + self._format_candidates(item.candidates),
+                    reply_markup=self.kbd_pick(token, len(item.candidates)),
                     disable_web_page_preview=True,
                 )
                 await callback.answer()
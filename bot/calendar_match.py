@@ -0,0 +1,459 @@
+# bot/calendar_match.py
+"""
+Подбор событий календаря для update/delete.
+
+- нормализация русской морфологии (облегчённый Snowball-стеммер, без внешних зависимостей);
+- инвертированный индекс по событиям владельца (название/место/участники/описание);
+- ранжирование: пересечение токенов (с весом IDF) + близость ко времени из плана
+  + совпадение места/участника.
+
+Индекс строится один раз на окно событий и кэшируется на короткое время,
+поэтому повторные поиски по тому же календарю не ходят в Google и укладываются в доли миллисекунды.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import os
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from cachetools import TTLCache
+
+# ---------------- Стемминг ----------------
+
+_VOWELS = "аеиоуыэюя"
+_SPLIT_RE = re.compile(r"[^a-zа-я0-9]+")
+
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")            # после а/я
+_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому",
+    "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")            # после а/я
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_1 = (                                               # после а/я
+    "ете", "йте", "ешь", "нно",
+    "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть",
+    "й", "л", "н",
+)
+_VERB_2 = (
+    "ейте", "уйте",
+    "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют",
+    "ены", "ить", "ыть", "ишь",
+    "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую",
+    "ю",
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях",
+    "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой", "ий", "ям", "ем", "ам", "ом", "ах", "ях",
+    "ию", "ью", "ия", "ья",
+    "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _by_len(suffixes: Tuple[str, ...]) -> Tuple[str, ...]:
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND_1 = _by_len(_PERFECTIVE_GERUND_1)
+_PERFECTIVE_GERUND_2 = _by_len(_PERFECTIVE_GERUND_2)
+_ADJECTIVE = _by_len(_ADJECTIVE)
+_PARTICIPLE_1 = _by_len(_PARTICIPLE_1)
+_PARTICIPLE_2 = _by_len(_PARTICIPLE_2)
+_VERB_1 = _by_len(_VERB_1)
+_VERB_2 = _by_len(_VERB_2)
+_NOUN = _by_len(_NOUN)
+
+
+def _regions(word: str) -> Tuple[int, int]:
+    """Позиции начала RV и R2 (по Snowball)."""
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+
+    def _next_r(start: int) -> int:
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = _next_r(0)
+    r2 = _next_r(r1)
+    return rv, r2
+
+
+def _strip(rv: str, group1: Tuple[str, ...], group2: Tuple[str, ...] = ()) -> Optional[str]:
+    """Срезает самое длинное окончание. group1 — только после «а»/«я»."""
+    best: Optional[str] = None
+    for suf in group2:
+        if rv.endswith(suf):
+            best = rv[: -len(suf)]
+            break
+    for suf in group1:
+        if rv.endswith(suf) and len(rv) > len(suf) and rv[-len(suf) - 1] in "ая":
+            cand = rv[: -len(suf)]
+            if best is None or len(cand) < len(best):
+                best = cand
+            break
+    return best
+
+
+@lru_cache(maxsize=50_000)
+def stem_ru(word: str) -> str:
+    """Облегчённый Snowball-стеммер для русского. Латиницу/цифры возвращает как есть."""
+    word = (word or "").lower().replace("ё", "е")
+    if len(word) < 3 or not any("а" <= ch <= "я" for ch in word):
+        return word
+
+    rv_pos, r2_pos = _regions(word)
+    head, rv = word[:rv_pos], word[rv_pos:]
+
+    # Шаг 1
+    cut = _strip(rv, _PERFECTIVE_GERUND_1, _PERFECTIVE_GERUND_2)
+    if cut is not None:
+        rv = cut
+    else:
+        for suf in _REFLEXIVE:
+            if rv.endswith(suf):
+                rv = rv[: -len(suf)]
+                break
+        cut = _strip(rv, (), _ADJECTIVE)
+        if cut is not None:
+            rv = cut
+            part = _strip(rv, _PARTICIPLE_1, _PARTICIPLE_2)
+            if part is not None:
+                rv = part
+        else:
+            cut = _strip(rv, _VERB_1, _VERB_2)
+            if cut is None:
+                cut = _strip(rv, (), _NOUN)
+            if cut is not None:
+                rv = cut
+
+    # Шаг 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные окончания в R2
+    r2_in_rv = max(0, r2_pos - rv_pos)
+    for suf in _DERIVATIONAL:
+        if rv.endswith(suf) and len(rv) - len(suf) >= r2_in_rv:
+            rv = rv[: -len(suf)]
+            break
+
+    # Шаг 4
+    for suf in _SUPERLATIVE:
+        if rv.endswith(suf):
+            rv = rv[: -len(suf)]
+            break
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    elif rv.endswith("ь"):
+        rv = rv[:-1]
+
+    return head + rv
+
+
+_STOPWORDS = frozenset((
+    "в", "во", "на", "с", "со", "к", "ко", "по", "у", "о", "об", "от", "за", "до", "для", "из", "и", "или",
+    "а", "но", "не", "же", "ли", "бы", "то", "это", "мой", "моя", "мое", "мою", "мне", "меня",
+    "the", "a", "an", "of", "in", "on", "at", "to", "and", "or", "with",
+))
+
+
+def tokenize(text: str) -> List[str]:
+    """Текст → список стемов без стоп-слов."""
+    out: List[str] = []
+    for raw in _SPLIT_RE.split((text or "").lower().replace("ё", "е")):
+        if not raw or raw in _STOPWORDS:
+            continue
+        if len(raw) < 2 and not raw.isdigit():
+            continue
+        out.append(stem_ru(raw))
+    return out
+
+
+# ---------------- Индекс ----------------
+
+# веса полей события
+_W_SUMMARY = 1.0
+_W_LOCATION = 0.6
+_W_ATTENDEE = 0.8
+_W_DESCRIPTION = 0.3
+
+_PREFIX_MIN = 3
+_PREFIX_WEIGHT = 0.7
+
+
+def _parse_iso(s: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat((s or "").replace("Z", "+00:00"))
+    except Exception:
+        return None
+
+
+def _event_start(ev: Dict[str, Any], tz) -> Optional[datetime]:
+    s = ev.get("start") or {}
+    if isinstance(s, str):
+        dt = _parse_iso(s)
+    else:
+        dt = _parse_iso(s.get("dateTime") or s.get("date"))
+    if dt is not None and dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz)
+    return dt
+
+
+def _attendee_text(ev: Dict[str, Any]) -> str:
+    parts: List[str] = []
+    for a in ev.get("attendees") or []:
+        if not isinstance(a, dict):
+            continue
+        parts.append(a.get("displayName") or "")
+        email = a.get("email") or ""
+        parts.append(email.split("@", 1)[0])
+    return " ".join(parts)
+
+
+@dataclass
+class EventIndex:
+    """Инвертированный индекс по событиям одного окна календаря."""
+    events: List[Dict[str, Any]]
+    start_ts: List[float] = field(default_factory=list)      # POSIX-время начала (inf — неизвестно)
+    postings: Dict[str, Dict[int, float]] = field(default_factory=dict)
+    location_postings: Dict[str, Set[int]] = field(default_factory=dict)
+    attendee_postings: Dict[str, Set[int]] = field(default_factory=dict)
+    keys: List[str] = field(default_factory=list)
+
+    @classmethod
+    def build(cls, events: List[Dict[str, Any]], tz) -> "EventIndex":
+        idx = cls(events=list(events or []))
+        for i, ev in enumerate(idx.events):
+            st = _event_start(ev, tz)
+            idx.start_ts.append(st.timestamp() if st is not None else math.inf)
+            loc = tokenize(ev.get("location") or "")
+            att = tokenize(_attendee_text(ev))
+            for t in loc:
+                idx.location_postings.setdefault(t, set()).add(i)
+            for t in att:
+                idx.attendee_postings.setdefault(t, set()).add(i)
+            for terms, w in (
+                (tokenize(ev.get("summary") or ""), _W_SUMMARY),
+                (loc, _W_LOCATION),
+                (att, _W_ATTENDEE),
+                (tokenize(ev.get("description") or ""), _W_DESCRIPTION),
+            ):
+                for t in terms:
+                    doc = idx.postings.setdefault(t, {})
+                    if doc.get(i, 0.0) < w:
+                        doc[i] = w
+        idx.keys = sorted(idx.postings)
+        return idx
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings.get(term) or ())
+        return math.log(1.0 + len(self.events) / (1.0 + df))
+
+    def _expand(self, q: str) -> List[Tuple[str, float]]:
+        """Точное совпадение стема + префиксные (опечатки/незнакомые формы)."""
+        out: List[Tuple[str, float]] = []
+        if q in self.postings:
+            out.append((q, 1.0))
+        if len(q) < _PREFIX_MIN:
+            return out
+        # индексные термы, начинающиеся с q
+        pos = bisect_left(self.keys, q)
+        while pos < len(self.keys) and self.keys[pos].startswith(q):
+            k = self.keys[pos]
+            if k != q:
+                out.append((k, _PREFIX_WEIGHT))
+            pos += 1
+        # q начинается с индексного терма
+        for n in range(len(q) - 1, _PREFIX_MIN - 1, -1):
+            k = q[:n]
+            if k in self.postings:
+                out.append((k, _PREFIX_WEIGHT))
+                break
+        return out
+
+    def text_scores(self, query_terms: List[str]) -> Dict[int, float]:
+        """{event_idx: 0..1} — доля «веса» запроса, найденная в событии."""
+        total = 0.0
+        acc: Dict[int, float] = {}
+        for q in dict.fromkeys(query_terms):
+            idf_q = self._idf(q) if q in self.postings else math.log(1.0 + len(self.events))
+            total += idf_q
+            expanded = self._expand(q)
+            if len(expanded) == 1 and expanded[0][1] == 1.0:
+                best = self.postings[expanded[0][0]]
+            else:
+                best = {}
+                for term, mult in expanded:
+                    for doc, w in self.postings[term].items():
+                        v = w * mult
+                        if v > best.get(doc, 0.0):
+                            best[doc] = v
+            for doc, v in best.items():
+                acc[doc] = acc.get(doc, 0.0) + v * idf_q
+        if total <= 0:
+            return {}
+        inv = 1.0 / total
+        return {doc: v * inv for doc, v in acc.items()}
+
+    def field_hits(self, postings: Dict[str, Set[int]], terms: frozenset) -> Set[int]:
+        hits: Set[int] = set()
+        for t in terms:
+            hits |= postings.get(t, set())
+        return hits
+
+
+# ---------------- Ранжирование ----------------
+
+TIME_SCALE_MIN = 180.0        # «полураспад» временной близости
+CONFIDENT_SCORE = 0.55        # минимальный скор лидера для выбора без вопроса
+CONFIDENT_MARGIN = 0.25       # отрыв лидера от второго места
+
+_W_TEXT_SIGNAL = 0.6
+_W_TIME_SIGNAL = 0.3
+_W_FIELD_SIGNAL = 0.1
+
+
+@dataclass
+class MatchQuery:
+    terms: List[str]
+    around: Optional[datetime] = None
+    location_terms: frozenset = frozenset()
+    attendee_terms: frozenset = frozenset()
+
+    @classmethod
+    def from_plan(cls, plan: Dict[str, Any], tz) -> "MatchQuery":
+        match = plan.get("match") or {}
+        around = _parse_iso(match.get("around")) if match.get("around") else None
+        if around is None and match.get("start"):
+            around = _parse_iso(match.get("start"))
+        if around is not None and around.tzinfo is None:
+            around = around.replace(tzinfo=tz)
+        return cls(
+            terms=tokenize(str(match.get("query") or "")),
+            around=around,
+            location_terms=frozenset(tokenize(str(match.get("location") or ""))),
+            attendee_terms=frozenset(tokenize(str(match.get("attendee") or ""))),
+        )
+
+    @property
+    def is_empty(self) -> bool:
+        """Ни слов, ни времени, ни места/участника — по такому запросу событие сами не выбираем."""
+        return not (self.terms or self.around is not None or self.location_terms or self.attendee_terms)
+
+
+def rank_events(index: EventIndex, query: MatchQuery, limit: int = 5) -> List[Tuple[float, Dict[str, Any]]]:
+    """
+    Возвращает [(score, event)] по убыванию скора (при равенстве — раньше начинающиеся).
+    Если в запросе есть текст/место/участник — в выдачу попадают только события,
+    совпавшие хотя бы по одному из этих признаков.
+    """
+    n = len(index.events)
+    if n == 0:
+        return []
+
+    text = index.text_scores(query.terms) if query.terms else {}
+    loc_hits = index.field_hits(index.location_postings, query.location_terms) if query.location_terms else set()
+    att_hits = index.field_hits(index.attendee_postings, query.attendee_terms) if query.attendee_terms else set()
+
+    if query.terms or query.location_terms or query.attendee_terms:
+        docs = set(text)
+        docs |= loc_hits
+        docs |= att_hits
+    else:
+        docs = range(n)
+
+    wsum = (
+        (_W_TEXT_SIGNAL if query.terms else 0.0)
+        + (_W_TIME_SIGNAL if query.around is not None else 0.0)
+        + (_W_FIELD_SIGNAL if query.location_terms else 0.0)
+        + (_W_FIELD_SIGNAL if query.attendee_terms else 0.0)
+    )
+    inv_wsum = 1.0 / wsum if wsum else 0.0
+    around_ts = query.around.timestamp() if query.around is not None else None
+    time_k = 1.0 / (TIME_SCALE_MIN * 60.0)
+    start_ts = index.start_ts
+    exp = math.exp
+
+    def _score(i: int) -> float:
+        v = _W_TEXT_SIGNAL * text.get(i, 0.0)
+        if around_ts is not None:
+            st = start_ts[i]
+            if st != math.inf:
+                v += _W_TIME_SIGNAL * exp(-abs(st - around_ts) * time_k)
+        if i in loc_hits:
+            v += _W_FIELD_SIGNAL
+        if i in att_hits:
+            v += _W_FIELD_SIGNAL
+        return v * inv_wsum
+
+    top = heapq.nsmallest(limit, ((-_score(i), start_ts[i], i) for i in docs))
+    return [(-neg, index.events[i]) for neg, _, i in top]
+
+
+def confident_choice(ranked: List[Tuple[float, Dict[str, Any]]], query: MatchQuery) -> Optional[Dict[str, Any]]:
+    """
+    Событие-лидер, если выбор однозначен (тогда не нужно спрашивать пользователя).
+    Единственный кандидат тоже должен набрать CONFIDENT_SCORE; по пустому запросу не выбираем никогда —
+    иначе update/delete применится к случайному событию без клавиатуры выбора.
+    """
+    if not ranked or query.is_empty:
+        return None
+    top = ranked[0][0]
+    if top < CONFIDENT_SCORE:
+        return None
+    if len(ranked) == 1 or top - ranked[1][0] >= CONFIDENT_MARGIN:
+        return ranked[0][1]
+    return None
+
+
+# ---------------- Кэш индексов по владельцам ----------------
+
+INDEX_TTL_SEC = int(os.getenv("CAL_INDEX_TTL_SEC", "120"))
+
+_INDEX_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=INDEX_TTL_SEC)
+
+
+async def get_event_index(
+    uid: int,
+    cal_id: str,
+    tz,
+    range_days: int,
+    loader: Callable[[int, str, datetime, datetime], Awaitable[List[Dict[str, Any]]]],
+) -> EventIndex:
+    """
+    Индекс событий владельца на окно [сейчас; сейчас+range_days].
+    loader — list_events_between_oauth(uid, cal_id, start, end).
+    """
+    key = (int(uid), cal_id, int(range_days))
+    idx = _INDEX_CACHE.get(key)
+    if idx is not None:
+        return idx
+    start = datetime.now(tz)
+    end = start + timedelta(days=range_days)
+    events = await loader(uid, cal_id, start, end)
+    idx = EventIndex.build(events or [], tz)
+    _INDEX_CACHE[key] = idx
+    return idx
+
+
+def invalidate_event_index(uid: int, cal_id: Optional[str] = None) -> None:
+    """Сбросить индексы владельца (после create/update/delete)."""
+    for key in [k for k in list(_INDEX_CACHE.keys()) if k[0] == int(uid) and (cal_id is None or k[1] == cal_id)]:
+        _INDEX_CACHE.pop(key, None)
+
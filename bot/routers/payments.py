@@ -9,7 +9,7 @@ from keyboards import (
     r_keyboard_sub, keyboard_return
 )
 
-from bot.services.db import get_subscription_until
+from bot.services.user_profile import UserProfile
 
 CB_CANCEL = "pay_cancel"
 CB_TO_YK = "pay_switch_yk"
@@ -18,12 +18,11 @@ CB_TO_CB = "pay_switch_cb"
 router = Router(name="payments")
 
 @router.callback_query(F.data == "payment")
-async def cq_payment(callback: types.CallbackQuery):
+async def cq_payment(callback: types.CallbackQuery, profile: UserProfile):
     # показать главное меню оплаты / выбор агента
-    res = await get_subscription_until(callback.from_user.id)
-    if res:
+    if profile.subscription_until:
         try:
-            await callback.message.edit_text("Главное меню", reply_markup=keyboard_sub(callback.from_user.id))
+            await callback.message.edit_text("Главное меню", reply_markup=keyboard_sub(callback.from_user.id, profile.bot_state))
         except Exception:
             pass
     else:
@@ -45,15 +44,15 @@ async def cq_yookassa(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "subscribe")
-async def subscribe(callback: types.CallbackQuery):
-    res = await get_subscription_until(callback.from_user.id)
+async def subscribe(callback: types.CallbackQuery, profile: UserProfile):
+    res = profile.subscription_until
     if res:
         # как в твоём main.py: короткое подтверждение + переход в главное меню
         await callback.message.answer(
             text=f"Ваша подписка активна до {res}",
             reply_markup=r_keyboard_sub()
         )
-        await callback.message.edit_text("Главное меню:", reply_markup=keyboard_sub(callback.from_user.id))
+        await callback.message.edit_text("Главное меню:", reply_markup=keyboard_sub(callback.from_user.id, profile.bot_state))
     else:
         await callback.message.edit_text("Главное меню:", reply_markup=keyboard_unsub())
 
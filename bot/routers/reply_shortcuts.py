@@ -8,14 +8,14 @@ from keyboards import (
     keyboard_prompt_controls,
     keyboard_attach_source,
 )
-from bot.services.db import get_user_doc_id
+from bot.services.user_profile import UserProfile
 from deepseek import doc
 
 router = Router(name="reply_shortcuts")
 
 # 1) Вкл/выкл «личного» бота — ТЕПЕРЬ БЕЗ run_bot/stop_bot
 @router.message(F.text.in_(["🤖✅ Бот включен", "🤖❌ Бот выключен"]))
-async def toggle_personal_bot(message: types.Message):
+async def toggle_personal_bot(message: types.Message, profile: UserProfile):
     """
     Раньше здесь запускали/останавливали дочернего бота напрямую,
     из-за чего получались двойные polling'и.
@@ -25,7 +25,7 @@ async def toggle_personal_bot(message: types.Message):
     """
     await message.answer(
         "Управление запуском бота теперь на кнопке в меню ниже 👇",
-        reply_markup=keyboard_sub(message.from_user.id),
+        reply_markup=keyboard_sub(message.from_user.id, profile.bot_state),
     )
 
 
@@ -37,8 +37,8 @@ async def open_settings(message: types.Message):
 
 # 3) Просмотр и редактирование промпта (Docs/Sheets)
 @router.message(F.text == "📝 Просмотр и редактирование промпта")
-async def view_prompt_source(message: types.Message):
-    link = await get_user_doc_id(message.from_user.id)
+async def view_prompt_source(message: types.Message, profile: UserProfile):
+    link = profile.doc_id
     if not link:
         await message.answer(
             "Источник не привязан. Добавьте Документ или Таблицу в настройках.",
@@ -1,14 +1,15 @@
 from __future__ import annotations
 from aiogram import Router, types, F
 from aiogram.filters import Command
+from bot.services.user_profile import UserProfile
 from .helpers import render_settings
 
 router = Router(name="settings.base")
 
 @router.callback_query(F.data == "setting_bot")
-async def setting_bot_cb(callback: types.CallbackQuery):
-    await render_settings(callback, callback.from_user.id)
+async def setting_bot_cb(callback: types.CallbackQuery, profile: UserProfile):
+    await render_settings(callback, profile)
 
 @router.message(Command("settings"))
-async def settings_cmd(message: types.Message):
-    await render_settings(message, message.from_user.id)
+async def settings_cmd(message: types.Message, profile: UserProfile):
+    await render_settings(message, profile)
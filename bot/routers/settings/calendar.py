@@ -6,21 +6,22 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from bot.states import Form
 from keyboards import keyboard_calendar_menu, keyboard_setting_bot
-from providers.google_calendar_oauth_provider import list_calendars_oauth
-from bot.services.db import set_user_calendar_id, get_user_calendar_id, clear_user_calendar_id
+from bot.services.db import set_user_calendar_id, clear_user_calendar_id
+from bot.services.calendar_prefs import get_cached_calendars, invalidate_calendar_prefs
+from bot.services.user_profile import UserProfile
 from .helpers import render_prompt_preview
 
 router = Router(name="settings.calendar")
 
 @router.callback_query(F.data == "calendar_menu")
-async def calendar_menu(callback: types.CallbackQuery):
-    is_linked = bool(await get_user_calendar_id(callback.from_user.id))
+async def calendar_menu(callback: types.CallbackQuery, profile: UserProfile):
+    is_linked = bool(profile.calendar_id)
     await callback.message.edit_text("Настройки календаря:", reply_markup=keyboard_calendar_menu(is_linked))
 
 @router.callback_query(F.data == "change_CAL")
 async def change_calendar(callback: types.CallbackQuery, state: FSMContext):
     try:
-        calendars = await list_calendars_oauth(callback.from_user.id)
+        calendars = await get_cached_calendars(callback.from_user.id)
     except Exception:
         await callback.answer("Не могу получить список календарей.\nПроверь подключение Google (OAuth) и что включён Calendar API.", show_alert=True)
         return
@@ -61,16 +62,18 @@ async def pick_calendar(callback: types.CallbackQuery, state: FSMContext):
     try:
         await set_user_calendar_id(callback.from_user.id, cal_id)
     finally:
+        invalidate_calendar_prefs(callback.from_user.id)
         await state.clear()
 
     await callback.answer("✅ Календарь привязан.", show_alert=False)
     await callback.message.edit_text("Настройка бота:", reply_markup=keyboard_setting_bot())
 
 @router.callback_query(F.data == "cal_unlink")
-async def cal_unlink(callback: types.CallbackQuery):
+async def cal_unlink(callback: types.CallbackQuery, profile: UserProfile):
     ok = await clear_user_calendar_id(callback.from_user.id)
+    invalidate_calendar_prefs(callback.from_user.id)
     if ok:
         await callback.answer("✅ Календарь отвязан.", show_alert=False)
-        await render_prompt_preview(callback, callback.from_user.id)  # перерисуем превью источника
+        await render_prompt_preview(callback, profile)  # перерисуем превью источника
     else:
         await callback.answer("Нечего отвязывать — календарь не привязан.", show_alert=True)
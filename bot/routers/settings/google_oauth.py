@@ -1,6 +1,7 @@
 from __future__ import annotations
 from aiogram import Router, types, F
 from bot.services.google_oauth import delete_refresh_token
+from bot.services.calendar_prefs import invalidate_calendar_prefs
 from .helpers import kb_connect_google
 
 router = Router(name="settings.google")
@@ -15,5 +16,6 @@ async def connect_google(callback: types.CallbackQuery):
 @router.callback_query(F.data == "disconnect_google")
 async def disconnect_google(callback: types.CallbackQuery):
     await delete_refresh_token(callback.from_user.id)
+    invalidate_calendar_prefs(callback.from_user.id)
     await callback.answer("Google отключён.", show_alert=False)
     # Обновлять сам экран можно из base.menu, оставим как есть
@@ -8,7 +8,7 @@ from keyboards import (
     keyboard_setting_bot, keyboard_unsub,
     keyboard_attach_source, keyboard_prompt_controls
 )
-from bot.services.db import get_subscription_until, get_user_doc_id
+from bot.services.user_profile import UserProfile
 from deepseek import doc
 
 BASE_URL = os.getenv("BASE_URL", "https://example.com")
@@ -17,9 +17,9 @@ REQUIRE_GOOGLE = os.getenv("FORCE_GOOGLE_OAUTH", "1") == "1"
 _DOC_RE = re.compile(r"/document/d/([a-zA-Z0-9_-]+)")
 _SHEET_RE = re.compile(r"/spreadsheets/d/([a-zA-Z0-9_-]+)")
 
-async def ensure_active_sub(ctx: types.Message | types.CallbackQuery, uid: int) -> bool:
+async def ensure_active_sub(ctx: types.Message | types.CallbackQuery, profile: UserProfile) -> bool:
     """True если подписка активна, иначе показываем предупреждение и главное меню без подписки."""
-    if await get_subscription_until(uid):
+    if profile.subscription_until:
         return True
     msg = "Подписка не активна. Продлите её через «💰 Оплата»."
     if isinstance(ctx, types.CallbackQuery):
@@ -37,19 +37,20 @@ def kb_connect_google(uid: int) -> InlineKeyboardMarkup:
     kb.adjust(1, 1)
     return kb.as_markup()
 
-async def render_settings(ctx: types.Message | types.CallbackQuery, uid: int) -> None:
-    if not await ensure_active_sub(ctx, uid):
+async def render_settings(ctx: types.Message | types.CallbackQuery, profile: UserProfile) -> None:
+    if not await ensure_active_sub(ctx, profile):
         return
     if isinstance(ctx, types.CallbackQuery):
         await ctx.message.edit_text("Настройка бота:", reply_markup=keyboard_setting_bot())
     else:
         await ctx.answer("Настройка бота:", reply_markup=keyboard_setting_bot())
 
-async def render_prompt_preview(ctx: types.Message | types.CallbackQuery, uid: int) -> None:
-    if not await ensure_active_sub(ctx, uid):
+async def render_prompt_preview(ctx: types.Message | types.CallbackQuery, profile: UserProfile) -> None:
+    if not await ensure_active_sub(ctx, profile):
         return
 
-    link = await get_user_doc_id(uid)
+    uid = profile.user_id
+    link = profile.doc_id
     if not link:
         text = "Источник не привязан. Добавьте Документ или Таблицу:"
         if isinstance(ctx, types.CallbackQuery):
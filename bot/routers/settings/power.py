@@ -4,13 +4,9 @@ import logging
 
 from aiogram import Router, types, F
 from aiogram.filters import Command
-from keyboards import keyboard_sub, keyboard_return, keyboard_unsub, state_bot
-from bot.services.db import (
-    get_subscription_until,
-    update_user_state,
-    get_user_token_and_doc,
-)
-from bot.services.google_oauth import has_google_oauth
+from keyboards import keyboard_sub, keyboard_return
+from bot.services.db import update_user_state
+from bot.services.user_profile import UserProfile
 from .helpers import REQUIRE_GOOGLE, kb_connect_google
 from openrouter import run_bot, stop_user_bots, active_bots
 
@@ -18,22 +14,21 @@ router = Router(name="settings.power")
 
 
 @router.callback_query(F.data == "turn_on_off")
-async def turn_cb(callback: types.CallbackQuery):
+async def turn_cb(callback: types.CallbackQuery, profile: UserProfile):
     uid = callback.from_user.id
-    current = state_bot(uid)
 
     # ► ВКЛЮЧИТЬ
-    if current == "🤖❌ Бот выключен":
+    if profile.bot_state != "active":
         # 1) проверяем подписку
-        if not await get_subscription_until(uid):
+        if not profile.subscription_until:
             await callback.answer(
                 "Подписка не активна. Продлите её через «💰 Оплата».",
                 show_alert=True,
             )
             return
 
-        # 2) проверяем Google OAuth (если обязателен)
-        if REQUIRE_GOOGLE and not await has_google_oauth(uid):
+        # 2) проверяем Google OAuth (если обязателен); протухший токен проявится при первом запросе к Google
+        if REQUIRE_GOOGLE and not profile.google_linked:
             await callback.message.edit_text(
                 "Чтобы включить бота, подключите Google-аккаунт:",
                 reply_markup=kb_connect_google(uid),
@@ -42,7 +37,7 @@ async def turn_cb(callback: types.CallbackQuery):
             return
 
         # 3) токен бота
-        token, word_file = await get_user_token_and_doc(uid)
+        token, word_file = profile.bot_token, profile.word_file
         if not token:
             await callback.message.answer(
                 "Не задан API-токен вашего Telegram-бота.\n"
@@ -58,7 +53,7 @@ async def turn_cb(callback: types.CallbackQuery):
         # 5) запускаем нового
         await callback.answer("Запускаю вашего бота ✅")
         await update_user_state(uid, "active")
-        await callback.message.edit_reply_markup(reply_markup=keyboard_sub(uid))
+        await callback.message.edit_reply_markup(reply_markup=keyboard_sub(uid, "active"))
         try:
             await asyncio.sleep(0)
             await run_bot(token, word_file, uid)
@@ -69,10 +64,10 @@ async def turn_cb(callback: types.CallbackQuery):
             )
 
     # ► ВЫКЛЮЧИТЬ
-    elif current == "🤖✅ Бот включен":
+    else:
         await callback.answer("Останавливаю вашего бота ❌")
         await update_user_state(uid, "stop")
-        await callback.message.edit_reply_markup(reply_markup=keyboard_sub(uid))
+        await callback.message.edit_reply_markup(reply_markup=keyboard_sub(uid, "stop"))
 
         stopped = await stop_user_bots(uid)
         if not stopped:
@@ -81,22 +76,11 @@ async def turn_cb(callback: types.CallbackQuery):
                 uid,
             )
 
-    # ► Неясное состояние — просто перерисуем меню
-    else:
-        await callback.message.edit_reply_markup(
-            reply_markup=keyboard_sub(uid)
-            if await get_subscription_until(uid)
-            else keyboard_unsub()
-        )
-        await callback.answer("Обновил состояние, попробуйте ещё раз.")
-
 
 @router.message(Command("debug_child"))
-async def debug_child(message: types.Message):
-    uid = message.from_user.id
-
-    # 1) достаём из БД токен дочернего бота для этого пользователя
-    token, _ = await get_user_token_and_doc(uid)
+async def debug_child(message: types.Message, profile: UserProfile):
+    # 1) токен дочернего бота этого пользователя (из профиля)
+    token = profile.bot_token
     if not token:
         await message.answer("У тебя не задан API-токен дочернего бота в /settings.")
         return
@@ -5,17 +5,18 @@ from aiogram.fsm.context import FSMContext
 from bot.states import Form
 from keyboards import keyboard_return
 from bot.services.db import update_user_document
+from bot.services.user_profile import UserProfile
 from .helpers import render_prompt_preview
 
 router = Router(name="settings.prompt")
 
 @router.callback_query(F.data == "prompt")
-async def prompt_cb(callback: types.CallbackQuery):
-    await render_prompt_preview(callback, callback.from_user.id)
+async def prompt_cb(callback: types.CallbackQuery, profile: UserProfile):
+    await render_prompt_preview(callback, profile)
 
 @router.message(Command("prompt"))
-async def prompt_cmd(message: types.Message):
-    await render_prompt_preview(message, message.from_user.id)
+async def prompt_cmd(message: types.Message, profile: UserProfile):
+    await render_prompt_preview(message, profile)
 
 @router.callback_query(F.data == "change_DOC")
 async def change_doc(callback: types.CallbackQuery, state: FSMContext):
@@ -2,7 +2,8 @@ from __future__ import annotations
 from aiogram import Router, types, F
 from keyboards import keyboard_confirm_delete_source, keyboard_setting_bot
 from providers.redis_provider import delete_by_pattern
-from bot.services.db import get_user_doc_id, update_user_document
+from bot.services.db import update_user_document
+from bot.services.user_profile import UserProfile
 from .helpers import extract_source_id
 
 router = Router(name="settings.source")
@@ -15,8 +16,8 @@ async def delete_source(callback: types.CallbackQuery):
     )
 
 @router.callback_query(F.data == "confirm_delete_source")
-async def confirm_delete_source(callback: types.CallbackQuery):
-    link = await get_user_doc_id(callback.from_user.id)
+async def confirm_delete_source(callback: types.CallbackQuery, profile: UserProfile):
+    link = profile.doc_id
     src_id = extract_source_id(link)
     if src_id:
         try:
@@ -2,18 +2,18 @@ from __future__ import annotations
 from aiogram import Router, types, F
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
-from bot.services.db import get_subscription_until, has_accepted_terms
+from bot.services.user_profile import UserProfile
 from keyboards import keyboard_sub, keyboard_unsub, keyboard_terms
 from .helpers import terms_text, welcome_text, send_demo_video_if_any
 
 router = Router(name="start.base")
 
 @router.message(CommandStart())
-async def start_cmd(message: types.Message):
+async def start_cmd(message: types.Message, profile: UserProfile):
     uid = message.from_user.id
 
     # сначала — соглашение
-    if not await has_accepted_terms(uid):
+    if not profile.terms_accepted:
         await message.answer(
             text=terms_text(),
             reply_markup=keyboard_terms(),
@@ -23,21 +23,21 @@ async def start_cmd(message: types.Message):
         return
 
     # после принятия — обычный сценарий
-    res = await get_subscription_until(uid)
+    res = profile.subscription_until
     await send_demo_video_if_any(message)
     if res:
-        await message.answer(text="Главное меню:", reply_markup=keyboard_sub(uid))
+        await message.answer(text="Главное меню:", reply_markup=keyboard_sub(uid, profile.bot_state))
     else:
         await message.answer(text=welcome_text(), parse_mode="HTML", disable_web_page_preview=True)
         await message.answer(text="Главное меню:", reply_markup=keyboard_unsub())
 
 @router.callback_query(F.data == "return")
-async def cq_return(callback: types.CallbackQuery, state: FSMContext):
+async def cq_return(callback: types.CallbackQuery, state: FSMContext, profile: UserProfile):
     await state.clear()
     uid = callback.from_user.id
 
     # если соглашение не принято — снова показываем его
-    if not await has_accepted_terms(uid):
+    if not profile.terms_accepted:
         await callback.message.edit_text(
             terms_text(),
             reply_markup=keyboard_terms(),
@@ -47,16 +47,14 @@ async def cq_return(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer()
         return
 
-    res = await get_subscription_until(uid)
-    if res:
-        await callback.message.edit_text("Главное меню:", reply_markup=keyboard_sub(uid))
+    if profile.subscription_until:
+        await callback.message.edit_text("Главное меню:", reply_markup=keyboard_sub(uid, profile.bot_state))
     else:
         await callback.message.edit_text("Главное меню:", reply_markup=keyboard_unsub())
     await callback.answer()
 
 @router.message(F.text.lower().in_(["🧭 главное меню", "главное меню"]))
-async def open_main_menu(message: types.Message):
+async def open_main_menu(message: types.Message, profile: UserProfile):
     uid = message.from_user.id
-    res = await get_subscription_until(uid)
-    kb = keyboard_sub(uid) if res else keyboard_unsub()
+    kb = keyboard_sub(uid, profile.bot_state) if profile.subscription_until else keyboard_unsub()
     await message.answer("Главное меню:", reply_markup=kb)
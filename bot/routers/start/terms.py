@@ -1,6 +1,7 @@
 from __future__ import annotations
 from aiogram import Router, types, F
-from bot.services.db import has_accepted_terms, set_terms_accepted, get_subscription_until
+from bot.services.db import set_terms_accepted
+from bot.services.user_profile import UserProfile
 from keyboards import keyboard_return, keyboard_sub, keyboard_unsub
 from .helpers import  welcome_text, DEMO_VIDEO_FILE_ID
 
@@ -17,9 +18,9 @@ async def cq_terms_decline(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "terms_accept")
-async def cq_terms_accept(callback: types.CallbackQuery):
+async def cq_terms_accept(callback: types.CallbackQuery, profile: UserProfile):
     uid = callback.from_user.id
-    first_time = not await has_accepted_terms(uid)
+    first_time = not profile.terms_accepted
     await set_terms_accepted(uid)
 
     # Видео (если настроено)
@@ -32,9 +33,8 @@ async def cq_terms_accept(callback: types.CallbackQuery):
     if first_time:
         await callback.message.answer("✅ Спасибо! Соглашение принято.")
 
-    res = await get_subscription_until(uid)
-    if res:
-        await callback.message.answer(text="Главное меню:", reply_markup=keyboard_sub(uid))
+    if profile.subscription_until:
+        await callback.message.answer(text="Главное меню:", reply_markup=keyboard_sub(uid, profile.bot_state))
     else:
         await callback.message.answer(text=welcome_text(), disable_web_page_preview=True)
         await callback.message.answer(text="Главное меню:", parse_mode= "HTML", reply_markup=keyboard_unsub())
@@ -5,7 +5,7 @@ from aiogram.fsm.context import FSMContext
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from keyboards import keyboard_sub, keyboard_subscribe, keyboard_change_ai
-from bot.services.db import get_subscription_until
+from bot.services.user_profile import UserProfile
 
 TZ_MOSCOW = ZoneInfo("Europe/Moscow")
 
@@ -38,8 +38,8 @@ def format_sub_until(raw) -> str:
 
 # "⏳ Подписка" (reply-кнопка)
 @router.message(F.text == "⏳ Подписка")
-async def check_sub_message(message: types.Message):
-    sub_until = await get_subscription_until(message.from_user.id)  
+async def check_sub_message(message: types.Message, profile: UserProfile):
+    sub_until = profile.subscription_until
     if sub_until:
         await message.answer(f"Подписка действительна до: {format_sub_until(sub_until)}")
     else:
@@ -47,11 +47,11 @@ async def check_sub_message(message: types.Message):
 
 # "💰 Оплата" (reply-кнопка)
 @router.message(F.text == "💰 Оплата")
-async def mes_payment(message: types.Message):
-    res = await get_subscription_until(message.from_user.id)
+async def mes_payment(message: types.Message, profile: UserProfile):
+    res = profile.subscription_until
     if res:
         # Просто шлём два сообщения пользователю — без chat_id/message_id, aiogram v3 сам подставит
-        await message.answer("Главное меню", reply_markup=keyboard_sub(message.from_user.id))
+        await message.answer("Главное меню", reply_markup=keyboard_sub(message.from_user.id, profile.bot_state))
         await message.answer("Выберите действие в главном меню:", reply_markup=keyboard_subscribe())
     else:
         await message.answer(
@@ -61,8 +61,8 @@ async def mes_payment(message: types.Message):
 
 
 @router.callback_query(F.data == "check_sub")
-async def check_sub_callback(callback: types.CallbackQuery):
-    res = await get_subscription_until(callback.from_user.id)
+async def check_sub_callback(callback: types.CallbackQuery, profile: UserProfile):
+    res = profile.subscription_until
     if res:
         await callback.answer(f"Подписка действительна до: {format_sub_until(res)}")
     else:
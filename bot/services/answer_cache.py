@@ -0,0 +1,241 @@
+# bot/services/answer_cache.py
+"""
+Кэш ответов на FAQ-вопросы, работающий и при наличии истории диалога.
+
+- Кэшируются только вопросы, не зависящие от истории (is_history_independent):
+  такие вопросы отправляются в модель без истории, поэтому ответ годится любому клиенту.
+  Даты/время, «завтра», запись/перенос и речь от первого лица — это уже личный запрос, не FAQ;
+  посреди диалога — только настоящий вопрос («?» или вопросительное слово) хотя бы из двух значимых стемов:
+  «Москва», «Наличными», «Для ребенка 5 лет» — ответы на уточнения бота, без истории они бессмысленны;
+- Ключ: источник знаний (doc) + версия источника (хэш system-промпта) + нормализованный вопрос
+  (стемы без стоп-слов, без порядка слов) — «Сколько стоит доставка?» и «доставка сколько стоит» совпадут.
+  Отрицание сохраняется в ключе: «работаете в воскресенье» и «не работаете в воскресенье» — разные вопросы.
+- Почти-дубликаты («сколько стоит доставка» / «какая стоимость доставки») находит локальный
+  индекс похожести (Jaccard по стемам) внутри процесса; сами ответы лежат в Redis.
+- Статистика по владельцу: hits / misses / saved_tokens (get_cache_stats).
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from cachetools import LRUCache
+
+from bot.calendar_match import tokenize
+from providers.redis_provider import get_redis
+
+ANSWER_CACHE_TTL_SEC = int(os.getenv("ANSWER_CACHE_TTL_SEC", str(24 * 3600)))
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.8"))
+MAX_QUESTION_TERMS = 20
+MAX_ENTRIES_PER_SCOPE = 500
+REDIS_PREFIX = "anscache:"
+
+# отсылки к предыдущим репликам и личные данные — такие вопросы без истории не понять
+_CONTEXT_WORDS = frozenset((
+    "это", "этот", "эта", "эти", "этого", "этой", "этих", "тот", "та", "те", "того", "той", "такой", "такая", "такие",
+    "он", "она", "оно", "они", "его", "ее", "её", "их", "ему", "ей", "им", "него", "нее", "неё", "них",
+    "там", "тогда", "туда", "оттуда", "выше", "ранее", "раньше", "предыдущий", "предыдущая", "прошлый",
+    "первый", "первая", "второй", "вторая", "третий", "последний", "последняя", "вариант", "варианты",
+    "тоже", "также", "еще", "ещё", "да", "нет", "ок", "окей", "хорошо", "давай", "давайте", "согласен",
+    "я", "меня", "мне", "мной", "мой", "моя", "мое", "моё", "мои", "мы", "нас", "нам", "наш", "наша", "зовут",
+    "хочу", "хотим", "хотел", "хотела", "хотелось", "могу", "можем", "буду", "будем", "приду", "придём", "придем",
+    "подойду", "планирую", "собираюсь",
+))
+# отрицание — часть смысла вопроса, в ключе кэша его не теряем (tokenize выкидывает «не» как стоп-слово)
+_NEGATIONS = frozenset(("не", "ни"))
+NEGATION_TERM = "не"
+# с них начинается вопрос; в «значимые» стемы не входят («Сколько стоит?» без предмета — не FAQ)
+_QUESTION_WORDS = frozenset((
+    "что", "чем", "как", "какой", "какая", "какое", "какие", "каких", "каков", "где", "куда", "откуда",
+    "когда", "сколько", "почему", "зачем", "кто", "можно", "ли",
+))
+MIN_CONTENT_TERMS = 2
+_WORD_RE = re.compile(r"[a-zа-яё0-9]+", re.I)
+_DIGITS_RE = re.compile(r"\d{3,}")  # телефоны, номера заказов, суммы — персональный контекст
+
+
+def normalize_question(text: str) -> Tuple[str, ...]:
+    """Стемы без стоп-слов (плюс маркер отрицания), отсортированные и без повторов."""
+    terms = set(tokenize(text))
+    if any(w in _NEGATIONS for w in _WORD_RE.findall((text or "").lower())):
+        terms.add(NEGATION_TERM)
+    return tuple(sorted(terms))
+
+
+def _is_question(s: str, words: List[str]) -> bool:
+    return s.endswith("?") or words[0] in _QUESTION_WORDS or "ли" in words
+
+
+def is_history_independent(text: str, has_history: bool = False) -> bool:
+    """
+    Похож ли вопрос на самостоятельный FAQ, понятный без предыдущих реплик.
+    has_history — у чата уже есть реплики (или summary): тогда нужен явный вопрос с предметом.
+    """
+    s = (text or "").strip().lower()
+    if not s or _DIGITS_RE.search(s):
+        return False
+    words = _WORD_RE.findall(s)
+    if not words or words[0] in ("а", "и", "но") or any(w in _CONTEXT_WORDS for w in words):
+        return False
+    # openrouter/__init__ поднимает воркер -> hashsss -> этот модуль, поэтому импорт при вызове
+    from openrouter.calendar_utils import has_booking_intent, has_date_expression
+
+    # «на завтра в 15», «хочу записаться» — ответ про конкретного клиента и день, общий кэш не годится
+    if has_date_expression(s) or has_booking_intent(s):
+        return False
+    terms = normalize_question(s)
+    if not 1 <= len(terms) <= MAX_QUESTION_TERMS:
+        return False
+    if has_history:
+        content = set(tokenize(" ".join(w for w in words if w not in _QUESTION_WORDS)))
+        return _is_question(s, words) and len(content) >= MIN_CONTENT_TERMS
+    return True
+
+
+@dataclass
+class _Scope:
+    """Локальный индекс похожести для одного (doc, версия источника)."""
+    entries: "OrderedDict[Tuple[str, ...], FrozenSet[str]]"
+    postings: Dict[str, Set[Tuple[str, ...]]]
+
+    def add(self, terms: Tuple[str, ...]) -> None:
+        if terms in self.entries:
+            self.entries.move_to_end(terms)
+            return
+        self.entries[terms] = frozenset(terms)
+        for t in terms:
+            self.postings.setdefault(t, set()).add(terms)
+        while len(self.entries) > MAX_ENTRIES_PER_SCOPE:
+            old, _ = self.entries.popitem(last=False)
+            for t in old:
+                bucket = self.postings.get(t)
+                if bucket is not None:
+                    bucket.discard(old)
+                    if not bucket:
+                        self.postings.pop(t, None)
+
+    def nearest(self, terms: Tuple[str, ...]) -> Optional[Tuple[str, ...]]:
+        q = frozenset(terms)
+        candidates: Set[Tuple[str, ...]] = set()
+        for t in q:
+            candidates |= self.postings.get(t, set())
+        best, best_sim = None, 0.0
+        negated = NEGATION_TERM in q
+        for cand in candidates:
+            other = self.entries[cand]
+            if (NEGATION_TERM in other) != negated:
+                continue
+            sim = len(q & other) / len(q | other)
+            if sim > best_sim:
+                best, best_sim = cand, sim
+        return best if best_sim >= SIMILARITY_THRESHOLD else None
+
+
+_SCOPES: LRUCache = LRUCache(maxsize=1000)
+
+
+def _scope(doc_key: str, source_ver: str) -> _Scope:
+    key = (doc_key, source_ver)
+    sc = _SCOPES.get(key)
+    if sc is None:
+        sc = _Scope(entries=OrderedDict(), postings={})
+        _SCOPES[key] = sc
+    return sc
+
+
+def _answer_key(doc_key: str, source_ver: str, terms: Tuple[str, ...]) -> str:
+    digest = hashlib.md5(" ".join(terms).encode("utf-8")).hexdigest()
+    return f"{REDIS_PREFIX}{doc_key}:{source_ver}:{digest}"
+
+
+def flight_key(doc_key: str, source_ver: str, text: str) -> str:
+    """Ключ single-flight для вызова модели: тот же, что и ключ кэша ответа."""
+    return "llm:" + _answer_key(doc_key, source_ver, normalize_question(text))
+
+
+def _stats_key(owner_id: int | None) -> str:
+    return f"{REDIS_PREFIX}stats:{owner_id if owner_id is not None else 'none'}"
+
+
+async def _bump(owner_id: int | None, **fields: int) -> None:
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for name, value in fields.items():
+            pipe.hincrby(_stats_key(owner_id), name, value)
+        await pipe.execute()
+    except Exception as e:
+        logging.debug("answer cache stats failed: %s", e.__class__.__name__)
+
+
+async def lookup(owner_id: int | None, doc_key: str, source_ver: str, text: str) -> Optional[str]:
+    """Ответ из кэша (точное совпадение нормализованного вопроса или близкий дубликат)."""
+    terms = normalize_question(text)
+    if not terms:
+        return None
+    scope = _scope(doc_key, source_ver)
+    keys = [terms]
+    near = scope.nearest(terms)
+    if near is not None and near != terms:
+        keys.append(near)
+
+    for k in keys:
+        try:
+            raw = await get_redis().get(_answer_key(doc_key, source_ver, k))
+        except Exception as e:
+            logging.debug("answer cache get failed: %s", e.__class__.__name__)
+            return None
+        if raw is None:
+            continue
+        try:
+            data = json.loads(raw)
+        except Exception:
+            continue
+        scope.add(k)
+        await _bump(owner_id, hits=1, saved_tokens=int(data.get("t") or 0))
+        return data.get("a")
+
+    await _bump(owner_id, misses=1)
+    return None
+
+
+async def store(doc_key: str, source_ver: str, text: str, answer: str, tokens: int) -> None:
+    terms = normalize_question(text)
+    if not terms or not (answer or "").strip():
+        return
+    payload = json.dumps({"a": answer, "t": int(tokens)}, ensure_ascii=False)
+    try:
+        await get_redis().set(_answer_key(doc_key, source_ver, terms), payload, ex=ANSWER_CACHE_TTL_SEC)
+    except Exception as e:
+        logging.debug("answer cache set failed: %s", e.__class__.__name__)
+        return
+    _scope(doc_key, source_ver).add(terms)
+
+
+async def get_cache_stats(owner_id: int | None) -> Dict[str, float]:
+    """{"hits", "misses", "saved_tokens", "hit_rate"} по владельцу."""
+    raw = await get_redis().hgetall(_stats_key(owner_id))
+    data = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in raw.items()}
+    hits, misses = data.get("hits", 0), data.get("misses", 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "saved_tokens": data.get("saved_tokens", 0),
+        "hit_rate": (hits / total) if total else 0.0,
+    }
+
+
+async def list_owner_stats() -> List[Tuple[str, Dict[str, float]]]:
+    """Статистика по всем владельцам (для отчёта)."""
+    out = []
+    prefix = f"{REDIS_PREFIX}stats:"
+    async for key in get_redis().scan_iter(match=f"{prefix}*", count=500):
+        k = key.decode() if isinstance(key, bytes) else key
+        owner = k[len(prefix):]
+        out.append((owner, await get_cache_stats(None if owner == "none" else int(owner))))
+    return out
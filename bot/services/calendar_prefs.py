@@ -0,0 +1,94 @@
+# bot/services/calendar_prefs.py
+from __future__ import annotations
+import os
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, tzinfo
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+
+from bot.services.db import get_user_calendar_id
+from bot.services.google_oauth import has_calendar_scope
+from providers.google_calendar_oauth_provider import (
+    fetch_user_timezone_oauth,
+    list_calendars_oauth,
+)
+
+# Настройки календаря меняются редко, поэтому держим их долго.
+# Сбрасываются явно через invalidate_calendar_prefs() при изменении в настройках.
+PREFS_TTL_SEC = int(os.getenv("CAL_PREFS_TTL_SEC", str(6 * 3600)))
+PREFS_MAX_OWNERS = int(os.getenv("CAL_PREFS_MAX_OWNERS", "10000"))
+
+_UNSET: Any = object()
+
+
+@dataclass
+class CalendarPrefs:
+    """Закэшированные настройки календаря одного владельца (поля грузятся лениво)."""
+    tz: Any = field(default=_UNSET)
+    calendar_id: Any = field(default=_UNSET)
+    calendars: Any = field(default=_UNSET)
+    connected: Any = field(default=_UNSET)
+
+
+_CACHE: TTLCache = TTLCache(maxsize=PREFS_MAX_OWNERS, ttl=PREFS_TTL_SEC)
+
+
+def _entry(user_id: int) -> CalendarPrefs:
+    key = int(user_id)
+    prefs = _CACHE.get(key)
+    if prefs is None:
+        prefs = CalendarPrefs()
+        _CACHE[key] = prefs
+    return prefs
+
+
+async def get_cached_timezone(user_id: int) -> tzinfo:
+    """
+    TZ владельца из Google (с кэшем).
+    При сбое возвращаем tz процесса и НЕ кэшируем — чтобы временная ошибка не залипла надолго.
+    """
+    prefs = _entry(user_id)
+    if prefs.tz is not _UNSET:
+        return prefs.tz
+    try:
+        tz = await fetch_user_timezone_oauth(int(user_id))
+    except Exception as e:
+        logging.debug("fetch_user_timezone_oauth(%s) failed: %s", user_id, e.__class__.__name__)
+        return datetime.now().astimezone().tzinfo
+    prefs.tz = tz
+    return tz
+
+
+async def get_cached_calendar_id(user_id: int) -> Optional[str]:
+    """ID привязанного календаря (или None), без похода в БД при повторных вызовах."""
+    prefs = _entry(user_id)
+    if prefs.calendar_id is _UNSET:
+        prefs.calendar_id = await get_user_calendar_id(user_id)
+    return prefs.calendar_id
+
+
+async def get_cached_calendars(user_id: int) -> List[Dict[str, Any]]:
+    """Список календарей аккаунта. Ошибки Google пробрасываются и не кэшируются."""
+    prefs = _entry(user_id)
+    if prefs.calendars is _UNSET:
+        prefs.calendars = await list_calendars_oauth(int(user_id))
+    return list(prefs.calendars)
+
+
+async def get_cached_calendar_connected(user_id: int) -> bool:
+    """Подключён ли Google Calendar (токен с calendar-scope). Ошибки БД считаем «подключён» и не кэшируем."""
+    prefs = _entry(user_id)
+    if prefs.connected is _UNSET:
+        try:
+            prefs.connected = await has_calendar_scope(int(user_id))
+        except Exception as e:
+            logging.debug("has_calendar_scope(%s) failed: %s", user_id, e.__class__.__name__)
+            return True
+    return prefs.connected
+
+
+def invalidate_calendar_prefs(user_id: int) -> None:
+    """Сбросить кэш владельца (после смены/отвязки календаря, (пере)подключения Google)."""
+    _CACHE.pop(int(user_id), None)
@@ -1,17 +1,21 @@
 from __future__ import annotations
 import hmac, hashlib, base64
-from typing import Optional, Dict
+from typing import Optional, Dict, TYPE_CHECKING
 import datetime
+import os
 import aiohttp
-import aiosqlite
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
 import asyncio
 from config import (
     GOOGLE_OAUTH_CLIENT_ID, GOOGLE_OAUTH_CLIENT_SECRET, OAUTH_REDIRECT_URI,
-    OAUTH_STATE_SECRET, DB_PATH
+    OAUTH_STATE_SECRET
 )
+from bot.services.db import user_changed
+from bot.services.storage import get_storage
+
+# google-auth / oauthlib тянут requests и urllib3 (~0.2 с на старте) — импортируем при первом использовании
+if TYPE_CHECKING:
+    from google_auth_oauthlib.flow import Flow
+    from google.oauth2.credentials import Credentials
 
 SCOPES = [
     "https://www.googleapis.com/auth/documents.readonly",
@@ -21,13 +25,28 @@ SCOPES = [
 
 ]
 
+# Один адрес вместо *.googleapis.com (стенд нагрузочного теста scripts/load_fakes.py); пусто — боевые API
+GOOGLE_API_BASE_URL = os.getenv("GOOGLE_API_BASE_URL", "").strip().rstrip("/")
+TOKEN_URI = f"{GOOGLE_API_BASE_URL}/token" if GOOGLE_API_BASE_URL else "https://oauth2.googleapis.com/token"
+
+
+def api_client_options(service_path: str = "") -> Optional[Dict]:
+    """
+    client_options для googleapiclient build() при GOOGLE_API_BASE_URL.
+    api_endpoint заменяет rootUrl+servicePath целиком, поэтому servicePath API передаём сами
+    (docs/sheets — "", calendar — "calendar/v3/").
+    """
+    if not GOOGLE_API_BASE_URL:
+        return None
+    return {"api_endpoint": f"{GOOGLE_API_BASE_URL}/{service_path}"}
+
 def _client_config() -> Dict:
     return {
         "web": {
             "client_id": GOOGLE_OAUTH_CLIENT_ID,
             "project_id": "ai-assistant",
             "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
+            "token_uri": TOKEN_URI,
             "client_secret": GOOGLE_OAUTH_CLIENT_SECRET,
             "redirect_uris": [OAUTH_REDIRECT_URI],
         }
@@ -57,6 +76,7 @@ def parse_state(state: str) -> Optional[int]:
     return None
 
 def build_flow() -> Flow:
+    from google_auth_oauthlib.flow import Flow
     return Flow.from_client_config(
         _client_config(),
         scopes=SCOPES,
@@ -86,26 +106,23 @@ async def save_refresh_token(user_id: int, creds: Credentials) -> None:
     if not creds.refresh_token:
         raise RuntimeError("No refresh_token in OAuth response")
     scopes = " ".join(sorted(creds.scopes or SCOPES))
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            """
-            INSERT INTO google_tokens (user_id, refresh_token, scopes)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-              refresh_token=excluded.refresh_token,
-              scopes=excluded.scopes
-            """,
-            (user_id, creds.refresh_token, scopes),
-        )
-        await conn.commit()
+    await get_storage().execute(
+        """
+        INSERT INTO google_tokens (user_id, refresh_token, scopes)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+          refresh_token=excluded.refresh_token,
+          scopes=excluded.scopes
+        """,
+        (int(user_id), creds.refresh_token, scopes),
+    )
+    user_changed(user_id, google_scopes=scopes)
 
 async def _get_refresh_token(user_id: int) -> str | None:
-    async with aiosqlite.connect(DB_PATH) as conn:
-        async with conn.execute(
-            "SELECT refresh_token FROM google_tokens WHERE user_id=?", (user_id,)
-        ) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else None
+    row = await get_storage().fetchone(
+        "SELECT refresh_token FROM google_tokens WHERE user_id=?", (int(user_id),)
+    )
+    return row[0] if row else None
 
 async def revoke_refresh_token(refresh_token: str) -> bool:
     url = "https://oauth2.googleapis.com/revoke"
@@ -123,6 +140,16 @@ async def has_google_oauth(user_id: int | str) -> bool:
     creds = await load_user_credentials(int(user_id))
     return creds is not None
 
+async def has_calendar_scope(user_id: int | str) -> bool:
+    """Есть ли у владельца сохранённый токен с доступом к Calendar (без refresh — только БД)."""
+    row = await get_storage().fetchone(
+        "SELECT scopes FROM google_tokens WHERE user_id=?", (int(user_id),)
+    )
+    if not row:
+        return False
+    scopes = (row[0] or "").split()
+    return any(s.startswith("https://www.googleapis.com/auth/calendar") for s in scopes)
+
 async def delete_refresh_token(user_id: int) -> None:
     token = await _get_refresh_token(user_id)
     if token:
@@ -130,24 +157,24 @@ async def delete_refresh_token(user_id: int) -> None:
             await revoke_refresh_token(token)
         except Exception:
             pass  # не ломаем UX
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute("DELETE FROM google_tokens WHERE user_id = ?", (user_id,))
-        await conn.commit()
+    await get_storage().execute("DELETE FROM google_tokens WHERE user_id = ?", (int(user_id),))
+    user_changed(user_id, google_scopes=None)
 
 async def load_user_credentials(user_id: int) -> Optional[Credentials]:
-    async with aiosqlite.connect(DB_PATH) as conn:
-        async with conn.execute(
-            "SELECT refresh_token, scopes FROM google_tokens WHERE user_id = ?",
-            (user_id,),
-        ) as cur:
-            row = await cur.fetchone()
+    row = await get_storage().fetchone(
+        "SELECT refresh_token, scopes FROM google_tokens WHERE user_id = ?",
+        (int(user_id),),
+    )
     if not row:
         return None
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+
     refresh_token, scopes = row[0], (row[1] or "")
     creds = Credentials(
         token=None,
         refresh_token=refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
+        token_uri=TOKEN_URI,
         client_id=GOOGLE_OAUTH_CLIENT_ID,
         client_secret=GOOGLE_OAUTH_CLIENT_SECRET,
         scopes=scopes.split(),
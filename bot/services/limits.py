@@ -1,9 +1,8 @@
 from __future__ import annotations
 import os
-import aiosqlite
 from typing import Dict
 
-DB_PATH = os.getenv("DB_PATH", "db.db")
+from bot.services.storage import get_storage
 
 def _env_int(name: str, default: int) -> int:
     try:
@@ -21,6 +20,18 @@ RPD_MAP: Dict[str, int] = {
     "premium": _env_int("LIMITS_RPD_PREMIUM", 5000),
 }
 
+# Веса владельцев в справедливой очереди к LLM (bot/services/llm_scheduler.py)
+LLM_WEIGHT_MAP: Dict[str, int] = {
+    "free":    _env_int("LIMITS_LLM_WEIGHT_FREE", 1),
+    "premium": _env_int("LIMITS_LLM_WEIGHT_PREMIUM", 3),
+}
+
+_PLAN_SQL = "SELECT subscribe, date_end FROM users WHERE id = ? LIMIT 1"
+
+# проверяет scripts/check_query_plans.py
+HOT_QUERIES = (("limits.plan", _PLAN_SQL),)
+
+
 async def resolve_plan(user_id: int) -> str:
     """
     Возвращает "premium" если у пользователя активная подписка,
@@ -28,12 +39,7 @@ async def resolve_plan(user_id: int) -> str:
     Совместимо с текущей схемой: subscribe='subscribe' + проверка date_end.
     """
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            async with conn.execute(
-                "SELECT subscribe, date_end FROM users WHERE id = ? LIMIT 1",
-                (user_id,),
-            ) as cur:
-                row = await cur.fetchone()
+        row = await get_storage().fetchone(_PLAN_SQL, (int(user_id),))
         if not row:
             return "free"
         subscribe, date_end = row[0], row[1]
@@ -57,6 +63,8 @@ TOKEN_ALLOWANCE_MAP: Dict[str, int] = {
     "premium": _env_int("LIMITS_TOKENS_PREMIUM", 80000), # побольше
 }
 
+def plan_token_allowance(plan: str) -> int:
+    return int(TOKEN_ALLOWANCE_MAP.get(plan, TOKEN_ALLOWANCE_MAP["free"]))
+
 async def month_token_allowance(user_id: int) -> int:
-    plan = await resolve_plan(user_id)
-    return int(TOKEN_ALLOWANCE_MAP.get(plan, TOKEN_ALLOWANCE_MAP["free"]))
\ No newline at end of file
+    return plan_token_allowance(await resolve_plan(user_id))
\ No newline at end of file
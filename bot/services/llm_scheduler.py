@@ -0,0 +1,226 @@
+# bot/services/llm_scheduler.py
+"""
+Планировщик вызовов LLM: взвешенная справедливая очередь по владельцам.
+
+- глобальный лимит одновременных запросов к OpenRouter (LLM_MAX_CONCURRENCY);
+- лимит на одного владельца (LLM_MAX_PER_OWNER) — «вирусный» бот не забирает весь пул;
+- порядок — weighted fair queuing: у каждого запроса виртуальное время окончания
+  max(vtime, последний тег владельца) + 1/вес; вес берётся из тарифа (LLM_WEIGHT_MAP);
+- дедлайн ожидания в очереди (LLM_QUEUE_DEADLINE_SEC): не дождались слота — LLMOverloaded сразу,
+  а не таймаут через 30 секунд;
+- слот занимает одна попытка запроса (SlotLease): на паузу перед повтором роутер его отпускает,
+  запасной hedge-запрос берёт свой слот, только если он свободен сразу (try_acquire).
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from cachetools import TTLCache
+
+from bot.services.limits import resolve_plan, LLM_WEIGHT_MAP
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_PER_OWNER = int(os.getenv("LLM_MAX_PER_OWNER", "2"))
+LLM_QUEUE_DEADLINE_SEC = float(os.getenv("LLM_QUEUE_DEADLINE_SEC", "12"))
+
+
+class LLMOverloaded(RuntimeError):
+    """Слот для вызова LLM не освободился до дедлайна очереди."""
+
+
+@dataclass(order=True)
+class _Ticket:
+    tag: float
+    seq: int
+    owner: Any = field(compare=False)
+    deadline: float = field(compare=False)
+    fut: asyncio.Future = field(compare=False)
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        *,
+        max_concurrency: int,
+        max_per_owner: int,
+        queue_deadline_sec: float,
+        weight_of: Callable[[Any], Awaitable[float]],
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_owner = max(1, max_per_owner)
+        self.queue_deadline_sec = queue_deadline_sec
+        self.weight_of = weight_of
+
+        self._queues: Dict[Any, Deque[_Ticket]] = {}
+        self._running: Dict[Any, int] = {}
+        self._last_tag: Dict[Any, float] = {}
+        self._active = 0
+        self._vtime = 0.0
+        self._seq = itertools.count()
+        self.shed = 0  # сколько запросов отклонено по дедлайну
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self._active,
+            "queued": sum(len(q) for q in self._queues.values()),
+            "owners_waiting": len(self._queues),
+            "shed": self.shed,
+        }
+
+    async def acquire(self, owner: Any) -> None:
+        weight = max(0.01, float(await self.weight_of(owner)))
+        now = time.monotonic()
+        tag = max(self._vtime, self._last_tag.get(owner, 0.0)) + 1.0 / weight
+        self._last_tag[owner] = tag
+        ticket = _Ticket(
+            tag=tag,
+            seq=next(self._seq),
+            owner=owner,
+            deadline=now + self.queue_deadline_sec,
+            fut=asyncio.get_running_loop().create_future(),
+        )
+        self._queues.setdefault(owner, deque()).append(ticket)
+        self._dispatch()
+        if ticket.fut.done():
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.fut), timeout=max(0.0, ticket.deadline - now))
+        except asyncio.TimeoutError:
+            if ticket.fut.done() and not ticket.fut.cancelled():
+                return  # слот выдали в последний момент
+            self._drop(ticket)
+            self.shed += 1
+            raise LLMOverloaded("LLM queue deadline exceeded") from None
+        except asyncio.CancelledError:
+            if ticket.fut.done() and not ticket.fut.cancelled():
+                self.release(owner)
+            else:
+                self._drop(ticket)
+            raise
+
+    def try_acquire(self, owner: Any) -> bool:
+        """Занять слот без ожидания — только если никто не стоит в очереди и лимиты не выбраны."""
+        if self._queues or self._active >= self.max_concurrency:
+            return False
+        if self._running.get(owner, 0) >= self.max_per_owner:
+            return False
+        self._active += 1
+        self._running[owner] = self._running.get(owner, 0) + 1
+        return True
+
+    def release(self, owner: Any) -> None:
+        self._active -= 1
+        left = self._running.get(owner, 1) - 1
+        if left > 0:
+            self._running[owner] = left
+        else:
+            self._running.pop(owner, None)
+            if owner not in self._queues:
+                self._last_tag.pop(owner, None)
+        self._dispatch()
+
+    def _drop(self, ticket: _Ticket) -> None:
+        q = self._queues.get(ticket.owner)
+        if q is None:
+            return
+        try:
+            q.remove(ticket)
+        except ValueError:
+            pass
+        if not q:
+            self._queues.pop(ticket.owner, None)
+        if not ticket.fut.done():
+            ticket.fut.cancel()
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._active < self.max_concurrency:
+            best: Optional[_Ticket] = None
+            for owner, q in list(self._queues.items()):
+                # просроченные головы выбрасываем сразу — их ожидающие уже получили/получат отказ
+                while q and (q[0].fut.done() or q[0].deadline <= now):
+                    stale = q.popleft()
+                    if not stale.fut.done():
+                        stale.fut.cancel()
+                if not q:
+                    self._queues.pop(owner, None)
+                    continue
+                if self._running.get(owner, 0) >= self.max_per_owner:
+                    continue
+                if best is None or q[0] < best:
+                    best = q[0]
+            if best is None:
+                return
+            q = self._queues[best.owner]
+            q.popleft()
+            if not q:
+                self._queues.pop(best.owner, None)
+            self._vtime = max(self._vtime, best.tag)
+            self._active += 1
+            self._running[best.owner] = self._running.get(best.owner, 0) + 1
+            best.fut.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, owner: Any):
+        await self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release(owner)
+
+
+class SlotLease:
+    """Слот одного владельца, который можно отпустить на время паузы и занять снова; release() идемпотентен."""
+
+    def __init__(self, scheduler: FairScheduler, owner: Any):
+        self.scheduler = scheduler
+        self.owner = owner
+        self.held = False
+
+    async def acquire(self) -> None:
+        await self.scheduler.acquire(self.owner)
+        self.held = True
+
+    def try_acquire(self) -> bool:
+        self.held = self.scheduler.try_acquire(self.owner)
+        return self.held
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self.scheduler.release(self.owner)
+
+
+_PLAN_CACHE: TTLCache = TTLCache(maxsize=10000, ttl=300)
+
+
+async def cached_plan(owner_id: Any) -> str:
+    """Тариф владельца (кэш 5 минут). Системные вызовы (owner_id=None) — free."""
+    if owner_id is None:
+        return "free"
+    plan = _PLAN_CACHE.get(owner_id)
+    if plan is None:
+        plan = await resolve_plan(int(owner_id))
+        _PLAN_CACHE[owner_id] = plan
+    return plan
+
+
+async def plan_weight(owner_id: Any) -> float:
+    """Вес владельца по тарифу."""
+    plan = await cached_plan(owner_id)
+    return float(LLM_WEIGHT_MAP.get(plan, LLM_WEIGHT_MAP["free"]))
+
+
+LLM_SCHEDULER = FairScheduler(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    max_per_owner=LLM_MAX_PER_OWNER,
+    queue_deadline_sec=LLM_QUEUE_DEADLINE_SEC,
+    weight_of=plan_weight,
+)
@@ -1,61 +1,164 @@
 # bot/services/memory.py
+"""
+Память диалога дочерних ботов.
+
+chat_memory — сырые реплики; chat_summary — rolling summary на (owner, chat) и id последней
+свёрнутой реплики. В промпт идут summary + окно свежих реплик в пределах токен-бюджета.
+Сворачивание старых реплик выполняется в фоне (schedule_compaction), не на пути ответа.
+
+При MEMORY_HOT_TIER=redis чтение/запись идут через горячий слой (bot/services/memory_hot.py),
+а БД (bot/services/storage.py) пополняется асинхронно пачками (flush_pending) и служит для прогрева при промахе.
+"""
 from __future__ import annotations
-from typing import List, Tuple
-import aiosqlite
+import asyncio
+import contextlib
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional, Set, Tuple
 
-from config import DB_PATH
+from bot.services.storage import Tx, get_storage
+from hashsss import summarize_dialog
+from bot.services.token_wallet import debit
+from bot.services.tokenizer import count_tokens
+from bot.services import memory_hot
 
-# сколько сообщений хранить на чат
-DEFAULT_LIMIT = 10
+# жёсткий потолок сырых реплик на чат (страховка, если сворачивание не работает)
+DEFAULT_LIMIT = int(os.getenv("MEMORY_MAX_ROWS", "50"))
+# бюджет на summary + окно свежих реплик (в грубых токенах)
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+# сворачиваем, когда несвёрнутых реплик больше COMPACT_TRIGGER или они не влезают в бюджет
+COMPACT_TRIGGER = int(os.getenv("MEMORY_COMPACT_TRIGGER", "10"))
+# сколько последних реплик всегда остаётся дословно
+KEEP_RECENT = int(os.getenv("MEMORY_KEEP_RECENT", "4"))
+# как часто сбрасывать накопленные реплики в БД при включённом горячем слое
+FLUSH_SEC = float(os.getenv("MEMORY_FLUSH_SEC", "1.0"))
 
 
-async def add_memory_message(
-    owner_id: int,
-    chat_id: int,
-    role: str,
-    content: str,
-    limit: int = DEFAULT_LIMIT,
-) -> None:
-    """
-    Сохраняем одну реплику диалога и подчищаем старые.
-    role: 'user' или 'assistant'
-    """
-    content = (content or "").strip()
-    if not content:
-        return
+# ring buffer: одним DELETE отрезаем всё старше limit-й с конца реплики (по индексу owner_id, chat_id, id)
+_TRIM_SQL = """
+DELETE FROM chat_memory
+WHERE owner_id = ? AND chat_id = ? AND id < (
+    SELECT id FROM chat_memory
+    WHERE owner_id = ? AND chat_id = ?
+    ORDER BY id DESC
+    LIMIT 1 OFFSET ?
+)
+"""
+
+_HISTORY_SQL = """
+SELECT role, content
+FROM chat_memory
+WHERE owner_id = ? AND chat_id = ?
+ORDER BY id DESC
+LIMIT ?
+"""
 
-    role = "assistant" if role == "assistant" else "user"
+_SUMMARY_SQL = "SELECT summary, upto_id FROM chat_summary WHERE owner_id = ? AND chat_id = ?"
 
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
+# несвёрнутый хвост: реплики после upto_id из chat_summary
+_UNSUMMARIZED_SQL = """
+SELECT id, role, content
+FROM chat_memory
+WHERE owner_id = ? AND chat_id = ? AND id > ?
+ORDER BY id DESC
+LIMIT ?
+"""
+
+# проверяет scripts/check_query_plans.py
+HOT_QUERIES = (
+    ("memory.history", _HISTORY_SQL),
+    ("memory.context", _UNSUMMARIZED_SQL),
+    ("memory.trim", _TRIM_SQL),
+    ("memory.summary", _SUMMARY_SQL),
+)
+
+
+async def _write_rows(rows: List[Tuple[int, int, str, str]], limit: int) -> None:
+    """Вставка реплик (возможно, разных чатов) + подрезка каждого чата одной транзакцией."""
+    async with get_storage().transaction() as tx:
+        await tx.executemany(
             """
             INSERT INTO chat_memory (owner_id, chat_id, role, content)
             VALUES (?, ?, ?, ?)
             """,
-            (owner_id, chat_id, role, content),
+            rows,
+        )
+        chats = {(o, c) for o, c, _, _ in rows}
+        await tx.executemany(
+            _TRIM_SQL,
+            [(o, c, o, c, max(1, limit) - 1) for o, c in chats],
         )
-        await conn.commit()
 
-        # подчистим старые записи сверх лимита
-        async with conn.execute(
-            """
-            SELECT id
-            FROM chat_memory
-            WHERE owner_id = ? AND chat_id = ?
-            ORDER BY id DESC
-            LIMIT -1 OFFSET ?
-            """,
-            (owner_id, chat_id, limit),
-        ) as cur:
-            extra = await cur.fetchall()
 
-        if extra:
-            ids = [row[0] for row in extra]
-            await conn.executemany(
-                "DELETE FROM chat_memory WHERE id = ?",
-                [(i,) for i in ids],
-            )
-            await conn.commit()
+_QUEUE: List[Tuple[int, int, str, str]] = []
+_FLUSH_LOCK = asyncio.Lock()
+_FLUSHER: Optional[asyncio.Task] = None
+
+
+async def flush_pending() -> int:
+    """Сбросить накопленные реплики в БД. Вернёт число записанных строк."""
+    async with _FLUSH_LOCK:
+        if not _QUEUE:
+            return 0
+        batch = _QUEUE[:]
+        del _QUEUE[:]
+        try:
+            await _write_rows(batch, DEFAULT_LIMIT)
+        except Exception:
+            _QUEUE[:0] = batch  # вернём в начало очереди, попробуем в следующий раз
+            raise
+        return len(batch)
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_SEC)
+        try:
+            await flush_pending()
+        except Exception as e:
+            logging.warning("memory flush failed: %s", e.__class__.__name__)
+
+
+def _ensure_flusher() -> None:
+    global _FLUSHER
+    if _FLUSHER is None or _FLUSHER.done():
+        _FLUSHER = asyncio.create_task(_flush_loop(), name="memory-flush")
+
+
+async def _append(owner_id: int, chat_id: int, items: List[Tuple[str, str]], limit: int) -> None:
+    rows = []
+    for role, content in items:
+        content = (content or "").strip()
+        if content:
+            rows.append((owner_id, chat_id, "assistant" if role == "assistant" else "user", content))
+    if not rows:
+        return
+
+    if not memory_hot.enabled():
+        await _write_rows(rows, limit)
+        return
+
+    _QUEUE.extend(rows)
+    _ensure_flusher()
+    try:
+        await memory_hot.append(owner_id, chat_id, [(r, c) for _, _, r, c in rows])
+    except Exception as e:
+        # горячий слой — лишь кэш: сбросим его, следующее чтение прогреется из БД
+        logging.warning("memory hot append failed: %s", e.__class__.__name__)
+        with contextlib.suppress(Exception):
+            await memory_hot.drop(owner_id, chat_id)
+
+
+async def add_memory_turn(
+    owner_id: int,
+    chat_id: int,
+    user_text: str,
+    assistant_text: str,
+    limit: int = DEFAULT_LIMIT,
+) -> None:
+    """Реплика пользователя и ответ ассистента — одной транзакцией."""
+    await _append(owner_id, chat_id, [("user", user_text), ("assistant", assistant_text)], limit)
 
 
 async def get_memory_history(
@@ -67,29 +170,181 @@ async def get_memory_history(
     Возвращает историю в виде списка (role, content),
     в хронологическом порядке (от старых к новым).
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        async with conn.execute(
-            """
-            SELECT role, content
-            FROM chat_memory
-            WHERE owner_id = ? AND chat_id = ?
-            ORDER BY id DESC
-            LIMIT ?
-            """,
-            (owner_id, chat_id, limit),
-        ) as cur:
-            rows = await cur.fetchall()
+    hot = await _read_hot(owner_id, chat_id)
+    if hot is not None:
+        return hot[1][-limit:] if limit > 0 else []
 
-    rows = list(rows)
+    rows = await get_storage().fetchall(_HISTORY_SQL, (owner_id, chat_id, limit))
     rows.reverse()  # делаем от старых к новым
     return [(r[0], r[1]) for r in rows]
 
 
 async def clear_memory(owner_id: int, chat_id: int) -> None:
     """На всякий случай: полная очистка истории конкретного чата."""
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
+    if memory_hot.enabled():
+        await flush_pending()
+    async with get_storage().transaction() as tx:
+        await tx.execute(
             "DELETE FROM chat_memory WHERE owner_id = ? AND chat_id = ?",
             (owner_id, chat_id),
         )
-        await conn.commit()
+        await tx.execute(
+            "DELETE FROM chat_summary WHERE owner_id = ? AND chat_id = ?",
+            (owner_id, chat_id),
+        )
+    if memory_hot.enabled():
+        with contextlib.suppress(Exception):
+            await memory_hot.drop(owner_id, chat_id)
+
+
+@dataclass
+class MemoryContext:
+    summary: Optional[str] = None
+    history: List[Tuple[str, str]] = field(default_factory=list)
+
+
+async def _load_unsummarized(
+    tx: Tx, owner_id: int, chat_id: int
+) -> Tuple[Optional[str], int, List[Tuple[int, str, str]]]:
+    """(summary, upto_id, [(id, role, content)] после upto_id — от новых к старым)."""
+    row = await tx.fetchone(_SUMMARY_SQL, (owner_id, chat_id))
+    summary, upto_id = (row[0], int(row[1])) if row else (None, 0)
+
+    rows = await tx.fetchall(_UNSUMMARIZED_SQL, (owner_id, chat_id, upto_id, DEFAULT_LIMIT))
+    rows = [(int(r[0]), r[1], r[2]) for r in rows]
+    return summary, upto_id, rows
+
+
+async def _read_hot(owner_id: int, chat_id: int) -> Optional[Tuple[Optional[str], List[Tuple[str, str]]]]:
+    """
+    (summary, несвёрнутые реплики от старых к новым) из горячего слоя; при промахе — прогрев из БД.
+    None — слой выключен или недоступен (читаем БД напрямую).
+    """
+    if not memory_hot.enabled():
+        return None
+    try:
+        hot = await memory_hot.read(owner_id, chat_id)
+        if hot is not None:
+            return hot
+        await flush_pending()  # иначе прогреемся без ещё не записанных реплик
+        async with get_storage().connection() as tx:
+            summary, _, rows = await _load_unsummarized(tx, owner_id, chat_id)
+        items = [(role, content) for _, role, content in reversed(rows)]
+        await memory_hot.hydrate(owner_id, chat_id, summary, items)
+        return summary, items
+    except Exception as e:
+        logging.warning("memory hot read failed: %s", e.__class__.__name__)
+        with contextlib.suppress(Exception):
+            await flush_pending()
+        return None
+
+
+async def get_memory_context(
+    owner_id: int,
+    chat_id: int,
+    budget_tokens: int = MEMORY_TOKEN_BUDGET,
+) -> MemoryContext:
+    """
+    Summary + свежие несвёрнутые реплики (от старых к новым), суммарно в пределах budget_tokens.
+    Две последние реплики берём всегда — без них теряется смысл уточнений.
+    """
+    hot = await _read_hot(owner_id, chat_id)
+    if hot is not None:
+        summary = hot[0]
+        rows = [(0, role, content) for role, content in reversed(hot[1])]
+    else:
+        async with get_storage().connection() as tx:
+            summary, _, rows = await _load_unsummarized(tx, owner_id, chat_id)
+
+    left = budget_tokens - (count_tokens(summary) if summary else 0)
+    window: List[Tuple[str, str]] = []
+    for i, (_, role, content) in enumerate(rows):
+        cost = count_tokens(content)
+        if i >= 2 and cost > left:
+            break
+        left -= cost
+        window.append((role, content))
+    window.reverse()
+    return MemoryContext(summary=summary, history=window)
+
+
+async def compact_memory(owner_id: int, chat_id: int) -> bool:
+    """
+    Сворачивает старые несвёрнутые реплики в rolling summary и удаляет их из chat_memory.
+    Вернёт True, если summary обновлён.
+    """
+    if memory_hot.enabled():
+        await flush_pending()  # сворачиваем по БД — она должна быть полной
+    async with get_storage().connection() as tx:
+        summary, _, rows = await _load_unsummarized(tx, owner_id, chat_id)
+
+    tokens = sum(count_tokens(c) for _, _, c in rows)
+    if len(rows) <= KEEP_RECENT or (len(rows) <= COMPACT_TRIGGER and tokens <= MEMORY_TOKEN_BUDGET):
+        return False
+
+    fold = list(reversed(rows[KEEP_RECENT:]))  # от старых к новым
+    reply = await summarize_dialog(
+        summary, [(role, content) for _, role, content in fold], owner_id=owner_id,
+    )
+    new_summary = reply.text
+    if not new_summary:
+        return False
+    upto_id = fold[-1][0]
+
+    async with get_storage().transaction() as tx:
+        await tx.execute(
+            """
+            INSERT INTO chat_summary (owner_id, chat_id, summary, upto_id, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(owner_id, chat_id) DO UPDATE SET
+              summary = excluded.summary,
+              upto_id = excluded.upto_id,
+              updated_at = excluded.updated_at
+            """,
+            (owner_id, chat_id, new_summary, upto_id),
+        )
+        await tx.execute(
+            "DELETE FROM chat_memory WHERE owner_id = ? AND chat_id = ? AND id <= ?",
+            (owner_id, chat_id, upto_id),
+        )
+
+    if memory_hot.enabled():
+        with contextlib.suppress(Exception):
+            await memory_hot.drop(owner_id, chat_id)  # прогреется заново уже со свежим summary
+
+    # сворачивание тоже тратит токены владельца (по фактическому usage, если он пришёл)
+    try:
+        if reply.usage is not None:
+            spent, usage = reply.usage.total_tokens, reply.usage.as_dict()
+        else:
+            prompt = (summary or "") + "".join(c for _, _, c in fold)
+            spent, usage = count_tokens(prompt) + count_tokens(new_summary), None
+        await debit(owner_id, spent, reason="memory-summary", meta={"bot_chat_id": chat_id},
+                    usage=usage, allow_overdraft=True)
+    except Exception as e:
+        logging.warning("memory-summary debit failed: %s", e.__class__.__name__)
+    return True
+
+
+_COMPACTING: Set[Tuple[int, int]] = set()
+_TASKS: Set[asyncio.Task] = set()
+
+
+def schedule_compaction(owner_id: int, chat_id: int) -> None:
+    """Фоновое сворачивание; не больше одной задачи на чат одновременно."""
+    key = (int(owner_id), int(chat_id))
+    if key in _COMPACTING:
+        return
+    _COMPACTING.add(key)
+
+    async def _run():
+        try:
+            await compact_memory(*key)
+        except Exception as e:
+            logging.warning("compact_memory failed: %s", e.__class__.__name__)
+        finally:
+            _COMPACTING.discard(key)
+
+    task = asyncio.create_task(_run())
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
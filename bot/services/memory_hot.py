@@ -0,0 +1,95 @@
+# bot/services/memory_hot.py
+"""
+Горячий слой памяти диалога в Redis (см. bot/services/memory.py).
+
+На (owner, chat) два ключа:
+- mem:{owner}:{chat}      — список несвёрнутых реплик (RPUSH + LTRIM, кольцевой буфер);
+- mem:{owner}:{chat}:sum  — rolling summary ("" если нет); заодно маркер «слой прогрет из SQLite».
+Пока маркера нет, дописывание в список пропускается — иначе после прогрева реплики задвоятся.
+
+Выбор: MEMORY_HOT_TIER=redis|off.
+"""
+from __future__ import annotations
+import json
+import os
+from typing import List, Optional, Tuple
+
+from providers.redis_provider import get_redis
+
+HOT_BACKEND = os.getenv("MEMORY_HOT_TIER", "redis").lower()
+HOT_MAX = int(os.getenv("MEMORY_HOT_MAX", "50"))
+HOT_TTL_SEC = int(os.getenv("MEMORY_HOT_TTL_SEC", str(7 * 24 * 3600)))
+REDIS_PREFIX = "mem:"
+
+# RPUSH + LTRIM + EXPIRE за один round trip и только для прогретого чата
+_APPEND_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then return 0 end
+for i = 3, #ARGV do redis.call('RPUSH', KEYS[1], ARGV[i]) end
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+def enabled() -> bool:
+    return HOT_BACKEND == "redis"
+
+
+def _keys(owner_id: int, chat_id: int) -> Tuple[str, str]:
+    base = f"{REDIS_PREFIX}{int(owner_id)}:{int(chat_id)}"
+    return base, f"{base}:sum"
+
+
+def _encode(role: str, content: str) -> bytes:
+    return json.dumps([role, content], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(raw: bytes | str) -> Optional[Tuple[str, str]]:
+    try:
+        role, content = json.loads(raw)
+    except Exception:
+        return None
+    return str(role), str(content)
+
+
+async def append(owner_id: int, chat_id: int, items: List[Tuple[str, str]]) -> bool:
+    """Дописать реплики. False — чат ещё не прогрет (реплики попадут в слой при прогреве)."""
+    if not items:
+        return True
+    list_key, sum_key = _keys(owner_id, chat_id)
+    args = [HOT_MAX, HOT_TTL_SEC] + [_encode(r, c) for r, c in items]
+    return bool(await get_redis().eval(_APPEND_LUA, 2, list_key, sum_key, *args))
+
+
+async def read(owner_id: int, chat_id: int) -> Optional[Tuple[Optional[str], List[Tuple[str, str]]]]:
+    """(summary, реплики от старых к новым) одним round trip; None — промах (нужен прогрев)."""
+    list_key, sum_key = _keys(owner_id, chat_id)
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.get(sum_key)
+    pipe.lrange(list_key, 0, -1)
+    summary, raw_items = await pipe.execute()
+    if summary is None:
+        return None
+    if isinstance(summary, bytes):
+        summary = summary.decode("utf-8", "replace")
+    items = [it for it in (_decode(x) for x in raw_items) if it is not None]
+    return (summary or None), items
+
+
+async def hydrate(owner_id: int, chat_id: int, summary: Optional[str], items: List[Tuple[str, str]]) -> None:
+    """Прогрев из SQLite: полностью заменяет содержимое слоя для чата."""
+    list_key, sum_key = _keys(owner_id, chat_id)
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.delete(list_key)
+    tail = items[-HOT_MAX:]
+    if tail:
+        pipe.rpush(list_key, *[_encode(r, c) for r, c in tail])
+        pipe.expire(list_key, HOT_TTL_SEC)
+    pipe.set(sum_key, summary or "", ex=HOT_TTL_SEC)
+    await pipe.execute()
+
+
+async def drop(owner_id: int, chat_id: int) -> None:
+    """Сбросить слой чата — следующее чтение прогреет его заново из SQLite."""
+    await get_redis().delete(*_keys(owner_id, chat_id))
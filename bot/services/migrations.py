@@ -0,0 +1,377 @@
+# bot/services/migrations.py
+"""
+Версионированные миграции схемы. Запускаются один раз на старте (main._run -> migrate()).
+
+- применённые версии — в schema_migrations; каждая миграция — одна транзакция;
+- миграции только добавляются в конец MIGRATIONS, уже выпущенные не меняем;
+- PostgreSQL (DATABASE_URL, см. bot/services/storage.py) — свой список PG_MIGRATIONS с теми же номерами
+  версий; новая миграция добавляется в оба списка. Несколько процессов на старте не мешают друг другу:
+  каждая миграция идёт под pg_advisory_xact_lock;
+- DDL на горячих путях больше нет: все таблицы и индексы создаются здесь;
+- индексы подобраны под горячие запросы, проверка планов — scripts/check_query_plans.py.
+"""
+from __future__ import annotations
+import datetime
+import logging
+from typing import Optional, Sequence
+
+import aiosqlite
+
+from bot.services.storage import DB_PATH, Storage, get_storage
+
+# (версия, имя, операторы). Операторы выполняются по одному внутри BEGIN IMMEDIATE ... COMMIT.
+MIGRATIONS: list[tuple[int, str, Sequence[str]]] = [
+    (1, "baseline", (
+        # users исторически создавалась руками — фиксируем колонки, которые читает код
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id        INTEGER PRIMARY KEY,
+            username  TEXT,
+            subscribe TEXT,
+            date_end  TEXT,
+            bot_token TEXT,
+            word_file TEXT,
+            state_bot TEXT DEFAULT 'stop'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_prefs (
+            user_id     INTEGER PRIMARY KEY,
+            calendar_id TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_terms (
+            user_id     INTEGER PRIMARY KEY,
+            accepted_at TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS google_tokens (
+            user_id       INTEGER PRIMARY KEY,
+            refresh_token TEXT NOT NULL,
+            scopes        TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_memory (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_id   INTEGER NOT NULL,
+            chat_id    INTEGER NOT NULL,
+            role       TEXT    NOT NULL,
+            content    TEXT    NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chat_memory_owner_chat_id ON chat_memory (owner_id, chat_id, id)",
+        """
+        CREATE TABLE IF NOT EXISTS chat_summary (
+            owner_id   INTEGER NOT NULL,
+            chat_id    INTEGER NOT NULL,
+            summary    TEXT    NOT NULL,
+            upto_id    INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (owner_id, chat_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pending_payments (
+            payment_id    TEXT PRIMARY KEY,
+            user_id       INTEGER NOT NULL,
+            username      TEXT,
+            status        TEXT NOT NULL DEFAULT 'pending',
+            created_at    TEXT NOT NULL,
+            expires_at    TEXT NOT NULL,
+            next_check_at TEXT NOT NULL,
+            checks        INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_pending_payments_due ON pending_payments (status, next_check_at)",
+        "CREATE INDEX IF NOT EXISTS idx_pending_payments_user ON pending_payments (user_id, status)",
+        """
+        CREATE TABLE IF NOT EXISTS notify_outbox (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id         INTEGER NOT NULL,
+            text            TEXT    NOT NULL,
+            reply_markup    TEXT,
+            parse_mode      TEXT,
+            dedupe_key      TEXT UNIQUE,
+            status          TEXT    NOT NULL DEFAULT 'pending',
+            attempts        INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT    NOT NULL,
+            last_error      TEXT,
+            created_at      TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            sent_at         TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_notify_outbox_due ON notify_outbox (status, next_attempt_at)",
+        """
+        CREATE TABLE IF NOT EXISTS token_wallets (
+            user_id INTEGER PRIMARY KEY,
+            period_start TEXT NOT NULL,
+            period_end   TEXT NOT NULL,
+            allowance_tokens INTEGER NOT NULL,
+            spent_tokens     INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'active',
+            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS token_tx (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ts TEXT NOT NULL DEFAULT (datetime('now')),
+            delta_tokens INTEGER NOT NULL,
+            reason TEXT,
+            request_id TEXT,
+            meta_json TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_token_tx_user_ts ON token_tx(user_id, ts DESC)",
+        # фактический расход по usage из OpenRouter рядом с локальной оценкой (для сверки)
+        """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ts TEXT NOT NULL DEFAULT (datetime('now')),
+            reason TEXT,
+            request_id TEXT,
+            model TEXT,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            cost REAL,
+            estimated_tokens INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_user_ts ON llm_usage(user_id, ts)",
+    )),
+    (2, "users_date_end_sortable", (
+        # старые записи: ISO с "T"/микросекундами -> единый формат db.DATE_END_FMT (сравнивается как текст)
+        """
+        UPDATE users SET date_end = datetime(date_end)
+        WHERE date_end IS NOT NULL AND datetime(date_end) IS NOT NULL AND date_end != datetime(date_end)
+        """,
+        # истечения подписок: WHERE subscribe='subscribe' AND date_end <= ? ORDER BY date_end
+        "CREATE INDEX IF NOT EXISTS idx_users_subscribe_date_end ON users (subscribe, date_end)",
+    )),
+]
+
+# Та же схема для PostgreSQL: BIGINT под Telegram id, identity вместо AUTOINCREMENT.
+# Даты, которые код сравнивает строками (date_end, next_*_at, ts), остаются TEXT в формате 'YYYY-MM-DD HH:MM:SS'.
+_PG_NOW_TEXT = "to_char(timezone('utc', now()), 'YYYY-MM-DD HH24:MI:SS')"
+
+PG_MIGRATIONS: list[tuple[int, str, Sequence[str]]] = [
+    (1, "baseline", (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id        BIGINT PRIMARY KEY,
+            username  TEXT,
+            subscribe TEXT,
+            date_end  TEXT,
+            bot_token TEXT,
+            word_file TEXT,
+            state_bot TEXT DEFAULT 'stop'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_prefs (
+            user_id     BIGINT PRIMARY KEY,
+            calendar_id TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_terms (
+            user_id     BIGINT PRIMARY KEY,
+            accepted_at TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS google_tokens (
+            user_id       BIGINT PRIMARY KEY,
+            refresh_token TEXT NOT NULL,
+            scopes        TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_memory (
+            id         BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            owner_id   BIGINT NOT NULL,
+            chat_id    BIGINT NOT NULL,
+            role       TEXT   NOT NULL,
+            content    TEXT   NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chat_memory_owner_chat_id ON chat_memory (owner_id, chat_id, id)",
+        """
+        CREATE TABLE IF NOT EXISTS chat_summary (
+            owner_id   BIGINT NOT NULL,
+            chat_id    BIGINT NOT NULL,
+            summary    TEXT   NOT NULL,
+            upto_id    BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (owner_id, chat_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pending_payments (
+            payment_id    TEXT PRIMARY KEY,
+            user_id       BIGINT NOT NULL,
+            username      TEXT,
+            status        TEXT NOT NULL DEFAULT 'pending',
+            created_at    TEXT NOT NULL,
+            expires_at    TEXT NOT NULL,
+            next_check_at TEXT NOT NULL,
+            checks        INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_pending_payments_due ON pending_payments (status, next_check_at)",
+        "CREATE INDEX IF NOT EXISTS idx_pending_payments_user ON pending_payments (user_id, status)",
+        """
+        CREATE TABLE IF NOT EXISTS notify_outbox (
+            id              BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            chat_id         BIGINT  NOT NULL,
+            text            TEXT    NOT NULL,
+            reply_markup    TEXT,
+            parse_mode      TEXT,
+            dedupe_key      TEXT UNIQUE,
+            status          TEXT    NOT NULL DEFAULT 'pending',
+            attempts        INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT    NOT NULL,
+            last_error      TEXT,
+            created_at      TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            sent_at         TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_notify_outbox_due ON notify_outbox (status, next_attempt_at)",
+        f"""
+        CREATE TABLE IF NOT EXISTS token_wallets (
+            user_id BIGINT PRIMARY KEY,
+            period_start TEXT NOT NULL,
+            period_end   TEXT NOT NULL,
+            allowance_tokens BIGINT NOT NULL,
+            spent_tokens     BIGINT NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'active',
+            updated_at TEXT NOT NULL DEFAULT {_PG_NOW_TEXT}
+        )
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS token_tx (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            ts TEXT NOT NULL DEFAULT {_PG_NOW_TEXT},
+            delta_tokens BIGINT NOT NULL,
+            reason TEXT,
+            request_id TEXT,
+            meta_json TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_token_tx_user_ts ON token_tx(user_id, ts DESC)",
+        f"""
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            ts TEXT NOT NULL DEFAULT {_PG_NOW_TEXT},
+            reason TEXT,
+            request_id TEXT,
+            model TEXT,
+            prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            completion_tokens BIGINT NOT NULL DEFAULT 0,
+            cached_tokens BIGINT NOT NULL DEFAULT 0,
+            cost DOUBLE PRECISION,
+            estimated_tokens BIGINT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_user_ts ON llm_usage(user_id, ts)",
+    )),
+    (2, "users_date_end_sortable", (
+        # данные в PostgreSQL приходят уже нормализованными (scripts/sqlite_to_postgres.py мигрирует SQLite первым)
+        "CREATE INDEX IF NOT EXISTS idx_users_subscribe_date_end ON users (subscribe, date_end)",
+    )),
+]
+
+_SCHEMA_MIGRATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version    INTEGER PRIMARY KEY,
+    name       TEXT NOT NULL,
+    applied_at TEXT NOT NULL
+)
+"""
+# ключ pg_advisory_xact_lock: миграции разных процессов идут строго по очереди
+_PG_LOCK_KEY = 4_180_047
+
+_applied_in_process: Optional[int] = None
+
+
+def _now() -> str:
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def _applied_versions(conn: aiosqlite.Connection) -> set[int]:
+    await conn.execute(_SCHEMA_MIGRATIONS_DDL)
+    async with conn.execute("SELECT version FROM schema_migrations") as cur:
+        return {int(r[0]) for r in await cur.fetchall()}
+
+
+async def _migrate_postgres(storage: Storage) -> list[int]:
+    done: list[int] = []
+    for version, name, statements in PG_MIGRATIONS:
+        async with storage.transaction() as tx:
+            await tx.fetchone("SELECT pg_advisory_xact_lock(?)", (_PG_LOCK_KEY,))
+            await tx.execute(_SCHEMA_MIGRATIONS_DDL)
+            if await tx.fetchone("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)):
+                continue
+            for sql in statements:
+                await tx.execute(sql)
+            await tx.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, _now()),
+            )
+        done.append(version)
+        logging.info("Applied migration %s (%s) [postgres]", version, name)
+    return done
+
+
+async def migrate(db_path: Optional[str] = None, *, storage: Optional[Storage] = None) -> list[int]:
+    """
+    Применить недостающие миграции. Вернёт список применённых сейчас версий.
+    db_path — явный SQLite-файл, storage — явный PostgresStorage (скрипты);
+    без них — БД сервисов (get_storage(): SQLite или PostgreSQL).
+    Повторный вызов в том же процессе — no-op (без запроса к БД).
+    """
+    global _applied_in_process
+    last = MIGRATIONS[-1][0]
+    if storage is not None and storage.dialect == "postgres":
+        return await _migrate_postgres(storage)
+    if db_path is None and _applied_in_process == last:
+        return []
+    if db_path is None and get_storage().dialect == "postgres":
+        done = await _migrate_postgres(get_storage())
+        _applied_in_process = last
+        return done
+    done: list[int] = []
+    async with aiosqlite.connect(db_path or DB_PATH, isolation_level=None) as conn:
+        await conn.execute("PRAGMA journal_mode=WAL")
+        applied = await _applied_versions(conn)
+        for version, name, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql in statements:
+                    await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, _now()),
+                )
+                await conn.execute("COMMIT")
+            except Exception:
+                await conn.execute("ROLLBACK")
+                logging.exception("migration %s (%s) failed", version, name)
+                raise
+            done.append(version)
+            logging.info("Applied migration %s (%s)", version, name)
+    if db_path is None:
+        _applied_in_process = last
+    return done
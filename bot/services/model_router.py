@@ -0,0 +1,312 @@
+# bot/services/model_router.py
+"""
+Маршрутизация запросов к моделям OpenRouter.
+
+- список моделей по виду запроса и тарифу (env LLM_MODELS_<KIND>[_<PLAN>], через запятую):
+  chat — полноценная консультация (история, календарь), faq — короткий самостоятельный вопрос
+  (дешёвая быстрая модель), summary — сворачивание памяти;
+- по каждой модели скользящие p50/p95 латентности и доля ошибок (последние LLM_STATS_WINDOW вызовов);
+  модели с высокой долей ошибок или после 429 («остывают» LLM_COOLDOWN_SEC) уходят в конец списка;
+- hedging: основная модель не ответила за max(p95, LLM_HEDGE_MIN_SEC) — параллельно отправляем
+  запрос следующей модели (если у планировщика есть свободный слот), берём первый успешный ответ,
+  второй отменяем (и дожидаемся отмены);
+- fallback: 408/429/5xx, таймаут или сетевая ошибка — следующая модель; прочие 4xx — ошибка как есть;
+- устойчивость (bot/services/resilience.py): на каждую модель свой circuit breaker и LLM_RETRIES
+  повторов с джиттером (Retry-After учитывается); весь вызов укладывается в LLM_TOTAL_BUDGET_SEC;
+- слоты планировщика (bot/services/llm_scheduler.py) — на попытку: на паузу перед повтором слот
+  отпускаем и занимаем заново, у hedge-запроса свой слот.
+  Breaker'ы всех моделей открыты — LLMUnavailable сразу, без ожидания таймаутов.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+import aiohttp
+
+from bot.services.llm_scheduler import FairScheduler, LLMOverloaded, SlotLease, cached_plan
+from bot.services.resilience import OPEN, CircuitBreaker, CircuitOpenError, retry_async
+
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+LLM_MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
+LLM_COOLDOWN_SEC = float(os.getenv("LLM_COOLDOWN_SEC", "30"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") not in ("0", "false", "no", "off")
+LLM_HEDGE_MIN_SEC = float(os.getenv("LLM_HEDGE_MIN_SEC", "4"))
+LLM_HEDGE_MAX_SEC = float(os.getenv("LLM_HEDGE_MAX_SEC", "15"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "1"))
+LLM_RETRY_MAX_DELAY_SEC = float(os.getenv("LLM_RETRY_MAX_DELAY_SEC", "5"))
+LLM_TOTAL_BUDGET_SEC = float(os.getenv("LLM_TOTAL_BUDGET_SEC", "45"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SEC = float(os.getenv("LLM_BREAKER_RESET_SEC", "30"))
+
+_DEFAULT_ROUTES: Dict[str, str] = {
+    "chat_premium": "anthropic/claude-3.5-sonnet,openai/gpt-4o",
+    "chat_free": "anthropic/claude-3.5-sonnet,openai/gpt-4o-mini",
+    "faq": "openai/gpt-4o-mini,anthropic/claude-3.5-haiku,anthropic/claude-3.5-sonnet",
+    "summary": os.getenv("SUMMARY_MODEL", "openai/gpt-4o-mini") + ",anthropic/claude-3.5-haiku",
+}
+
+
+def _models(kind: str, plan: str) -> List[str]:
+    """LLM_MODELS_CHAT_PREMIUM > LLM_MODELS_CHAT > встроенный список."""
+    raw = (
+        os.getenv(f"LLM_MODELS_{kind.upper()}_{plan.upper()}")
+        or os.getenv(f"LLM_MODELS_{kind.upper()}")
+        or _DEFAULT_ROUTES.get(f"{kind}_{plan}")
+        or _DEFAULT_ROUTES.get(kind)
+        or _DEFAULT_ROUTES["chat_free"]
+    )
+    out: List[str] = []
+    for m in raw.split(","):
+        m = m.strip()
+        if m and m not in out:
+            out.append(m)
+    return out
+
+
+class UpstreamError(RuntimeError):
+    """Ошибка HTTP от OpenRouter; status — код ответа."""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LLMUnavailable(RuntimeError):
+    """Ни одна модель сейчас не доступна (breaker'ы открыты / все попытки неудачны)."""
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Временная ошибка upstream: имеет смысл повторить и она считается отказом для breaker'а."""
+    if isinstance(exc, UpstreamError):
+        return exc.status in (408, 429) or exc.status >= 500
+    return isinstance(exc, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Можно ли повторить запрос на другой модели."""
+    return isinstance(exc, CircuitOpenError) or is_transient(exc)
+
+
+class ModelStats:
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+    def record_ok(self, latency: float) -> None:
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+
+    def record_error(self, exc: BaseException) -> None:
+        self.outcomes.append(False)
+        if isinstance(exc, UpstreamError) and exc.status == 429:
+            self.cooldown_until = time.monotonic() + (exc.retry_after or LLM_COOLDOWN_SEC)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        data = sorted(self.latencies)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    @property
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until and self.error_rate < LLM_MAX_ERROR_RATE
+
+
+class ModelRouter:
+    def __init__(self, *, hedge: bool = LLM_HEDGE, window: int = LLM_STATS_WINDOW):
+        self.hedge = hedge
+        self.window = window
+        self._stats: Dict[str, ModelStats] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.hedged = 0     # сколько раз отправляли запасной запрос
+        self.fallbacks = 0  # сколько раз переходили к следующей модели после ошибки
+
+    def _st(self, model: str) -> ModelStats:
+        st = self._stats.get(model)
+        if st is None:
+            st = self._stats[model] = ModelStats(self.window)
+        return st
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        br = self._breakers.get(model)
+        if br is None:
+            br = self._breakers[model] = CircuitBreaker(
+                f"llm:{model}",
+                failure_threshold=LLM_BREAKER_FAILURES,
+                reset_timeout=LLM_BREAKER_RESET_SEC,
+                is_failure=is_transient,
+            )
+        return br
+
+    async def candidates(self, owner_id: Any, kind: str) -> List[str]:
+        """Модели в порядке попыток: здоровые в порядке конфига, затем остальные (как крайний вариант)."""
+        models = _models(kind, await cached_plan(owner_id))
+        now = time.monotonic()
+        healthy = [m for m in models if self._st(m).healthy(now) and self._breaker(m).state != OPEN]
+        return healthy + [m for m in models if m not in healthy]
+
+    def hedge_delay(self, model: str) -> float:
+        p95 = self._st(model).quantile(0.95)
+        return min(LLM_HEDGE_MAX_SEC, max(LLM_HEDGE_MIN_SEC, p95 or LLM_HEDGE_MIN_SEC))
+
+    async def _attempt(
+        self,
+        model: str,
+        payload: dict,
+        post: Callable[[dict], Awaitable[Any]],
+        deadline: float,
+        lease: Optional[SlotLease] = None,
+    ) -> Any:
+        st = self._st(model)
+        br = self._breaker(model)
+
+        async def backoff(delay: float) -> None:
+            # пауза перед повтором: слот отдаём другим запросам, следующую попытку снова ставим в очередь
+            if lease is None:
+                await asyncio.sleep(delay)
+                return
+            lease.release()
+            await asyncio.sleep(delay)
+            await lease.acquire()
+
+        async def once() -> Any:
+            t0 = time.monotonic()
+            try:
+                result = await br.call(lambda: post({**payload, "model": model}))
+            except (asyncio.CancelledError, CircuitOpenError):
+                raise  # проигравший hedge / запрос не отправлялся — не ошибка модели
+            except Exception as e:
+                st.record_error(e)
+                raise
+            st.record_ok(time.monotonic() - t0)
+            return result
+
+        return await retry_async(
+            once,
+            name=f"llm:{model}",
+            attempts=LLM_RETRIES + 1,
+            retryable=is_transient,
+            max_delay=LLM_RETRY_MAX_DELAY_SEC,
+            deadline=deadline,
+            sleep=backoff,
+        )
+
+    async def complete(
+        self,
+        payload: dict,
+        *,
+        owner_id: Any,
+        kind: str,
+        post: Callable[[dict], Awaitable[Any]],
+        scheduler: Optional[FairScheduler] = None,
+    ) -> Any:
+        """
+        Ответ первой успешной модели. scheduler — справедливая очередь: каждая попытка держит свой слот
+        (не дождались — LLMOverloaded); без него слоты не занимаются.
+        """
+        models = await self.candidates(owner_id, kind)
+        deadline = 0.0
+        tasks: Dict[asyncio.Task, str] = {}
+        leases: Dict[asyncio.Task, Optional[SlotLease]] = {}
+        nxt = 0
+        last_exc: Optional[BaseException] = None
+
+        async def launch(*, wait: bool = True) -> bool:
+            nonlocal nxt, deadline
+            lease = SlotLease(scheduler, owner_id) if scheduler is not None else None
+            if lease is not None:
+                if wait:
+                    await lease.acquire()
+                elif not lease.try_acquire():
+                    return False
+            if nxt == 0:
+                deadline = time.monotonic() + LLM_TOTAL_BUDGET_SEC  # бюджет — с момента, когда получили слот
+            model = models[nxt]
+            nxt += 1
+            task = asyncio.create_task(self._attempt(model, payload, post, deadline, lease))
+            tasks[task] = model
+            leases[task] = lease
+            return True
+
+        def finish(task: asyncio.Task) -> str:
+            lease = leases.pop(task)
+            if lease is not None:
+                lease.release()
+            return tasks.pop(task)
+
+        await launch()
+        try:
+            while tasks:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise asyncio.TimeoutError("LLM time budget exceeded")
+                timeout = left
+                hedging = self.hedge and len(tasks) == 1 and nxt < len(models)
+                if hedging:
+                    timeout = min(left, self.hedge_delay(next(iter(tasks.values()))))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done and not hedging:
+                    continue  # на следующем круге сработает проверка бюджета
+                if not done:
+                    # hedge — только на свободный слот; нет его — ждём основной запрос дальше
+                    slow = next(iter(tasks.values()))
+                    if await launch(wait=False):
+                        self.hedged += 1
+                        logging.info("LLM hedge: %s is slow, also asking %s", slow, models[nxt - 1])
+                    continue
+                for t in done:
+                    model = finish(t)
+                    exc = t.exception()
+                    if exc is None:
+                        return t.result()
+                    if isinstance(exc, LLMOverloaded) and tasks:
+                        continue  # повтору не хватило слота, но параллельный запрос ещё идёт
+                    if not is_retryable(exc):
+                        raise exc
+                    if not isinstance(exc, CircuitOpenError):
+                        logging.warning("LLM %s failed (%s), falling back", model, exc.__class__.__name__)
+                    last_exc = exc
+                if not tasks and nxt < len(models):
+                    self.fallbacks += 1
+                    await launch()
+            if last_exc is None or isinstance(last_exc, CircuitOpenError):
+                raise LLMUnavailable("all LLM circuits are open")
+            raise last_exc
+        finally:
+            for t in tasks:
+                t.cancel()
+            if tasks:
+                # дожидаемся отмены проигравших: post() успевает учесть уже отправленный запрос
+                await asyncio.wait(tasks)
+            for t in list(tasks):
+                finish(t)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "hedged": self.hedged,
+            "fallbacks": self.fallbacks,
+            "models": {
+                m: {
+                    "calls": len(st.outcomes),
+                    "p50": st.quantile(0.5),
+                    "p95": st.quantile(0.95),
+                    "error_rate": st.error_rate,
+                    "cooling": now < st.cooldown_until,
+                    "circuit": self._breaker(m).state,
+                }
+                for m, st in self._stats.items()
+            },
+        }
+
+
+MODEL_ROUTER = ModelRouter()
@@ -0,0 +1,257 @@
+# bot/services/notify.py
+"""
+Исходящие уведомления главного бота через outbox.
+
+- enqueue() кладёт сообщение в таблицу notify_outbox (переживает рестарт); dedupe_key — не больше
+  одного сообщения на событие (повторный enqueue с тем же ключом игнорируется);
+- notification_dispatcher() — одна фоновая задача: token bucket на весь бот (NOTIFY_GLOBAL_RATE msg/s,
+  у Telegram ~30) и на каждый чат (1 msg/s в личке, 20 msg/min в группах);
+- TelegramRetryAfter — пауза всей отправки на retry_after, сообщение остаётся в очереди;
+  прочие временные ошибки — экспоненциальный backoff до NOTIFY_MAX_ATTEMPTS; бот заблокирован / чат
+  не найден — failed без повторов;
+- несколько реплик: строки берутся в работу атомарно (UPDATE ... status='sending' ... RETURNING), одну
+  строку отправляет один диспетчер; взятые, но не отмеченные за NOTIFY_LEASE_SEC (реплика упала), снова pending;
+- доставка «at least once»: упали между отправкой и отметкой sent — сообщение уйдёт ещё раз;
+- метрики: NOTIFY_STATS (enqueued / deduped / sent / failed / retry_after / retried) и get_notify_stats().
+"""
+from __future__ import annotations
+import asyncio
+import datetime
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+from cachetools import TTLCache
+
+from bot.services.storage import get_storage
+
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "10"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_BATCH = 200
+NOTIFY_LEASE_SEC = float(os.getenv("NOTIFY_LEASE_SEC", "300"))  # сколько строка может висеть в 'sending'
+PRIVATE_CHAT_RATE = 1.0          # msg/s в один личный чат
+GROUP_CHAT_RATE = 20 / 60.0      # msg/s в группу/канал
+IDLE_SEC = 30.0
+
+NOTIFY_STATS: "Counter[str]" = Counter()
+
+_WAKE: Optional[asyncio.Event] = None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """0 — токен взят; иначе через сколько секунд он появится."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def _ts(dt: datetime.datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _wake() -> None:
+    if _WAKE is not None:
+        _WAKE.set()
+
+
+async def enqueue(
+    chat_id: int,
+    text: str,
+    *,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    parse_mode: Optional[str] = None,
+    dedupe_key: Optional[str] = None,
+) -> bool:
+    """Поставить уведомление в очередь. False — такое (dedupe_key) уже было."""
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+    added = await get_storage().execute(
+        """
+        INSERT INTO notify_outbox (chat_id, text, reply_markup, parse_mode, dedupe_key, next_attempt_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dedupe_key) DO NOTHING
+        """,
+        (int(chat_id), text, markup, parse_mode, dedupe_key, _ts(datetime.datetime.now())),
+    ) > 0
+    NOTIFY_STATS["enqueued" if added else "deduped"] += 1
+    if added:
+        _wake()
+    return added
+
+
+# горячие запросы диспетчера — по индексу notify_outbox(status, next_attempt_at); проверяет scripts/check_query_plans.py
+# взять пачку в работу: status='sending', next_attempt_at — срок аренды; условие на status во внешнем WHERE
+# перепроверяется на свежей версии строки (PostgreSQL), так что строку забирает только одна реплика;
+# status||'' — чтобы SQLite искал строки по первичному ключу, а не перебирал индекс статуса
+_CLAIM_SQL = """
+UPDATE notify_outbox SET status='sending', next_attempt_at=?
+WHERE status || '' = 'pending' AND id IN (
+    SELECT id FROM notify_outbox
+    WHERE status='pending' AND next_attempt_at <= ?
+    ORDER BY next_attempt_at, id
+    LIMIT ?
+)
+RETURNING id, chat_id, text, reply_markup, parse_mode, attempts
+"""
+
+# аренда истекла (диспетчер упал между взятием и отметкой) — вернуть в очередь
+_RECLAIM_SQL = "UPDATE notify_outbox SET status='pending' WHERE status='sending' AND next_attempt_at <= ?"
+
+_NEXT_DUE_SQL = "SELECT MIN(next_attempt_at) FROM notify_outbox WHERE status='pending'"
+
+HOT_QUERIES = (
+    ("notify.claim", _CLAIM_SQL),
+    ("notify.reclaim", _RECLAIM_SQL),
+    ("notify.next", _NEXT_DUE_SQL),
+)
+
+
+async def _claim_due(limit: int) -> list[tuple]:
+    """Атомарно забрать в работу до limit сообщений, которым пора (плюс вернуть зависшие в очередь)."""
+    now = datetime.datetime.now()
+    storage = get_storage()
+    await storage.execute(_RECLAIM_SQL, (_ts(now),))
+    lease_until = now + datetime.timedelta(seconds=NOTIFY_LEASE_SEC)
+    rows = await storage.fetchall(_CLAIM_SQL, (_ts(lease_until), _ts(now), limit))
+    return sorted(rows, key=lambda r: r[0])  # порядок RETURNING не гарантирован
+
+
+async def _next_due_at() -> Optional[datetime.datetime]:
+    row = await get_storage().fetchone(_NEXT_DUE_SQL)
+    return datetime.datetime.fromisoformat(row[0]) if row and row[0] else None
+
+
+async def _mark(msg_id: int, status: str, error: Optional[str] = None) -> None:
+    await get_storage().execute(
+        "UPDATE notify_outbox SET status=?, attempts=attempts+1, last_error=?, sent_at=? WHERE id=?",
+        (status, error, _ts(datetime.datetime.now()) if status == "sent" else None, msg_id),
+    )
+
+
+async def _postpone(msg_id: int, delay: float, *, count_attempt: bool, error: Optional[str] = None) -> None:
+    at = datetime.datetime.now() + datetime.timedelta(seconds=max(1.0, delay))
+    await get_storage().execute(
+        "UPDATE notify_outbox SET status='pending', next_attempt_at=?, attempts=attempts+?, "
+        "last_error=COALESCE(?, last_error) WHERE id=?",
+        (_ts(at), 1 if count_attempt else 0, error, msg_id),
+    )
+
+
+class NotificationDispatcher:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.global_bucket = TokenBucket(NOTIFY_GLOBAL_RATE, capacity=NOTIFY_GLOBAL_RATE)
+        self.chat_buckets: TTLCache = TTLCache(maxsize=100_000, ttl=300)
+        self.paused_until = 0.0
+        self.sem = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        b = self.chat_buckets.get(chat_id)
+        if b is None:
+            rate = GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE
+            b = self.chat_buckets[chat_id] = TokenBucket(rate, capacity=1)
+        return b
+
+    async def _send(self, row: tuple) -> None:
+        msg_id, chat_id, text, markup, parse_mode, attempts = row
+        kwargs: Dict[str, Any] = {}
+        if markup:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.model_validate_json(markup)
+        if parse_mode:
+            kwargs["parse_mode"] = parse_mode
+        async with self.sem:
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                # flood control касается всего бота — притормаживаем всю отправку
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                NOTIFY_STATS["retry_after"] += 1
+                logging.warning("notify: flood control, pause %ss", e.retry_after)
+                await _postpone(msg_id, e.retry_after, count_attempt=False)
+                return
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                NOTIFY_STATS["failed"] += 1
+                await _mark(msg_id, "failed", e.__class__.__name__)
+                return
+            except Exception as e:
+                if attempts + 1 >= NOTIFY_MAX_ATTEMPTS:
+                    NOTIFY_STATS["failed"] += 1
+                    logging.warning("notify: giving up on %s after %s attempts: %s",
+                                    msg_id, attempts + 1, e.__class__.__name__)
+                    await _mark(msg_id, "failed", e.__class__.__name__)
+                else:
+                    NOTIFY_STATS["retried"] += 1
+                    await _postpone(msg_id, 2 ** (attempts + 1), count_attempt=True, error=e.__class__.__name__)
+                return
+        NOTIFY_STATS["sent"] += 1
+        await _mark(msg_id, "sent")
+
+    async def drain_once(self) -> int:
+        """Отправить всё, что уже пора, в пределах лимитов. Вернёт число взятых в работу сообщений."""
+        rows = await _claim_due(NOTIFY_BATCH)
+        tasks = []
+        for row in rows:
+            chat_id = int(row[1])
+            wait = self._chat_bucket(chat_id).delay()
+            if wait > 0:
+                await _postpone(row[0], wait, count_attempt=False)
+                continue
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            while (wait := self.global_bucket.delay()) > 0:
+                await asyncio.sleep(wait)
+            tasks.append(asyncio.create_task(self._send(row)))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return len(tasks)
+
+    async def run(self) -> None:
+        global _WAKE
+        _WAKE = asyncio.Event()
+        while True:
+            _WAKE.clear()
+            try:
+                if await self.drain_once():
+                    continue
+                nxt = await _next_due_at()
+                delay = IDLE_SEC if nxt is None else (nxt - datetime.datetime.now()).total_seconds()
+            except Exception:
+                logging.exception("notification dispatcher failed")
+                delay = 5.0
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(_WAKE.wait(), timeout=min(delay, IDLE_SEC))
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def notification_dispatcher(bot: Bot) -> None:
+    await NotificationDispatcher(bot).run()
+
+
+async def get_notify_stats() -> Dict[str, int]:
+    """Счётчики процесса + размер очереди по статусам."""
+    out: Dict[str, int] = dict(NOTIFY_STATS)
+    for status, n in await get_storage().fetchall("SELECT status, COUNT(*) FROM notify_outbox GROUP BY status"):
+        out[f"queue_{status}"] = int(n)
+    return out
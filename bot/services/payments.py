@@ -1,6 +1,9 @@
 from __future__ import annotations
 import asyncio
-import contextlib
+import datetime
+import logging
+import os
+import time
 from typing import Optional
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
@@ -8,25 +11,37 @@ from aiogram.fsm.state import State, StatesGroup
 from config import PRICE_premium, MANAGER_GROUP
 from keyboards import (
     keyboard_yookassa,
-    keyboard_sub,
     keyboard_subscribe,
     keyboard_return,
 )
-from payments import create, check
-from bot.services.db import get_subscription_until, set_subscription_active
+from payments import create, fetch_status
+from bot.services.db import set_subscription_active
+from bot.services.storage import get_storage
+from bot.services.subscription import schedule_expiry
+from bot.services.notify import enqueue
 
-# Константы проверки
-CHECKERS: dict[int, asyncio.Task] = {}
-MAX_ATTEMPTS = 200
-SLEEP_SECONDS = 3
+# Проверка оплаты: основной путь — webhook YooKassa (bot/web/oauth_app.py),
+# запасной — один общий поллер по всем ожидающим платежам (payment_poller).
+PAYMENT_TTL_SEC = 10 * 60            # ссылка на оплату живёт 10 минут (см. payments.create)
+PAYMENT_GRACE_SEC = 5 * 60           # после истечения ещё немного проверяем — вдруг оплатили в последний момент
+POLL_BATCH = int(os.getenv("PAY_POLL_BATCH", "50"))
+POLL_CONCURRENCY = int(os.getenv("PAY_POLL_CONCURRENCY", "5"))
+POLL_IDLE_SEC = 60.0                 # нет ожидающих платежей — спим до wake()
+WEBHOOK_FRESH_SEC = 3600             # webhook недавно приходил — поллер проверяет реже
+WEBHOOK_SLOWDOWN = 4
 
+# "expired" YooKassa не присылает — это наш локальный таймаут (PAYMENT_TTL_SEC + PAYMENT_GRACE_SEC)
+FINAL_STATUSES = ("succeeded", "canceled", "expired")
+# из каких статусов строку можно завершить: успех принимаем и после локального таймаута —
+# оплата в последний момент может подтвердиться (webhook/опрос) уже после него
+CLAIMABLE_FROM = {
+    "succeeded": ("pending", "abandoned", "expired"),
+}
+CLAIMABLE_DEFAULT = ("pending", "abandoned")
+
+_WAKE: Optional[asyncio.Event] = None
+_last_webhook_at: Optional[float] = None
 
-async def _cancel_checker(chatid: int) -> None:
-    t = CHECKERS.pop(chatid, None)
-    if t and not t.done():
-        t.cancel()
-        with contextlib.suppress(Exception):
-            await t
 
 class PaymentStates(StatesGroup):
     waiting_for_yookassa = State()
@@ -41,13 +56,128 @@ async def _safe_edit_text(message, text: str, reply_markup=None) -> None:
     except Exception:
         pass
 
+
+def _wake_poller() -> None:
+    if _WAKE is not None:
+        _WAKE.set()
+
+
+def poll_interval(age_sec: float) -> float:
+    """Через сколько проверить платёж снова: чаще в первые минуты, когда оплата наиболее вероятна."""
+    if age_sec < 120:
+        base = 5.0
+    elif age_sec < 300:
+        base = 15.0
+    else:
+        base = 60.0
+    if _last_webhook_at is not None and time.monotonic() - _last_webhook_at < WEBHOOK_FRESH_SEC:
+        base *= WEBHOOK_SLOWDOWN  # webhook работает — поллер лишь страхует
+    return base
+
+
+def _ts(dt: datetime.datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# -------- таблица ожидающих платежей --------
+
+# горячие запросы поллера — по индексу pending_payments(status, next_check_at); проверяет scripts/check_query_plans.py
+_ABANDON_SQL = "UPDATE pending_payments SET status='abandoned' WHERE user_id=? AND status='pending'"
+
+_DUE_SQL = """
+SELECT payment_id, user_id, username, created_at
+FROM pending_payments
+WHERE status='pending' AND next_check_at <= ?
+ORDER BY next_check_at
+LIMIT ?
+"""
+
+_NEXT_DUE_SQL = "SELECT MIN(next_check_at) FROM pending_payments WHERE status='pending'"
+
+HOT_QUERIES = (
+    ("payments.due", _DUE_SQL),
+    ("payments.next", _NEXT_DUE_SQL),
+    ("payments.abandon", _ABANDON_SQL),
+)
+
+async def _add_pending(payment_id: str, user_id: int, username: Optional[str]) -> None:
+    now = datetime.datetime.now()
+    async with get_storage().transaction() as tx:
+        # прежние незавершённые платежи пользователя больше не опрашиваем (webhook их всё ещё примет)
+        await tx.execute(_ABANDON_SQL, (int(user_id),))
+        await tx.execute(
+            """
+            INSERT INTO pending_payments
+                (payment_id, user_id, username, status, created_at, expires_at, next_check_at, checks)
+            VALUES (?, ?, ?, 'pending', ?, ?, ?, 0)
+            ON CONFLICT (payment_id) DO UPDATE SET
+                user_id=excluded.user_id, username=excluded.username, status=excluded.status,
+                created_at=excluded.created_at, expires_at=excluded.expires_at,
+                next_check_at=excluded.next_check_at, checks=excluded.checks
+            """,
+            (
+                payment_id, int(user_id), username, _ts(now),
+                _ts(now + datetime.timedelta(seconds=PAYMENT_TTL_SEC)),
+                _ts(now + datetime.timedelta(seconds=poll_interval(0))),
+            ),
+        )
+
+
+async def _due_pending(now: datetime.datetime, limit: int) -> list[tuple[str, int, Optional[str], str]]:
+    rows = await get_storage().fetchall(_DUE_SQL, (_ts(now), limit))
+    return [(r[0], int(r[1]), r[2], r[3]) for r in rows]
+
+
+async def _next_due_at() -> Optional[datetime.datetime]:
+    row = await get_storage().fetchone(_NEXT_DUE_SQL)
+    if not row or not row[0]:
+        return None
+    return datetime.datetime.fromisoformat(row[0])
+
+
+async def _reschedule(payment_id: str, at: datetime.datetime) -> None:
+    await get_storage().execute(
+        "UPDATE pending_payments SET next_check_at=?, checks=checks+1 WHERE payment_id=? AND status='pending'",
+        (_ts(at), payment_id),
+    )
+
+
+async def _claim(payment_id: str, status: str) -> Optional[tuple[int, Optional[str]]]:
+    """
+    Атомарно перевести платёж в финальный статус. Вернёт (user_id, username), если перевели мы —
+    так webhook и поллер (и повторные уведомления YooKassa) не активируют подписку дважды.
+    """
+    # один UPDATE ... RETURNING: условие на статус и смена статуса атомарны в любом бэкенде
+    sources = CLAIMABLE_FROM.get(status, CLAIMABLE_DEFAULT)
+    row = await get_storage().fetchone(
+        f"""
+        UPDATE pending_payments SET status=?
+        WHERE payment_id=? AND status IN ({", ".join("?" * len(sources))})
+        RETURNING user_id, username
+        """,
+        (status, payment_id, *sources),
+    )
+    if not row:
+        return None
+    return int(row[0]), row[1]
+
+
+async def abandon_user_payments(user_id: int) -> None:
+    """Пользователь отменил оплату — перестаём опрашивать его платежи."""
+    await get_storage().execute(_ABANDON_SQL, (int(user_id),))
+
+
+async def _cancel_checker(chatid: int) -> None:
+    # совместимость с роутером: раньше здесь гасилась per-user задача проверки
+    await abandon_user_payments(chatid)
+
 # -------- YooKassa --------
 
 async def start_yookassa(callback, state: FSMContext, bot: Bot) -> None:
-    # если уже что-то крутится — гасим и начинаем новое
-    await _cancel_checker(callback.from_user.id)
-
-    payment_url, payment_id = create(float(PRICE_premium), callback.from_user.id)
+    # блокирующий SDK — в отдельном потоке, чтобы не останавливать остальных ботов в процессе
+    payment_url, payment_id = await asyncio.to_thread(create, float(PRICE_premium), callback.from_user.id)
+    await _add_pending(payment_id, callback.from_user.id, callback.from_user.username)
+    _wake_poller()
 
     # чтобы текст не был захардкожен на 599
     price_text = f"{float(PRICE_premium):.2f}"
@@ -61,84 +191,130 @@ async def start_yookassa(callback, state: FSMContext, bot: Bot) -> None:
         ),
         reply_markup=keyboard_yookassa(payment_url),
     )
-    await state.set_state(PaymentStates.waiting_for_yookassa)
-    await state.update_data(payment_id=payment_id)
-
-    task = asyncio.create_task(
-        verify_yookassa(state, bot, callback.from_user.id, callback.from_user.username)
-    )
-    CHECKERS[callback.from_user.id] = task
+    # FSM-состояние не ставим: оплату подтверждают webhook и поллер, а не хендлер этого чата —
+    # «ожидание оплаты» некому было бы снять, и оно перехватывало бы следующие апдейты
 
 
-async def verify_yookassa(
-    state: FSMContext,
-    bot: Bot,
-    chatid: int,
-    username: Optional[str],
-) -> bool:
-    try:
-        user_data = await state.get_data()
-        payment_id = user_data.get("payment_id")
-        attempts = 0
-
-        while attempts < MAX_ATTEMPTS:
-            # ❶ если пользователь отменил/переключился — выходим сразу
-            if (await state.get_state()) != PaymentStates.waiting_for_yookassa.state:
-                return False
-
-            # ❷ подписка уже активна — выходим
-            if await get_subscription_until(chatid):
-                await bot.send_message(
-                    chatid,
-                    "Кажется, Вы уже оплатили подписку",
-                    reply_markup=keyboard_sub(chatid),
-                )
-                return True
-
-            # ❸ спрашиваем YooKassa
-            try:
-                paid = bool(check(payment_id))
-            except Exception:
-                paid = False
-
-            if paid:
-                await state.set_state(PaymentStates.payment_verified)
-                await set_subscription_active(chatid, username, days=30)
-                await bot.send_message(
-                    chatid,
-                    "✅ Оплата прошла успешно, подписка активирована!",
-                    reply_markup=keyboard_subscribe(),
-                )
-                await state.clear()
-                return True
+async def apply_payment_status(payment_id: str, status: str) -> bool:
+    """
+    Применить статус YooKassa к платежу (идемпотентно). Вернёт True, если платёж завершён этим вызовом.
+    """
+    if status not in FINAL_STATUSES:
+        return False
+    claimed = await _claim(payment_id, status)
+    if claimed is None:
+        return False
+    chatid, username = claimed
 
-            attempts += 1
-            await asyncio.sleep(SLEEP_SECONDS)
+    if status == "succeeded":
+        try:
+            end = await set_subscription_active(chatid, username, days=30)
+            schedule_expiry(chatid, end)
+            await enqueue(
+                chatid,
+                "✅ Оплата прошла успешно, подписка активирована!",
+                reply_markup=keyboard_subscribe(),
+                dedupe_key=f"pay-ok:{payment_id}",
+            )
+        except Exception as e:
+            await _notify_managers(e, chatid, username)
+        return True
 
-        # таймаут
-        await bot.send_message(
+    try:
+        await enqueue(
             chatid,
             "Время оплаты истекло, повторите попытку заново",
             reply_markup=keyboard_return(),
+            dedupe_key=f"pay-end:{payment_id}",
         )
-        await state.clear()
-        return False
+    except Exception:
+        logging.exception("enqueue payment notice failed for %s", chatid)
+    return True
 
-    except asyncio.CancelledError:
-        return False
+
+async def _notify_managers(e: Exception, chatid: int, username: Optional[str]) -> None:
+    try:
+        if MANAGER_GROUP and int(MANAGER_GROUP) != 0:
+            await enqueue(
+                MANAGER_GROUP,
+                (
+                    f"Ошибка {e} с оплатой (YooKassa)\n"
+                    f"<b>ID: {chatid}\n@{username}</b>"
+                ),
+                parse_mode="HTML",
+            )
+    except Exception:
+        pass
+
+
+async def handle_webhook_notification(body: dict) -> None:
+    """
+    Уведомление YooKassa ({"type": "notification", "event": "payment.succeeded", "object": {"id": ...}}).
+    Телу не доверяем: статус перепроверяем запросом к API, обрабатываем только наши платежи.
+    """
+    global _last_webhook_at
+    obj = body.get("object") or {}
+    payment_id = obj.get("id")
+    if body.get("type") != "notification" or not payment_id:
+        return
+    _last_webhook_at = time.monotonic()
+    try:
+        status = await asyncio.to_thread(fetch_status, str(payment_id))
     except Exception as e:
+        logging.warning("yookassa webhook: status check failed for %s: %s", payment_id, e.__class__.__name__)
+        _wake_poller()  # пусть поллер перепроверит
+        return
+    await apply_payment_status(str(payment_id), status)
+
+
+async def _check_one(sem: asyncio.Semaphore, payment_id: str, created_at: str) -> None:
+    created = datetime.datetime.fromisoformat(created_at)
+    now = datetime.datetime.now()
+    async with sem:
         try:
-            if MANAGER_GROUP and int(MANAGER_GROUP) != 0:
-                await bot.send_message(
-                    MANAGER_GROUP,
-                    text=(
-                        f"Ошибка {e} с оплатой (YooKassa)\n"
-                        f"<b>ID: {chatid}\n@{username}</b>"
-                    ),
-                    parse_mode="HTML",
+            status = await asyncio.to_thread(fetch_status, payment_id)
+        except Exception as e:
+            logging.warning("yookassa poll failed for %s: %s", payment_id, e.__class__.__name__)
+            status = "pending"
+    if status in FINAL_STATUSES:
+        await apply_payment_status(payment_id, status)
+        return
+    age = (now - created).total_seconds()
+    if age > PAYMENT_TTL_SEC + PAYMENT_GRACE_SEC:
+        await apply_payment_status(payment_id, "expired")
+        return
+    await _reschedule(payment_id, now + datetime.timedelta(seconds=poll_interval(age)))
+
+
+async def payment_poller() -> None:
+    """
+    Один фоновый поллер на процесс: пачкой проверяет все платежи, у которых подошло время проверки,
+    и спит до ближайшего следующего (или до wake() при новом платеже).
+    """
+    global _WAKE
+    _WAKE = asyncio.Event()
+    sem = asyncio.Semaphore(POLL_CONCURRENCY)
+    while True:
+        _WAKE.clear()
+        try:
+            due = await _due_pending(datetime.datetime.now(), POLL_BATCH)
+            if due:
+                results = await asyncio.gather(
+                    *(_check_one(sem, pid, created) for pid, _, _, created in due),
+                    return_exceptions=True,
                 )
+                for pid, res in zip((d[0] for d in due), results):
+                    if isinstance(res, Exception):
+                        logging.warning("payment %s check failed: %s", pid, res.__class__.__name__)
+                if len(due) == POLL_BATCH:
+                    continue  # есть ещё просроченные — без сна
+            nxt = await _next_due_at()
+            delay = POLL_IDLE_SEC if nxt is None else (nxt - datetime.datetime.now()).total_seconds()
         except Exception:
-            pass
-        return False
-    finally:
-        CHECKERS.pop(chatid, None)
+            logging.exception("payment_poller loop failed")
+            delay = 10.0
+        if delay > 0:
+            try:
+                await asyncio.wait_for(_WAKE.wait(), timeout=min(delay, POLL_IDLE_SEC))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,178 @@
+# bot/services/pending_store.py
+"""
+Хранилище ожидающих подтверждения действий (календарь: create/update/delete).
+
+- RedisPendingStore — по умолчанию: нативный TTL, доступно любому процессу/воркеру,
+  переживает рестарт приложения;
+- MemoryPendingStore — внутри процесса, с вытеснением по timer wheel (для dev/одного процесса).
+
+Выбор: CAL_PENDING_BACKEND=redis|memory.
+"""
+from __future__ import annotations
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Protocol, Set
+
+from providers.redis_provider import get_redis
+
+PENDING_TTL_SEC = int(os.getenv("CAL_PENDING_TTL_SEC", str(15 * 60)))
+PENDING_BACKEND = os.getenv("CAL_PENDING_BACKEND", "redis").lower()
+REDIS_PREFIX = "calpend:"
+
+# из событий-кандидатов храним только то, что нужно для выбора и применения
+_CANDIDATE_KEYS = ("id", "summary", "start", "end")
+
+
+def _compact(value: Any) -> Any:
+    """Рекурсивно выкидывает None-поля — план хранится компактно."""
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    return value
+
+
+def encode_pending(item: Dict[str, Any]) -> bytes:
+    data = dict(item)
+    cands = data.get("candidates")
+    if cands:
+        data["candidates"] = [{k: ev.get(k) for k in _CANDIDATE_KEYS if ev.get(k) is not None} for ev in cands]
+    return json.dumps(_compact(data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_pending(raw: bytes | str | None) -> Optional[Dict[str, Any]]:
+    if raw is None:
+        return None
+    try:
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        data = json.loads(raw)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class PendingStore(Protocol):
+    async def put(self, token: str, item: Dict[str, Any], ttl: int = PENDING_TTL_SEC) -> None: ...
+    async def get(self, token: str) -> Optional[Dict[str, Any]]: ...
+    async def update(self, token: str, item: Dict[str, Any]) -> bool: ...
+    async def pop(self, token: str) -> Optional[Dict[str, Any]]: ...
+
+
+class RedisPendingStore:
+    def __init__(self, prefix: str = REDIS_PREFIX):
+        self.prefix = prefix
+
+    def _key(self, token: str) -> str:
+        return f"{self.prefix}{token}"
+
+    async def put(self, token: str, item: Dict[str, Any], ttl: int = PENDING_TTL_SEC) -> None:
+        await get_redis().set(self._key(token), encode_pending(item), ex=int(ttl))
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        return decode_pending(await get_redis().get(self._key(token)))
+
+    async def update(self, token: str, item: Dict[str, Any]) -> bool:
+        """Перезаписывает значение, сохраняя исходный TTL. False — если запись уже истекла."""
+        return bool(await get_redis().set(self._key(token), encode_pending(item), xx=True, keepttl=True))
+
+    async def pop(self, token: str) -> Optional[Dict[str, Any]]:
+        return decode_pending(await get_redis().getdel(self._key(token)))
+
+
+class TimerWheel:
+    """
+    Хэшированное колесо таймеров: слот = тик истечения % число слотов.
+    Продвигается лениво (при каждом обращении к хранилищу), за один шаг — не больше одного оборота.
+    """
+
+    def __init__(self, slots: int = 512, tick_sec: float = 1.0):
+        self.slots: List[Set[str]] = [set() for _ in range(slots)]
+        self.tick_sec = tick_sec
+        self._last_tick = self._tick(time.monotonic())
+
+    def _tick(self, t: float) -> int:
+        return int(t / self.tick_sec)
+
+    def schedule(self, key: str, expires_at: float) -> None:
+        self.slots[self._tick(expires_at) % len(self.slots)].add(key)
+
+    def cancel(self, key: str, expires_at: float) -> None:
+        self.slots[self._tick(expires_at) % len(self.slots)].discard(key)
+
+    def advance(self, now: float) -> List[str]:
+        """Ключи из пройденных слотов — кандидаты на вытеснение (владелец сверит срок)."""
+        cur = self._tick(now)
+        if cur <= self._last_tick:
+            return []
+        steps = min(cur - self._last_tick, len(self.slots))
+        due: List[str] = []
+        for t in range(cur - steps + 1, cur + 1):
+            slot = self.slots[t % len(self.slots)]
+            if slot:
+                due.extend(slot)
+        self._last_tick = cur
+        return due
+
+
+class MemoryPendingStore:
+    def __init__(self, slots: int = 512):
+        self._data: Dict[str, tuple[float, bytes]] = {}
+        self._wheel = TimerWheel(slots=slots)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key in self._wheel.advance(now):
+            rec = self._data.get(key)
+            if rec is not None and rec[0] <= now:
+                self._data.pop(key, None)
+                self._wheel.cancel(key, rec[0])
+
+    async def put(self, token: str, item: Dict[str, Any], ttl: int = PENDING_TTL_SEC) -> None:
+        self._evict()
+        old = self._data.get(token)
+        if old is not None:
+            self._wheel.cancel(token, old[0])
+        expires_at = time.monotonic() + int(ttl)
+        self._data[token] = (expires_at, encode_pending(item))
+        self._wheel.schedule(token, expires_at)
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        self._evict()
+        rec = self._data.get(token)
+        if rec is None or rec[0] <= time.monotonic():
+            return None
+        return decode_pending(rec[1])
+
+    async def update(self, token: str, item: Dict[str, Any]) -> bool:
+        self._evict()
+        rec = self._data.get(token)
+        if rec is None or rec[0] <= time.monotonic():
+            return False
+        self._data[token] = (rec[0], encode_pending(item))
+        return True
+
+    async def pop(self, token: str) -> Optional[Dict[str, Any]]:
+        self._evict()
+        rec = self._data.pop(token, None)
+        if rec is None:
+            return None
+        self._wheel.cancel(token, rec[0])
+        if rec[0] <= time.monotonic():
+            return None
+        return decode_pending(rec[1])
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_STORE: Optional[PendingStore] = None
+
+
+def get_pending_store() -> PendingStore:
+    """Общий для процесса экземпляр хранилища (backend — из CAL_PENDING_BACKEND)."""
+    global _STORE
+    if _STORE is None:
+        _STORE = MemoryPendingStore() if PENDING_BACKEND == "memory" else RedisPendingStore()
+    return _STORE
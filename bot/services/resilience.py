@@ -0,0 +1,129 @@
+# bot/services/resilience.py
+"""
+Устойчивость вызовов внешних сервисов: повторы с джиттером и circuit breaker.
+
+- retry_async: ограниченное число повторов, экспоненциальная задержка с full jitter,
+  Retry-After из ошибки (атрибут retry_after) имеет приоритет; не выходит за общий дедлайн;
+- CircuitBreaker: после N подряд неудач — open (сразу CircuitOpenError, без запроса upstream),
+  через reset_timeout — half-open (один пробный запрос), успех — closed;
+- каждое изменение состояния логируется и считается в BREAKER_TRANSITIONS (для метрик).
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# (имя, из, в) -> сколько раз
+BREAKER_TRANSITIONS: "Counter[Tuple[str, str, str]]" = Counter()
+RETRY_COUNTS: "Counter[str]" = Counter()
+
+
+class CircuitOpenError(RuntimeError):
+    """Breaker открыт — запрос к upstream не отправлялся."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        is_failure: Callable[[BaseException], bool] = lambda e: True,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe = False  # в half-open пропускаем ровно один запрос
+
+    def _move(self, new: str) -> None:
+        if new == self.state:
+            return
+        BREAKER_TRANSITIONS[(self.name, self.state, new)] += 1
+        logging.warning("circuit %s: %s -> %s", self.name, self.state, new)
+        self.state = new
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._move(HALF_OPEN)
+            self._probe = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probe:
+            self._probe = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probe = False
+        self._move(CLOSED)
+
+    def record_failure(self) -> None:
+        self._probe = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._move(OPEN)
+
+    async def call(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.allow():
+            raise CircuitOpenError(f"circuit {self.name} is open")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._probe = False
+            raise
+        except Exception as e:
+            if self.is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()  # upstream ответил (например, 400) — он жив
+            raise
+        self.record_success()
+        return result
+
+
+async def retry_async(
+    fn: Callable[[], Awaitable[Any]],
+    *,
+    name: str,
+    attempts: int,
+    retryable: Callable[[BaseException], bool],
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    deadline: Optional[float] = None,
+    sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+) -> Any:
+    """
+    fn() с повторами. deadline — time.monotonic(), после которого новых попыток не делаем.
+    Retry-After длиннее max_delay или за дедлайном — сразу отдаём ошибку (пусть решает вызывающий).
+    sleep — пауза между попытками (роутер LLM на это время отпускает слот планировщика).
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= attempts or not retryable(e):
+                raise
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                delay = float(retry_after)
+            else:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            if delay > max_delay or (deadline is not None and time.monotonic() + delay >= deadline):
+                raise
+            RETRY_COUNTS[name] += 1
+            logging.info("retry %s #%d in %.2fs (%s)", name, attempt, delay, e.__class__.__name__)
+            await sleep(delay)
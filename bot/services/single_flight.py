@@ -0,0 +1,138 @@
+# bot/services/single_flight.py
+"""
+Single-flight: одинаковые параллельные запросы (чтение источника, кэшируемый вызов LLM)
+обслуживаются одним вызовом upstream.
+
+- внутри процесса: все ждут один общий Future; лидера отменили — первый ожидающий становится
+  новым лидером и вызывает сам (чужая отмена не роняет остальные запросы);
+- между процессами: лидер берёт Redis-лок (SET NX PX), кладёт результат в Redis на пару секунд,
+  остальные ждут результат; если лидер упал (лок пропал, результата нет) — вызывают сами.
+Redis недоступен — работаем только внутри процесса.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from providers.redis_provider import get_redis
+
+SF_LOCK_TTL_MS = int(os.getenv("SF_LOCK_TTL_MS", "45000"))
+SF_RESULT_TTL_MS = int(os.getenv("SF_RESULT_TTL_MS", "5000"))
+SF_WAIT_TIMEOUT_SEC = float(os.getenv("SF_WAIT_TIMEOUT_SEC", "40"))
+REDIS_PREFIX = "sf:"
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+
+class _LeaderGone(Exception):
+    """Лидер отменён до результата — ожидающие повторяют вызов сами."""
+
+
+def _redis_keys(key: str) -> tuple[str, str]:
+    h = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return f"{REDIS_PREFIX}lock:{h}", f"{REDIS_PREFIX}res:{h}"
+
+
+async def _distributed(
+    key: str,
+    fn: Callable[[], Awaitable[Any]],
+    encode: Callable[[Any], str],
+    decode: Callable[[str], Any],
+) -> Any:
+    lock_key, res_key = _redis_keys(key)
+    token = secrets.token_hex(8)
+    try:
+        r = get_redis()
+        acquired = await r.set(lock_key, token, nx=True, px=SF_LOCK_TTL_MS)
+    except Exception as e:
+        logging.debug("single_flight: redis unavailable (%s)", e.__class__.__name__)
+        return await fn()
+
+    if acquired:
+        try:
+            result = await fn()
+            try:
+                await r.set(res_key, encode(result), px=SF_RESULT_TTL_MS)
+            except Exception as e:
+                logging.debug("single_flight: result publish failed (%s)", e.__class__.__name__)
+            return result
+        finally:
+            try:
+                await r.eval(_RELEASE_LUA, 1, lock_key, token)
+            except Exception:
+                pass  # лок истечёт сам
+
+    # ждём результат лидера из другого процесса
+    deadline = time.monotonic() + SF_WAIT_TIMEOUT_SEC
+    delay = 0.05
+    while time.monotonic() < deadline:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.get(res_key)
+            pipe.exists(lock_key)
+            raw, locked = await pipe.execute()
+        except Exception:
+            break
+        if raw is not None:
+            try:
+                return decode(raw.decode("utf-8") if isinstance(raw, bytes) else raw)
+            except Exception:
+                break
+        if not locked:
+            break  # лидер завершился без результата (ошибка) — идём сами
+    return await fn()
+
+
+async def single_flight(
+    key: str,
+    fn: Callable[[], Awaitable[Any]],
+    *,
+    encode: Callable[[Any], str] = lambda v: json.dumps(v, ensure_ascii=False),
+    decode: Callable[[str], Any] = json.loads,
+    distributed: bool = True,
+) -> Any:
+    """
+    Выполнить fn() один раз на все одновременные вызовы с тем же key.
+    encode/decode — сериализация результата для ожидающих в других процессах.
+    Ошибка лидера внутри процесса достаётся всем ожидающим.
+    """
+    fut: Optional[asyncio.Future] = _INFLIGHT.get(key)
+    while fut is not None:
+        try:
+            return await asyncio.shield(fut)
+        except _LeaderGone:
+            fut = _INFLIGHT.get(key)  # уже есть новый лидер — ждём его, нет — становимся им сами
+
+    fut = asyncio.get_running_loop().create_future()
+    _INFLIGHT[key] = fut
+    try:
+        if distributed:
+            result = await _distributed(key, fn, encode, decode)
+        else:
+            result = await fn()
+    except asyncio.CancelledError:
+        # не fut.cancel(): CancelledError у ожидающих проскочил бы мимо их except Exception
+        fut.set_exception(_LeaderGone())
+        fut.exception()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # помечаем как полученное — без «exception was never retrieved»
+        raise
+    else:
+        fut.set_result(result)
+        return result
+    finally:
+        _INFLIGHT.pop(key, None)
@@ -1,56 +1,125 @@
 # bot/services/subscription.py
 from __future__ import annotations
 import asyncio
+import heapq
 import logging
-from datetime import datetime, timezone
+import os
+from datetime import datetime, timedelta
+from typing import Optional
 
-from aiogram import Bot
 from bot.services.db import (
-    find_users_to_expire,
-    mark_subscriptions_expired,
+    expire_due_subscriptions,
+    upcoming_expiries,
     get_user_token_and_doc,
 )
+from bot.services.notify import enqueue
 from openrouter import stop_bot  # твоя функция остановки дочерних ботов
 
-CHECK_INTERVAL_SEC = 60 * 30  # каждые 30 мин; можно 5–10 мин
+# Истечения планируются по min-heap (date_end, user_id): спим ровно до ближайшего.
+# Heap — только будильник: при срабатывании погашение идёт по БД (expire_due_subscriptions),
+# так что продление подписки не требует удалять старую запись из heap.
+RELOAD_INTERVAL_SEC = 10 * 60        # перечитываем ближайшие истечения (внешние правки, grant_vip.sql)
+HORIZON = timedelta(hours=1)         # в heap держим только истечения в пределах горизонта
+EXPIRY_CONCURRENCY = int(os.getenv("EXPIRY_CONCURRENCY", "5"))
+EXPIRE_BATCH = 500
 
-async def subscription_expirer(bot: Bot, interval: int = CHECK_INTERVAL_SEC):
+EXPIRED_TEXT = (
+    "⛔️ Ваша подписка закончилась. Доступ к боту приостановлен.\n"
+    "Нажмите «💰 Оплата» в меню, чтобы продлить."
+)
+
+
+class ExpiryScheduler:
+    def __init__(self):
+        self._heap: list[tuple[datetime, int]] = []
+        self._wake = asyncio.Event()
+        self._sem = asyncio.Semaphore(EXPIRY_CONCURRENCY)
+        self._loaded_until: Optional[datetime] = None
+
+    def schedule(self, user_id: int, date_end: datetime) -> None:
+        """Подписка выдана/продлена — учесть новое время истечения (если оно в пределах горизонта)."""
+        if self._loaded_until is None or date_end <= self._loaded_until:
+            heapq.heappush(self._heap, (date_end, int(user_id)))
+            self._wake.set()
+
+    async def _reload(self) -> None:
+        until = datetime.now() + HORIZON
+        rows = await upcoming_expiries(until)
+        self._heap = list(rows)
+        heapq.heapify(self._heap)
+        self._loaded_until = until
+
+    async def _finish_one(self, user_id: int, state: Optional[str]) -> None:
+        async with self._sem:
+            if state == "active":
+                try:
+                    token, _ = await get_user_token_and_doc(user_id)
+                    if token:
+                        await stop_bot(str(token))
+                except Exception:
+                    logging.exception("stop_bot failed for %s", user_id)
+            # уведомление — через outbox (лимиты Telegram, повторы); одно на пользователя в сутки
+            try:
+                await enqueue(user_id, EXPIRED_TEXT, dedupe_key=f"sub-expired:{user_id}:{datetime.now():%Y-%m-%d}")
+            except Exception:
+                logging.exception("enqueue expiry notice failed for %s", user_id)
+
+    async def expire_due(self) -> int:
+        """Погасить все истёкшие подписки (пачками), остановить ботов (параллельно, но ограниченно) и поставить уведомления."""
+        total = 0
+        while True:
+            expired = await expire_due_subscriptions(datetime.now(), limit=EXPIRE_BATCH)
+            if not expired:
+                return total
+            total += len(expired)
+            await asyncio.gather(*(self._finish_one(uid, state) for uid, state in expired))
+            if len(expired) < EXPIRE_BATCH:
+                return total
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_reload = loop.time() - RELOAD_INTERVAL_SEC  # первая итерация сразу читает БД
+        while True:
+            try:
+                if loop.time() - last_reload >= RELOAD_INTERVAL_SEC:
+                    await self._reload()
+                    last_reload = loop.time()
+                now = datetime.now()
+                if self._heap and self._heap[0][0] <= now:
+                    while self._heap and self._heap[0][0] <= now:
+                        heapq.heappop(self._heap)
+                    await self.expire_due()
+                    continue
+            except Exception:
+                logging.exception("subscription expiry scheduler failed")
+                await asyncio.sleep(10)
+                continue
+
+            delay = RELOAD_INTERVAL_SEC - (loop.time() - last_reload)
+            if self._heap:
+                delay = min(delay, (self._heap[0][0] - datetime.now()).total_seconds())
+            self._wake.clear()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+
+EXPIRY_SCHEDULER: Optional[ExpiryScheduler] = None
+
+
+def schedule_expiry(user_id: int, date_end: datetime) -> None:
+    """Сообщить планировщику о новой дате окончания (no-op, если он не запущен)."""
+    if EXPIRY_SCHEDULER is not None:
+        EXPIRY_SCHEDULER.schedule(user_id, date_end)
+
+
+async def subscription_expirer():
     """
-    Периодически помечает истёкшие подписки как неактивные,
+    Фоновая задача: гасит подписки точно в момент истечения,
     останавливает их "дочерние" боты и уведомляет пользователей.
     """
-    while True:
-        try:
-            now = datetime.now()  # оставим naive, чтобы совпадало с форматом date_end
-            to_expire = await find_users_to_expire(now)
-            if to_expire:
-                user_ids = [uid for uid, _ in to_expire]
-                # 1) пометить истекшими
-                await mark_subscriptions_expired(user_ids)
-
-                # 2) остановить активных
-                for uid, state in to_expire:
-                    if state == "active":
-                        token, _ = await get_user_token_and_doc(uid)
-                        if token:
-                            try:
-                                await stop_bot(str(token))
-                            except Exception:
-                                logging.exception("stop_bot failed for %s", uid)
-
-                # 3) уведомить
-                for uid, _ in to_expire:
-                    try:
-                        await bot.send_message(
-                            uid,
-                            "⛔️ Ваша подписка закончилась. Доступ к боту приостановлен.\n"
-                            "Нажмите «💰 Оплата» в меню, чтобы продлить.",
-                        )
-                    except Exception:
-                        # без падений, если нельзя доставить
-                        pass
-
-        except Exception:
-            logging.exception("subscription_expirer loop failed")
-
-        await asyncio.sleep(interval)
+    global EXPIRY_SCHEDULER
+    EXPIRY_SCHEDULER = ExpiryScheduler()
+    await EXPIRY_SCHEDULER.run()
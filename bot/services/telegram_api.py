@@ -0,0 +1,20 @@
+# bot/services/telegram_api.py
+"""
+Адрес Bot API для всех ботов процесса (основного и дочерних).
+TELEGRAM_API_URL задан — сессия aiogram ходит туда (локальный telegram-bot-api, стенд scripts/load_fakes.py),
+иначе — обычный api.telegram.org.
+"""
+from __future__ import annotations
+from typing import Optional
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config import TELEGRAM_API_URL
+
+
+def make_session() -> Optional[AiohttpSession]:
+    """Сессия для Bot(..., session=make_session()); None — aiogram создаст сессию по умолчанию."""
+    if not TELEGRAM_API_URL:
+        return None
+    return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
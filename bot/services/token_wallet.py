@@ -1,11 +1,20 @@
 from __future__ import annotations
 import json
 import datetime as dt
-import aiosqlite
-from typing import Optional, Tuple
+import os
+from typing import Iterable, Optional, Tuple
 
-# Берём путь к базе из существующего сервиса, чтобы всё писалось в тот же db.db
-from bot.services.db import DB_PATH  # noqa: F401
+from cachetools import TTLCache
+
+from bot.services.tokenizer import count_tokens, count_message_tokens, MESSAGE_OVERHEAD
+
+# Та же БД, что у остальных сервисов (SQLite-файл DB_PATH или PostgreSQL по DATABASE_URL)
+from bot.services.storage import get_storage
+
+
+def _now_utc() -> str:
+    # формат SQLite datetime('now') — как в уже записанных строках
+    return dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
 # === Вспомогательные даты ===
 def _month_bounds(now: Optional[dt.datetime] = None) -> tuple[str, str]:
@@ -19,56 +28,30 @@ def _month_bounds(now: Optional[dt.datetime] = None) -> tuple[str, str]:
         nxt = dt.datetime(y, m + 1, 1)
     return start.isoformat(), nxt.isoformat()
 
-# === Инициализация таблиц (одноразово на старте) ===
-async def ensure_tables() -> None:
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.executescript("""
-        PRAGMA journal_mode=WAL;
-        CREATE TABLE IF NOT EXISTS token_wallets (
-            user_id INTEGER PRIMARY KEY,
-            period_start TEXT NOT NULL,
-            period_end   TEXT NOT NULL,
-            allowance_tokens INTEGER NOT NULL,
-            spent_tokens     INTEGER NOT NULL DEFAULT 0,
-            status TEXT NOT NULL DEFAULT 'active',
-            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-        );
-        CREATE TABLE IF NOT EXISTS token_tx (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            ts TEXT NOT NULL DEFAULT (datetime('now')),
-            delta_tokens INTEGER NOT NULL,
-            reason TEXT,
-            request_id TEXT,
-            meta_json TEXT
-        );
-        CREATE INDEX IF NOT EXISTS idx_token_tx_user_ts ON token_tx(user_id, ts DESC);
-        """)
-        await conn.commit()
-
 # === Публичный API кошелька ===
 async def ensure_current_wallet(user_id: int, allowance_tokens: int) -> None:
     """Гарантирует кошелёк на текущий месяц и правильный лимит."""
     p_start, p_end = _month_bounds()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute("""
-        INSERT INTO token_wallets(user_id, period_start, period_end, allowance_tokens, spent_tokens, status)
-        VALUES(?, ?, ?, ?, 0, 'active')
-        ON CONFLICT(user_id) DO UPDATE SET
-            period_start = excluded.period_start,
-            period_end   = excluded.period_end,
-            allowance_tokens = excluded.allowance_tokens,
-            status = 'active',
-            updated_at = datetime('now')
-        """, (user_id, p_start, p_end, int(allowance_tokens)))
-        await conn.commit()
+    await get_storage().execute("""
+    INSERT INTO token_wallets(user_id, period_start, period_end, allowance_tokens, spent_tokens, status, updated_at)
+    VALUES(?, ?, ?, ?, 0, 'active', ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        period_start = excluded.period_start,
+        period_end   = excluded.period_end,
+        allowance_tokens = excluded.allowance_tokens,
+        status = 'active',
+        updated_at = excluded.updated_at
+    """, (int(user_id), p_start, p_end, int(allowance_tokens), _now_utc()))
+
+_BALANCE_SQL = "SELECT allowance_tokens, spent_tokens FROM token_wallets WHERE user_id=?"
+
+# проверяет scripts/check_query_plans.py
+HOT_QUERIES = (("wallet.balance", _BALANCE_SQL),)
+
 
 async def get_balance(user_id: int) -> Tuple[int, int, int]:
     """return (allowance, spent, remaining)"""
-    async with aiosqlite.connect(DB_PATH) as conn:
-        async with conn.execute("SELECT allowance_tokens, spent_tokens FROM token_wallets WHERE user_id=?",
-                                (user_id,)) as cur:
-            row = await cur.fetchone()
+    row = await get_storage().fetchone(_BALANCE_SQL, (int(user_id),))
     if not row:
         return 0, 0, 0
     allowance, spent = int(row[0]), int(row[1])
@@ -81,34 +64,80 @@ async def can_spend(user_id: int, tokens: int) -> bool:
         return False
     return (spent + int(tokens)) <= allowance
 
-async def debit(user_id: int, tokens: int, reason: str = "llm", request_id: Optional[str] = None, meta: Optional[dict] = None) -> bool:
-    """Атомарное списание. Вернёт True, если уложились в лимит."""
+async def debit(
+    user_id: int,
+    tokens: int,
+    reason: str = "llm",
+    request_id: Optional[str] = None,
+    meta: Optional[dict] = None,
+    *,
+    usage: Optional[dict] = None,
+    estimated_tokens: Optional[int] = None,
+    allow_overdraft: bool = False,
+) -> bool:
+    """
+    Атомарное списание. Вернёт True, если уложились в лимит.
+    usage — фактический расход из OpenRouter ({"model", "prompt_tokens", "completion_tokens",
+    "cached_tokens", "cost"}): пишется в llm_usage вместе с локальной оценкой estimated_tokens.
+    allow_overdraft — списать даже сверх лимита (фактически потраченные токены не «отменить»).
+    """
     tokens = int(tokens)
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute("BEGIN IMMEDIATE")
-        async with conn.execute("SELECT allowance_tokens, spent_tokens FROM token_wallets WHERE user_id=?",
-                                (user_id,)) as cur:
-            row = await cur.fetchone()
-            if not row:
-                await conn.execute("ROLLBACK")
-                return False
-            allowance, spent = int(row[0]), int(row[1])
-            if spent + tokens > allowance:
-                await conn.execute("ROLLBACK")
-                return False
-        await conn.execute("UPDATE token_wallets SET spent_tokens = spent_tokens + ?, updated_at=datetime('now') WHERE user_id=?",
-                           (tokens, user_id))
-        await conn.execute("""
-            INSERT INTO token_tx(user_id, delta_tokens, reason, request_id, meta_json)
-            VALUES(?, ?, ?, ?, ?)
-        """, (user_id, -tokens, reason, request_id, json.dumps(meta or {}, ensure_ascii=False)))
-        await conn.commit()
-        return True
-
-# Ненавязчивая грубая оценка токенов (пока нет usage из OpenRouter).
-# При желании заменим на реальное значение.
-def rough_token_estimate(prompt: str, completion: Optional[str]) -> int:
-    # эмпирика: ~1 токен ≈ 4 символа (для RU/EN в среднем)
-    p = len(prompt or "") // 4
-    c = len(completion or "") // 4
-    return max(1, p + c)
+    user_id = int(user_id)
+    now = _now_utc()
+    async with get_storage().transaction() as tx:
+        if usage is not None:
+            await tx.execute("""
+                INSERT INTO llm_usage(user_id, ts, reason, request_id, model, prompt_tokens, completion_tokens,
+                                      cached_tokens, cost, estimated_tokens)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                user_id, now, reason, request_id, usage.get("model"),
+                int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0),
+                int(usage.get("cached_tokens") or 0), usage.get("cost"), estimated_tokens,
+            ))
+        # проверка лимита и списание — одним UPDATE: без отдельного SELECT и гонки между ними
+        row = await tx.fetchone("""
+            UPDATE token_wallets SET spent_tokens = spent_tokens + ?, updated_at = ?
+            WHERE user_id = ? AND (? OR spent_tokens + ? <= allowance_tokens)
+            RETURNING allowance_tokens, spent_tokens
+        """, (tokens, now, user_id, bool(allow_overdraft), tokens))
+        if not row:
+            return False  # кошелька нет или не хватает лимита; usage всё равно сохраняем
+        within = int(row[1]) <= int(row[0])
+        await tx.execute("""
+            INSERT INTO token_tx(user_id, ts, delta_tokens, reason, request_id, meta_json)
+            VALUES(?, ?, ?, ?, ?, ?)
+        """, (user_id, now, -tokens, reason, request_id, json.dumps(meta or {}, ensure_ascii=False)))
+        return within
+
+
+# Сколько токенов ответа закладывать в предварительную проверку баланса
+COMPLETION_RESERVE = int(os.getenv("LLM_COMPLETION_RESERVE", "150"))
+
+# System-промпт (документ владельца + инструкции) воркеру не виден — его размер узнаём
+# из фактического usage: скользящее среднее (prompt_tokens − видимая часть) на владельца.
+_PROMPT_OVERHEAD: TTLCache = TTLCache(maxsize=10000, ttl=7 * 24 * 3600)
+_OVERHEAD_ALPHA = 0.3
+
+
+def estimate_prompt_tokens(
+    user_id: int,
+    text: str,
+    history: Optional[Iterable[Tuple[str, str]]] = None,
+    summary: Optional[str] = None,
+    *,
+    with_overhead: bool = True,
+) -> int:
+    visible = count_message_tokens(history or []) + count_tokens(text) + MESSAGE_OVERHEAD
+    if summary:
+        visible += count_tokens(summary)
+    if with_overhead:
+        visible += int(_PROMPT_OVERHEAD.get(user_id, 0))
+    return visible
+
+
+def observe_prompt_usage(user_id: int, visible_estimate: int, actual_prompt_tokens: int) -> None:
+    """Подстроить оценку скрытой части промпта по фактическому usage."""
+    diff = max(0, int(actual_prompt_tokens) - int(visible_estimate))
+    prev = _PROMPT_OVERHEAD.get(user_id)
+    _PROMPT_OVERHEAD[user_id] = diff if prev is None else prev + _OVERHEAD_ALPHA * (diff - prev)
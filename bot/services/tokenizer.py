@@ -0,0 +1,46 @@
+# bot/services/tokenizer.py
+"""
+Локальная оценка числа токенов (без сетевых вызовов и внешних зависимостей).
+
+Текст режется тем же способом, что и BPE-претокенизаторы (слова / числа по 3 цифры /
+знаки препинания), каждый кусок оценивается по средней длине BPE-токена для своего алфавита.
+Используется для предварительной проверки баланса; списание идёт по usage из OpenRouter.
+Точность видна в отчёте сверки (scripts/usage_reconciliation.py).
+"""
+from __future__ import annotations
+import math
+import re
+from typing import Iterable, Optional, Tuple
+
+# средняя длина токена в символах (cl100k/Claude-подобные словари)
+CHARS_PER_TOKEN_LATIN = 4.2
+CHARS_PER_TOKEN_CYRILLIC = 2.8
+# служебные токены на одно сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD = 4
+
+_PIECE_RE = re.compile(r"[A-Za-z]+|[А-Яа-яЁё]+|\d{1,3}|\n+|[ \t]+|[^\sA-Za-zА-Яа-яЁё\d]")
+
+
+def count_tokens(text: Optional[str]) -> int:
+    n = 0
+    for m in _PIECE_RE.finditer(text or ""):
+        p = m.group()
+        c = p[0]
+        if c == " " or c == "\t":
+            n += 0 if len(p) == 1 else 1  # одиночный пробел склеивается со следующим словом
+        elif c == "\n":
+            n += 1
+        elif c.isdigit():
+            n += 1
+        elif "A" <= c <= "z":
+            n += max(1, math.ceil(len(p) / CHARS_PER_TOKEN_LATIN))
+        elif c.isalpha():
+            n += max(1, math.ceil(len(p) / CHARS_PER_TOKEN_CYRILLIC))
+        else:
+            n += 1
+    return n
+
+
+def count_message_tokens(messages: Iterable[Tuple[str, str]]) -> int:
+    """Токены списка (role, content) с учётом служебных токенов сообщений."""
+    return sum(count_tokens(content) + MESSAGE_OVERHEAD for _, content in messages)
@@ -0,0 +1,243 @@
+# bot/services/tracing.py
+"""
+Трассировка и метрики горячего пути дочерних ботов (openrouter/worker.py::_process_text_query).
+
+- trace_request(owner_id) — одно входящее сообщение; span("answer") — этап внутри него. Длительность этапа
+  идёт в гистограмму child_stage_seconds{stage, plan, owner} и в разбивку трассы, всего запроса —
+  в child_request_seconds{plan, outcome};
+- гистограммы — фиксированные бакеты: наблюдение = bisect + два инкремента, без локов (всё в одном event loop);
+- owner в метках — не больше METRICS_MAX_OWNERS владельцев (остальные — "other"), METRICS_OWNER_LABEL=0 — без него;
+- TRACE_SLOW_MS > 0 — запросы дольше порога пишутся в лог одной строкой с разбивкой по этапам;
+- add_trace_listener(fn) — fn(trace, total) на каждый завершённый запрос (сырые длительности для
+  нагрузочного теста scripts/load_test.py; в обычной работе слушателей нет);
+- render_metrics() — текст в формате Prometheus (плюс счётчики планировщика LLM, роутера моделей,
+  breaker'ов и outbox'а), отдаётся на /metrics (bot/web/oauth_app.py).
+"""
+from __future__ import annotations
+import logging
+import os
+import sys
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_OWNER_LABEL = os.getenv("METRICS_OWNER_LABEL", "1") not in ("0", "false", "no", "off")
+METRICS_MAX_OWNERS = int(os.getenv("METRICS_MAX_OWNERS", "200"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+
+# секунды: от чтения из кэша до ответа модели с повторами
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 45.0)
+
+log = logging.getLogger(__name__)
+
+_REGISTRY: List["Histogram"] = []
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по бакетам..., +Inf, сумма]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def count(self, *labels: str) -> int:
+        s = self._series.get(labels)
+        return sum(s[:-1]) if s else 0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, s in sorted(self._series.items()):
+            base = _fmt_labels(self.labelnames, labels)
+            sep = "," if base else ""
+            acc = 0
+            for le, n in zip(self.buckets, s):
+                acc += n
+                yield f'{self.name}_bucket{{{base}{sep}le="{le:g}"}} {acc}'
+            acc += s[len(self.buckets)]
+            yield f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {acc}'
+            yield f"{self.name}_sum{{{base}}} {s[-1]:.6f}"
+            yield f"{self.name}_count{{{base}}} {acc}"
+
+
+STAGE_SECONDS = Histogram(
+    "child_stage_seconds", "Длительность этапа обработки сообщения дочерним ботом", ("stage", "plan", "owner"),
+)
+REQUEST_SECONDS = Histogram(
+    "child_request_seconds", "Полное время обработки сообщения дочерним ботом", ("plan", "outcome"),
+)
+
+
+@dataclass
+class Trace:
+    owner: str
+    plan: str = "unknown"
+    outcome: str = "ok"
+    started: float = field(default_factory=time.perf_counter)
+    # (этап, смещение от начала, длительность) — в порядке завершения
+    stages: List[Tuple[str, float, float]] = field(default_factory=list)
+
+
+_CURRENT: ContextVar[Optional[Trace]] = ContextVar("child_trace", default=None)
+_OWNERS: set = set()
+_LISTENERS: List[Callable[[Trace, float], None]] = []
+
+
+def add_trace_listener(fn: Callable[[Trace, float], None]) -> None:
+    _LISTENERS.append(fn)
+
+
+def remove_trace_listener(fn: Callable[[Trace, float], None]) -> None:
+    if fn in _LISTENERS:
+        _LISTENERS.remove(fn)
+
+
+def _owner_label(owner_id) -> str:
+    if not METRICS_OWNER_LABEL:
+        return ""
+    key = str(owner_id)
+    if key in _OWNERS:
+        return key
+    if len(_OWNERS) < METRICS_MAX_OWNERS:
+        _OWNERS.add(key)
+        return key
+    return "other"
+
+
+def current_trace() -> Optional[Trace]:
+    return _CURRENT.get()
+
+
+def set_plan(plan: str) -> None:
+    tr = _CURRENT.get()
+    if tr is not None:
+        tr.plan = plan
+
+
+def set_outcome(outcome: str) -> None:
+    tr = _CURRENT.get()
+    if tr is not None:
+        tr.outcome = outcome
+
+
+@contextmanager
+def trace_request(owner_id) -> Iterator[Trace]:
+    """Трасса одного сообщения: этапы внутри (span) попадают в неё и в метки plan/owner."""
+    tr = Trace(owner=_owner_label(owner_id))
+    token = _CURRENT.set(tr)
+    try:
+        yield tr
+    except Exception:
+        tr.outcome = "error"
+        raise
+    finally:
+        _CURRENT.reset(token)
+        total = time.perf_counter() - tr.started
+        REQUEST_SECONDS.observe(total, tr.plan, tr.outcome)
+        for fn in _LISTENERS:
+            try:
+                fn(tr, total)
+            except Exception:
+                log.exception("trace listener failed")
+        if TRACE_SLOW_MS > 0 and total * 1000 >= TRACE_SLOW_MS:
+            log.warning("slow child request: %s", format_trace(tr, total))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Этап горячего пути. Вне trace_request тоже меряется (plan="none")."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t1 = time.perf_counter()
+        tr = _CURRENT.get()
+        if tr is None:
+            STAGE_SECONDS.observe(t1 - t0, stage, "none", "")
+        else:
+            STAGE_SECONDS.observe(t1 - t0, stage, tr.plan, tr.owner)
+            tr.stages.append((stage, t0 - tr.started, t1 - t0))
+
+
+def format_trace(tr: Trace, total: float) -> str:
+    parts = " ".join(f"{name}@{off * 1000:.0f}={dur * 1000:.0f}ms" for name, off, dur in sorted(tr.stages, key=lambda s: s[1]))
+    return f"owner={tr.owner or '-'} plan={tr.plan} outcome={tr.outcome} total={total * 1000:.0f}ms {parts}"
+
+
+# ---------- экспорт ----------
+
+def _gauge(name: str, doc: str, samples: List[Tuple[str, float]], kind: str = "gauge") -> List[str]:
+    out = [f"# HELP {name} {doc}", f"# TYPE {name} {kind}"]
+    out += [f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}" for labels, value in samples]
+    return out
+
+
+def _subsystem_metrics() -> List[str]:
+    """Счётчики уже загруженных подсистем (не импортируем то, что процесс не использует)."""
+    out: List[str] = []
+    sched = sys.modules.get("bot.services.llm_scheduler")
+    if sched is not None:
+        st = sched.LLM_SCHEDULER.stats()
+        out += _gauge("llm_scheduler_active", "Вызовов LLM в работе", [("", st["active"])])
+        out += _gauge("llm_scheduler_queued", "Вызовов LLM в очереди", [("", st["queued"])])
+        out += _gauge("llm_scheduler_owners_waiting", "Владельцев с ожидающими вызовами", [("", st["owners_waiting"])])
+        out += _gauge("llm_scheduler_shed_total", "Вызовов отклонено по дедлайну очереди", [("", st["shed"])], "counter")
+    router = sys.modules.get("bot.services.model_router")
+    if router is not None:
+        st = router.MODEL_ROUTER.stats()
+        out += _gauge("llm_hedged_total", "Запущено hedge-запросов", [("", st["hedged"])], "counter")
+        out += _gauge("llm_fallbacks_total", "Ответов от резервной модели", [("", st["fallbacks"])], "counter")
+        lat, err, opened = [], [], []
+        for model, m in sorted(st["models"].items()):
+            ml = _fmt_labels(("model",), (model,))
+            for q in ("p50", "p95"):
+                if m[q] is not None:
+                    lat.append((f'{ml},quantile="{q[1:]}"', m[q]))
+            err.append((ml, m["error_rate"]))
+            opened.append((ml, 0 if m["circuit"] == "closed" else 1))
+        out += _gauge("llm_model_latency_seconds", "Латентность модели в скользящем окне", lat)
+        out += _gauge("llm_model_error_rate", "Доля ошибок модели в скользящем окне", err)
+        out += _gauge("llm_model_circuit_open", "Breaker модели не закрыт", opened)
+    res = sys.modules.get("bot.services.resilience")
+    if res is not None:
+        out += _gauge("breaker_transitions_total", "Переходы circuit breaker'ов", [
+            (_fmt_labels(("name", "from", "to"), key), n) for key, n in sorted(res.BREAKER_TRANSITIONS.items())
+        ], "counter")
+        out += _gauge("retries_total", "Повторы вызовов внешних сервисов", [
+            (_fmt_labels(("name",), (name,)), n) for name, n in sorted(res.RETRY_COUNTS.items())
+        ], "counter")
+    notify = sys.modules.get("bot.services.notify")
+    if notify is not None:
+        out += _gauge("notify_events_total", "События outbox уведомлений", [
+            (_fmt_labels(("event",), (event,)), n) for event, n in sorted(notify.NOTIFY_STATS.items())
+        ], "counter")
+    return out
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for hist in _REGISTRY:
+        lines += hist.render()
+    lines += _subsystem_metrics()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,124 @@
+# bot/services/user_profile.py
+"""
+Кэш профиля пользователя главного бота: users + user_prefs + user_terms + google_tokens одним заходом в БД.
+
+- get_profile() — профиль из кэша, на промахе одно соединение и по запросу на таблицу;
+  UserProfileMiddleware (middlewares/user_profile.py) кладёт его в data["profile"] один раз на апдейт;
+- write-through: мутаторы bot.services.db / google_oauth зовут user_changed(), и мы правим закэшированный
+  объект на месте — хендлер, уже держащий профиль, видит свои же изменения;
+- TTL страхует от внешних правок БД (grant_vip.sql и т.п.), invalidate_profile() — явный сброс;
+- google_linked — есть ли сохранённый refresh-токен (без похода в Google за refresh, как было в has_google_oauth).
+"""
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from bot.services.db import on_user_change, subscription_until_from
+from bot.services.storage import get_storage
+
+PROFILE_TTL_SEC = int(os.getenv("USER_PROFILE_TTL_SEC", "600"))
+PROFILE_MAX_USERS = int(os.getenv("USER_PROFILE_MAX_USERS", "50000"))
+
+
+@dataclass
+class UserProfile:
+    user_id: int
+    exists: bool = False
+    subscribe: Optional[str] = None
+    date_end: Optional[str] = None
+    bot_token: Optional[str] = None
+    word_file: Optional[str] = None
+    state_bot: Optional[str] = None
+    calendar_id: Optional[str] = None
+    terms_accepted: bool = False
+    google_scopes: Optional[str] = None
+
+    @property
+    def subscription_until(self) -> str | bool:
+        """Как get_subscription_until(): строка с датой окончания или False."""
+        return subscription_until_from(self.date_end)
+
+    @property
+    def bot_state(self) -> str:
+        return "active" if self.state_bot == "active" else "stop"
+
+    @property
+    def doc_id(self) -> Optional[str]:
+        """Как get_user_doc_id(): ссылка/ID источника или None."""
+        val = (str(self.word_file).strip() if self.word_file is not None else "")
+        return val or None
+
+    @property
+    def google_linked(self) -> bool:
+        return self.google_scopes is not None
+
+
+_CACHE: TTLCache = TTLCache(maxsize=PROFILE_MAX_USERS, ttl=PROFILE_TTL_SEC)
+
+# по запросу на таблицу, все по первичному ключу; проверяет scripts/check_query_plans.py
+_USER_SQL = "SELECT subscribe, date_end, bot_token, word_file, state_bot FROM users WHERE id = ?"
+_PREFS_SQL = "SELECT calendar_id FROM user_prefs WHERE user_id = ?"
+_TERMS_SQL = "SELECT 1 FROM user_terms WHERE user_id = ?"
+_GOOGLE_SQL = "SELECT scopes FROM google_tokens WHERE user_id = ?"
+
+HOT_QUERIES = (
+    ("profile.users", _USER_SQL),
+    ("profile.user_prefs", _PREFS_SQL),
+    ("profile.user_terms", _TERMS_SQL),
+    ("profile.google_tokens", _GOOGLE_SQL),
+)
+
+
+async def _load(user_id: int) -> UserProfile:
+    prof = UserProfile(user_id=user_id)
+    async with get_storage().connection() as tx:
+        row = await tx.fetchone(_USER_SQL, (user_id,))
+        if row:
+            prof.exists = True
+            prof.subscribe, prof.date_end, prof.bot_token, prof.word_file, prof.state_bot = row
+        row = await tx.fetchone(_PREFS_SQL, (user_id,))
+        prof.calendar_id = row[0] if row else None
+        prof.terms_accepted = await tx.fetchone(_TERMS_SQL, (user_id,)) is not None
+        row = await tx.fetchone(_GOOGLE_SQL, (user_id,))
+        prof.google_scopes = (row[0] or "") if row else None
+    return prof
+
+
+async def get_profile(user_id: int) -> UserProfile:
+    key = int(user_id)
+    prof = _CACHE.get(key)
+    if prof is None:
+        prof = await _load(key)
+        _CACHE[key] = prof
+    return prof
+
+
+def peek_profile(user_id: int) -> Optional[UserProfile]:
+    """Профиль из кэша без обращения к БД (None — в кэше нет)."""
+    return _CACHE.get(int(user_id))
+
+
+async def get_bot_state(user_id: int) -> str:
+    """'active' или 'stop'."""
+    return (await get_profile(user_id)).bot_state
+
+
+def invalidate_profile(user_id: int) -> None:
+    _CACHE.pop(int(user_id), None)
+
+
+def _on_user_change(user_id: int, fields: Dict[str, Any]) -> None:
+    if not fields:
+        invalidate_profile(user_id)
+        return
+    prof = _CACHE.get(user_id)
+    if prof is None:
+        return
+    for name, value in fields.items():
+        setattr(prof, name, value)
+
+
+on_user_change(_on_user_change)
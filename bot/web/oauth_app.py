@@ -1,5 +1,10 @@
 # bot/web/oauth_app.py
 from __future__ import annotations
+import asyncio
+import hmac
+import ipaddress
+import logging
+import os
 from aiohttp import web
 from aiogram import Bot
 
@@ -7,9 +12,67 @@ from config import OAUTH_HOST, OAUTH_PORT
 from bot.services.google_oauth import (
     build_auth_url, parse_state, exchange_code_for_tokens, save_refresh_token,
 )
+from bot.services.calendar_prefs import invalidate_calendar_prefs
+from bot.services.payments import handle_webhook_notification
+from bot.services.notify import enqueue
+from bot.services.tracing import render_metrics
+
+
+def _networks(value: str) -> list:
+    return [ipaddress.ip_network(x.strip(), strict=False) for x in value.split(",") if x.strip()]
+
+
+# Необязательный allowlist адресов YooKassa (через запятую, CIDR). Статус платежа всё равно
+# перепроверяется запросом к API (handle_webhook_notification -> fetch_status), так что поддельное
+# уведомление ничего не активирует.
+YOOKASSA_WEBHOOK_IPS = _networks(os.getenv("YOOKASSA_WEBHOOK_IPS", ""))
+# Прокси, которым верим в X-Real-IP / X-Forwarded-For (Caddy в docker-сети). Заголовки от остальных игнорируем.
+TRUSTED_PROXIES = _networks(os.getenv("TRUSTED_PROXIES", "127.0.0.1/32,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16"))
+
+
+def _trusted(ip) -> bool:
+    return any(ip in net for net in TRUSTED_PROXIES)
+
+
+def client_ip(remote: str | None, headers) -> ipaddress.IPv4Address | ipaddress.IPv6Address | None:
+    """
+    Адрес клиента. Соединение не от доверенного прокси — это и есть клиент (заголовкам не верим).
+    От прокси — X-Real-IP, иначе самый правый недоверенный адрес X-Forwarded-For (левые части мог подставить клиент).
+    """
+    try:
+        ip = ipaddress.ip_address(remote or "")
+    except ValueError:
+        return None
+    if not _trusted(ip):
+        return ip
+    real = (headers.get("X-Real-IP") or "").strip()
+    if real:
+        try:
+            return ipaddress.ip_address(real)
+        except ValueError:
+            return None
+    for part in reversed((headers.get("X-Forwarded-For") or "").split(",")):
+        try:
+            hop = ipaddress.ip_address(part.strip())
+        except ValueError:
+            return None
+        if not _trusted(hop):
+            return hop
+    return ip
+
+# /metrics (Prometheus): отдаётся только с Bearer METRICS_TOKEN; без токена маршрут отвечает 404
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
 
 routes = web.RouteTableDef()
 
+_BG: set[asyncio.Task] = set()
+
+
+def _webhook_done(task: asyncio.Task) -> None:
+    _BG.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("yookassa webhook handling failed: %s", task.exception().__class__.__name__)
+
 def make_app(bot: Bot) -> web.Application:
     app = web.Application()
 
@@ -35,15 +98,33 @@ def make_app(bot: Bot) -> web.Application:
         try:
             creds = await exchange_code_for_tokens(code)
             await save_refresh_token(user_id, creds)
+            invalidate_calendar_prefs(user_id)
             # уведомим пользователя в TG
             try:
-                await bot.send_message(user_id, "✅ Google подключён. Можно использовать Docs/Sheets без постоянного входа в аккаунт.")
+                await enqueue(user_id, "✅ Google подключён. Можно использовать Docs/Sheets без постоянного входа в аккаунт.")
             except Exception:
-                pass
+                logging.exception("enqueue oauth notice failed for %s", user_id)
             return web.Response(text="Success! You can return to Telegram.")
         except Exception as e:
             return web.Response(text=f"OAuth error: {e}", status=500)
 
+    async def yookassa_webhook(request: web.Request) -> web.Response:
+        if YOOKASSA_WEBHOOK_IPS:
+            # за Caddy request.remote — адрес прокси; настоящий отправитель — в его заголовках
+            ip = client_ip(request.remote, request.headers)
+            if ip is None or not any(ip in net for net in YOOKASSA_WEBHOOK_IPS):
+                return web.Response(status=403)
+        try:
+            body = await request.json()
+        except Exception:
+            return web.Response(text="bad json", status=400)
+        # отвечаем сразу, проверку делаем в фоне — YooKassa ждёт 200 недолго и повторяет уведомления
+        task = asyncio.create_task(handle_webhook_notification(body))
+        _BG.add(task)
+        task.add_done_callback(_webhook_done)
+        return web.Response(text="ok")
+
+    app.router.add_post("/pay/yookassa/webhook", yookassa_webhook)
     app.router.add_get("/oauth/google/start", start)
     app.router.add_get("/oauth/google/callback", callback)
     app.add_routes(routes)
@@ -59,4 +140,14 @@ async def start_oauth_webserver(bot: Bot):
 
 @routes.get("/oauth/health")
 async def health(_):
-    return web.Response(text="ok")
\ No newline at end of file
+    return web.Response(text="ok")
+
+@routes.get("/metrics")
+async def metrics(request: web.Request) -> web.Response:
+    if not METRICS_TOKEN:
+        return web.Response(status=404)
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        return web.Response(status=401)
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
\ No newline at end of file
@@ -10,6 +10,8 @@ TOKEN = os.getenv("BOT_TOKEN")
 MANAGER_URL = os.getenv("MANAGER_URL", "https://t.me/your_manager")
 # Use 0 if MANAGER_GROUP is not set (no notifications). Negative for channels/supergroups.
 MANAGER_GROUP = int(os.getenv("MANAGER_GROUP", "0"))
+# Другой адрес Bot API (локальный telegram-bot-api или стенд scripts/load_fakes.py); пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip()
 
 # === Crypto Bot (CryptoPay / aiosend) ===
 ASSET = os.getenv("CRYPTO_ASSET", "USDT")
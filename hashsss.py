@@ -1,28 +1,35 @@
 # hashsss.py
 
 from __future__ import annotations
-from typing import Optional
+from dataclasses import dataclass, field, replace
+from typing import Any, Optional
+import asyncio
 import os
+import json
 import hashlib
 import aiohttp
 import ssl
 import certifi
-from dotenv import load_dotenv
 
-from providers.redis_provider import cache_get, cache_setex, delete_by_pattern
+import config  # noqa: F401  — .env загружается в config (load_dotenv), здесь только читаем os.getenv
+from bot.services import answer_cache
+from bot.services.single_flight import single_flight
+from bot.services.llm_scheduler import LLM_SCHEDULER
+from bot.services.model_router import MODEL_ROUTER, UpstreamError, LLMUnavailable
+from bot.services.tracing import span
 from deepseek import doc
 import logging
-logging.basicConfig(level=logging.INFO)
-
-load_dotenv(override=True)
 
 OPEN_ROUTER_API_KEY = os.getenv("OPEN_ROUTER_API_KEY") or os.getenv("OR_API_KEY")
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_URL = os.getenv("OPENROUTER_URL") or "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_REFERER = os.getenv("OPEN_ROUTER_REFERER")
 OPENROUTER_TITLE = os.getenv("OPEN_ROUTER_TITLE")
 
-MODEL = "anthropic/claude-3.5-sonnet"
-TTL_SECONDS = 3600  # 1 час
+# модели выбирает bot/services/model_router.py (LLM_MODELS_CHAT / LLM_MODELS_FAQ / LLM_MODELS_SUMMARY)
+# таймауты одной попытки по фазам: соединение / ожидание данных / вся попытка
+LLM_CONNECT_TIMEOUT_SEC = float(os.getenv("LLM_CONNECT_TIMEOUT_SEC", "5"))
+LLM_READ_TIMEOUT_SEC = float(os.getenv("LLM_READ_TIMEOUT_SEC", "25"))
+LLM_ATTEMPT_TIMEOUT_SEC = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SEC", "30"))
 
 
 def _md5(s: str) -> str:
@@ -32,6 +39,86 @@ def _system_hash(system_content: str) -> str:
     return _md5(system_content)[:16]
 
 
+@dataclass
+class ToolCall:
+    name: str
+    arguments: dict[str, Any]
+    id: str | None = None
+
+
+@dataclass
+class Usage:
+    """Фактический расход по данным OpenRouter (usage в ответе chat/completions)."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float | None = None
+    model: str | None = None
+    # промпты отменённых hedge-запросов (OpenRouter их уже принял); оценка по промпту победителя
+    hedge_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens + self.hedge_tokens
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost": self.cost,
+        }
+
+
+@dataclass
+class LLMReply:
+    """Ответ модели: текст + структурированные вызовы инструментов (если передавали tools=)."""
+    text: str
+    tool_calls: list[ToolCall] = field(default_factory=list)
+    usage: Usage | None = None
+    from_cache: bool = False  # ответ из кэша / чужого вызова — модель для нас не вызывалась
+
+    def __str__(self) -> str:
+        return self.text
+
+
+def _parse_usage(data: dict) -> Usage | None:
+    u = data.get("usage")
+    if not isinstance(u, dict):
+        return None
+    details = u.get("prompt_tokens_details") or {}
+    cost = u.get("cost")
+    return Usage(
+        prompt_tokens=int(u.get("prompt_tokens") or 0),
+        completion_tokens=int(u.get("completion_tokens") or 0),
+        cached_tokens=int(details.get("cached_tokens") or 0),
+        cost=float(cost) if cost is not None else None,
+        model=data.get("model"),
+    )
+
+
+def _parse_tool_calls(message: dict) -> list[ToolCall]:
+    out: list[ToolCall] = []
+    for tc in message.get("tool_calls") or []:
+        fn = tc.get("function") or {}
+        name = fn.get("name")
+        if not name:
+            continue
+        raw_args = fn.get("arguments") or "{}"
+        try:
+            args = json.loads(raw_args) if isinstance(raw_args, str) else dict(raw_args)
+        except Exception:
+            # битые аргументы не превращаем молча в «нет действия» — пишем в лог
+            logging.warning("tool call %s: invalid JSON arguments", name)
+            continue
+        if not isinstance(args, dict):
+            logging.warning("tool call %s: arguments is not an object", name)
+            continue
+        out.append(ToolCall(name=name, arguments=args, id=tc.get("id")))
+    return out
+
+
 def build_system_prompt(ans: dict | None) -> str:
     """
     ans может быть None, если doc_id не задан или источник недоступен.
@@ -73,20 +160,128 @@ def build_system_prompt(ans: dict | None) -> str:
     )
 
 
+async def _chat_completion(payload: dict, owner_id: int | None = None, kind: str = "chat") -> LLMReply:
+    """
+    Один запрос к OpenRouter chat/completions (через справедливую очередь владельцев).
+    Модель (и запасные) подбирает роутер по kind: "chat" / "faq" / "summary".
+    """
+    abandoned = 0
+
+    async def post(attempt_payload: dict) -> LLMReply:
+        nonlocal abandoned
+        try:
+            return await _post_chat(attempt_payload)
+        except asyncio.CancelledError:
+            abandoned += 1  # проигравший hedge: запрос ушёл, ответ не нужен
+            raise
+
+    # слоты справедливой очереди роутер занимает на каждую попытку (и отпускает на паузы между ними)
+    reply = await MODEL_ROUTER.complete(payload, owner_id=owner_id, kind=kind, post=post, scheduler=LLM_SCHEDULER)
+    if abandoned and reply.usage is not None:
+        reply.usage.hedge_tokens = abandoned * reply.usage.prompt_tokens
+    return reply
+
+
+async def _post_chat(payload: dict) -> LLMReply:
+    if not OPEN_ROUTER_API_KEY:
+        raise RuntimeError("OPEN_ROUTER_API_KEY is not set (add it to .env).")
+
+    headers = {
+        "Authorization": f"Bearer {OPEN_ROUTER_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    if OPENROUTER_REFERER:
+        headers["HTTP-Referer"] = OPENROUTER_REFERER
+    if OPENROUTER_TITLE:
+        headers["X-Title"] = OPENROUTER_TITLE
+
+    # usage accounting: OpenRouter вернёт фактические токены и стоимость в поле usage
+    payload = {**payload, "usage": {"include": True}}
+
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    timeout = aiohttp.ClientTimeout(
+        total=LLM_ATTEMPT_TIMEOUT_SEC,
+        sock_connect=LLM_CONNECT_TIMEOUT_SEC,
+        sock_read=LLM_READ_TIMEOUT_SEC,
+    )
+    async with aiohttp.ClientSession(timeout=timeout,
+                                     connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
+        async with session.post(OPENROUTER_URL, json=payload, headers=headers) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status >= 400:
+                hint = " (Invalid key OR missing HTTP-Referer for Project Key)" if resp.status == 401 else ""
+                try:
+                    retry_after = float(resp.headers.get("Retry-After") or 0) or None
+                except ValueError:
+                    retry_after = None
+                raise UpstreamError(resp.status, f"OpenRouter error {resp.status}{hint}: {data}", retry_after)
+            try:
+                message = data["choices"][0]["message"]
+                return LLMReply(
+                    text=message.get("content") or "",
+                    tool_calls=_parse_tool_calls(message),
+                    usage=_parse_usage(data),
+                )
+            except Exception:
+                raise RuntimeError(f"Unexpected OpenRouter response shape: {data}")
+
+
+SUMMARY_SYSTEM = (
+    "Ты ведёшь краткий конспект переписки менеджера с клиентом. "
+    "Обнови конспект с учётом новых реплик: имя и контакты клиента, его потребности, "
+    "выбранные товары/услуги, цены, договорённости, даты и открытые вопросы. "
+    "Пиши по-русски, фактами, без воды, не больше {max_words} слов. Верни только текст конспекта."
+)
+
+
+async def summarize_dialog(
+    previous: str | None,
+    turns: list[tuple[str, str]],
+    max_words: int = 120,
+    owner_id: int | None = None,
+) -> LLMReply:
+    """Сворачивает старые реплики в rolling summary (дешёвые модели kind="summary"); текст — .text."""
+    lines = []
+    for role, msg in turns:
+        who = "Менеджер" if role == "assistant" else "Клиент"
+        lines.append(f"{who}: {(msg or '').strip()}")
+    user = (
+        f"Текущий конспект:\n{(previous or '').strip() or '(пусто)'}\n\n"
+        "Новые реплики:\n" + "\n".join(lines)
+    )
+    payload = {
+        "messages": [
+            {"role": "system", "content": SUMMARY_SYSTEM.format(max_words=max_words)},
+            {"role": "user", "content": user},
+        ],
+        "max_tokens": max_words * 4,
+    }
+    result = await _chat_completion(payload, owner_id=owner_id, kind="summary")
+    result.text = result.text.strip()
+    return result
+
+
 async def answer(
     text: str,
     doc_id: str,
     owner_id: int | None = None,
     history: list[tuple[str, str]] | None = None,
     extra_system: str | None = None,   # ✅ добавили
-) -> str:
+    tools: list[dict] | None = None,   # OpenAI-совместимые схемы инструментов (tool calling)
+    memory_summary: str | None = None,  # сжатое содержание ранней части диалога
+) -> LLMReply:
     ans = None
     source_error = None
 
     # ✅ больше НЕ делаем ранний return при пустом doc_id
     if (doc_id or "").strip():
         try:
-            ans = await doc(doc_id, owner_user_id=owner_id)  # {'id','title','content','kind'}
+            # одновременные запросы к тому же источнику делят одно чтение
+            with span("source"):
+                ans = await single_flight(
+                    f"doc:{owner_id}:{doc_id.strip()}",
+                    lambda: doc(doc_id, owner_user_id=owner_id),
+                )  # {'id','title','content','kind'}
         except FileNotFoundError:
             source_error = "Документ/таблица не найдены или нет доступа."
         except Exception as e:
@@ -101,24 +296,54 @@ async def answer(
             "Если вопрос пользователя требует данных из источника — честно сообщи об этом."
         )
 
-    # ✅ добавляем системные инструкции календаря (если передали)
-    if extra_system and extra_system.strip():
-        system_content += "\n\n" + extra_system.strip()
+    # --- КЭШ FAQ: вопрос понятен без истории -> отвечаем без неё и кэшируем ---
+    # (календарные инструкции/инструменты означают возможное действие — такие ответы не кэшируем)
+    doc_key = (doc_id or "").strip() or "no-doc"
+    source_ver = _system_hash(system_content)
+    if (not tools and not source_error and not (extra_system or "").strip()
+            and answer_cache.is_history_independent(text, has_history=bool(history or memory_summary))):
+        with span("cache_lookup"):
+            cached = await answer_cache.lookup(owner_id, doc_key, source_ver, text)
+        if cached is not None:
+            return LLMReply(text=cached, from_cache=True)
 
-    sys_hash = _system_hash(system_content)
+        leader = False
 
-    # --- КЭШ ТОЛЬКО БЕЗ ИСТОРИИ ---
-    cache_key = None
-    if not history:
-        doc_key = (doc_id or "").strip() or "no-doc"
-        cache_key = f"openrouter:{doc_key}:{sys_hash}:{_md5(text)}"
-        cached = await cache_get(cache_key)
-        if cached is not None:
-            return cached
+        async def _faq_call() -> LLMReply:
+            nonlocal leader
+            leader = True
+            # короткий самостоятельный вопрос — быстрая дешёвая модель
+            result = await _chat_completion({
+                "messages": [
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": text},
+                ],
+            }, owner_id=owner_id, kind="faq")
+            if result.text.strip() and not result.tool_calls:
+                await answer_cache.store(
+                    doc_key, source_ver, text, result.text,
+                    tokens=result.usage.total_tokens if result.usage else 0,
+                )
+            return result
+
+        # одинаковые FAQ-вопросы «в моменте» — один вызов модели на всех;
+        # расход списывается только с того, чей вызов реально ушёл в модель
+        with span("model"):
+            result = await single_flight(
+                answer_cache.flight_key(doc_key, source_ver, text),
+                _faq_call,
+                encode=lambda r: r.text,
+                decode=lambda s: LLMReply(text=s),
+            )
+        return result if leader else replace(result, usage=None, from_cache=True)
     # --- конец блока кэша ---
 
-    if not OPEN_ROUTER_API_KEY:
-        raise RuntimeError("OPEN_ROUTER_API_KEY is not set (add it to .env).")
+    # ✅ добавляем системные инструкции календаря (если передали)
+    if extra_system and extra_system.strip():
+        system_content += "\n\n" + extra_system.strip()
+
+    if memory_summary and memory_summary.strip():
+        system_content += "\n\nКраткое содержание предыдущего диалога с этим клиентом:\n" + memory_summary.strip()
 
     messages = [{"role": "system", "content": system_content}]
 
@@ -132,31 +357,18 @@ async def answer(
 
     messages.append({"role": "user", "content": text})
 
-    payload = {"model": MODEL, "messages": messages}
-    headers = {
-        "Authorization": f"Bearer {OPEN_ROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    if OPENROUTER_REFERER:
-        headers["HTTP-Referer"] = OPENROUTER_REFERER
-    if OPENROUTER_TITLE:
-        headers["X-Title"] = OPENROUTER_TITLE
-
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    timeout = aiohttp.ClientTimeout(total=30)
-    async with aiohttp.ClientSession(timeout=timeout,
-                                     connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
-        async with session.post(OPENROUTER_URL, json=payload, headers=headers) as resp:
-            data = await resp.json(content_type=None)
-            if resp.status >= 400:
-                hint = " (Invalid key OR missing HTTP-Referer for Project Key)" if resp.status == 401 else ""
-                raise RuntimeError(f"OpenRouter error {resp.status}{hint}: {data}")
-            try:
-                result = data["choices"][0]["message"]["content"]
-            except Exception:
-                raise RuntimeError(f"Unexpected OpenRouter response shape: {data}")
-
-    if cache_key:
-        await cache_setex(cache_key, TTL_SECONDS, result)
-
-    return result
+    payload = {"messages": messages}
+    if tools:
+        payload["tools"] = tools
+        payload["tool_choice"] = "auto"
+    try:
+        with span("model"):
+            return await _chat_completion(payload, owner_id=owner_id)
+    except LLMUnavailable:
+        # деградация: модели недоступны — отдаём ответ на похожий вопрос из кэша, если он есть
+        if tools or source_error:
+            raise
+        cached = await answer_cache.lookup(owner_id, doc_key, source_ver, text)
+        if cached is None:
+            raise
+        return LLMReply(text=cached, from_cache=True)
@@ -1,8 +1,8 @@
 from __future__ import annotations
-import sqlite3
 from aiogram.types import KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from config import MANAGER_URL, CRYPTO_ENABLED
+from bot.services.user_profile import peek_profile
 
 # ---------------- Reply keyboards ----------------
 CB_CANCEL = "pay_cancel"
@@ -34,14 +34,15 @@ def r_keyboard_sub(user_id: int = None):
 
 # ---------------- Inline keyboards ----------------
 
-def keyboard_sub(user_id: int):
+def keyboard_sub(user_id: int, bot_state: str | None = None):
     """
     Главное меню для подписчиков.
-    Первая кнопка показывает текущее состояние бота по пользователю.
+    Первая кнопка показывает текущее состояние бота по пользователю:
+    bot_state — profile.bot_state; без него берём из кэша профиля (БД не трогаем).
     """
     builder = InlineKeyboardBuilder()
     builder.add(
-        InlineKeyboardButton(text=state_bot(user_id), callback_data="turn_on_off"),
+        InlineKeyboardButton(text=state_bot(user_id, bot_state), callback_data="turn_on_off"),
         InlineKeyboardButton(text="🔧 Настройка Бота ", callback_data="setting_bot"),
         InlineKeyboardButton(text="📝 Просмотр и редактирование промпта", callback_data="prompt"),
         InlineKeyboardButton(text="⏳ Подписка", callback_data="check_sub"),
@@ -155,25 +156,15 @@ def keyboard_setting_bot():
 
 # ---------------- Helpers ----------------
 
-def state_bot(user_id: int) -> str:
+def state_bot(user_id: int, bot_state: str | None = None) -> str:
     """
-    Синхронная проверка состояния бота пользователя.
-    Оставляем синхронной, чтобы не менять сигнатуры остальных функций.
-    В случае ошибки — безопасно возвращаем «выключен».
+    Подпись кнопки состояния бота. Без I/O: состояние передаётся явно
+    или берётся из кэша bot.services.user_profile (нет в кэше — «выключен»).
     """
-    try:
-        conn = sqlite3.connect("db.db")
-        cursor = conn.cursor()
-        row = cursor.execute(
-            "SELECT state_bot FROM users WHERE id = ?",
-            (user_id,),
-        ).fetchone()
-        conn.close()
-        state = (row[0] if row else None) or "stop"
-        return "🤖✅ Бот включен" if state == "active" else "🤖❌ Бот выключен"
-    except Exception:
-        # лог можно добавить на вкус
-        return "🤖❌ Бот выключен"
+    if bot_state is None:
+        prof = peek_profile(user_id)
+        bot_state = prof.bot_state if prof is not None else None
+    return "🤖✅ Бот включен" if bot_state == "active" else "🤖❌ Бот выключен"
 
 def keyboard_calendar_menu(is_linked: bool):
     kb = InlineKeyboardBuilder()
@@ -4,25 +4,31 @@ import logging
 from contextlib import suppress
 import signal
 import os
+import importlib
 from aiogram import Bot, Dispatcher, Router
-from aiosend import CryptoPay
 
-from config import TOKEN, CRYPTOTOKEN
+from config import TOKEN
 from bot.web.oauth_app import start_oauth_webserver
 
 # Необязательно, но полезно: фоновая задача, которая гасит истёкшие подписки
 # Если файла нет — можно временно закомментировать импорт и запуск.
 from bot.services.subscription import subscription_expirer
-from bot.services.token_wallet import ensure_tables
+from bot.services.payments import payment_poller
+from bot.services.notify import notification_dispatcher
+from bot.services.migrations import migrate
+from bot.services.memory import flush_pending
+from bot.services.storage import close_storage
+from bot.services.telegram_api import make_session
 # ↓↓↓ NEW: импорты для лимитов ↓↓↓
 from middlewares.rate_limit import parse_admins, RateLimitMiddleware
+from middlewares.user_profile import UserProfileMiddleware
 from providers.redis_provider import get_redis
 from bot.services.limits import RPM_MAP, RPD_MAP, resolve_plan
 # ↑↑↑ NEW ↑↑↑
 
 # === Инициализация ===
-# cp = CryptoPay(CRYPTOTOKEN)  # если не используешь здесь — можно удалить
-bot = Bot(TOKEN)
+# CryptoPay (aiosend) здесь не нужен; если понадобится — импортировать по месту использования
+bot = Bot(TOKEN, session=make_session())
 dp = Dispatcher()
 router = Router(name="core")  # если пустой — можно не подключать
 
@@ -41,6 +47,36 @@ dp.include_router(reply_router)
 dp.include_router(router)
 
 
+# Тяжёлые подсистемы импортируются лениво (при первом использовании). Чтобы первый запрос
+# не платил за импорт, после старта polling прогреваем их в фоне, в отдельном потоке.
+WARMUP_MODULES = (
+    "googleapiclient.discovery",
+    "google_auth_oauthlib.flow",
+    "google.oauth2.credentials",
+    "google.auth.transport.requests",
+    "yookassa",
+)
+STT_PRELOAD = os.getenv("STT_PRELOAD", "0") in ("1", "true", "yes")
+
+
+def _import_all(names) -> None:
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logging.warning("warm-up import %s failed: %s", name, e.__class__.__name__)
+
+
+async def _warmup() -> None:
+    await asyncio.sleep(0)  # сначала даём стартовать polling
+    await asyncio.to_thread(_import_all, WARMUP_MODULES)
+    if STT_PRELOAD:
+        from stt.provider import preload
+        with suppress(Exception):
+            await preload()
+    logging.info("Warm-up complete")
+
+
 async def _run():
     """
     Поднимаем OAuth веб-сервер, запускаем фоновые задачи и polling.
@@ -58,6 +94,10 @@ async def _run():
         metric_prefix="rl-main",
     )
     dp.message.middleware(limiter)
+    # профиль пользователя — один раз на апдейт (после лимитера: отбитые сообщения в БД не ходят)
+    profile_mw = UserProfileMiddleware()
+    dp.message.middleware(profile_mw)
+    dp.callback_query.middleware(profile_mw)
     # перехват сигналов (на Windows SIGTERM может быть недоступен — игнорируем)
     stop_event = asyncio.Event()
 
@@ -72,12 +112,12 @@ async def _run():
             loop.add_signal_handler(sig, _stop)
 
     try:
-        # 0) Инициализация таблиц кошелька
+        # 0) Схема БД: версионированные миграции (bot/services/migrations.py)
         try:
-            await ensure_tables()
-            logging.info("Token wallet tables are ready")
+            applied = await migrate()
+            logging.info("DB schema is up to date (applied now: %s)", applied or "none")
         except Exception:
-            logging.exception("Failed to ensure token_wallet tables")
+            logging.exception("Failed to migrate DB schema")
 
         # 2) OAuth веб-сервер
         try:
@@ -88,9 +128,16 @@ async def _run():
 
         # 2) фоновые задачи (по желанию)
         try:
-            tasks.append(asyncio.create_task(subscription_expirer(bot), name="subscription-expirer"))
+            tasks.append(asyncio.create_task(subscription_expirer(), name="subscription-expirer"))
         except Exception:
             logging.exception("Failed to start subscription_expirer task")
+        # запасная проверка платежей YooKassa (основной путь — webhook /pay/yookassa/webhook)
+        tasks.append(asyncio.create_task(payment_poller(), name="payment-poller"))
+        # исходящие уведомления (истечение подписки, оплата, OAuth) — через outbox с лимитами Telegram
+        tasks.append(asyncio.create_task(notification_dispatcher(bot), name="notification-dispatcher"))
+
+        # 2.1) прогрев ленивых подсистем — параллельно с polling
+        tasks.append(asyncio.create_task(_warmup(), name="warmup"))
 
         # 3) polling (блокирующе, до Ctrl+C/сигнала)
         await dp.start_polling(bot, allowed_updates=[
@@ -115,6 +162,12 @@ async def _run():
             with suppress(asyncio.CancelledError):
                 await t
 
+        # 1.1) дописываем в БД реплики из горячего слоя памяти и закрываем пул соединений (PostgreSQL)
+        with suppress(Exception):
+            await flush_pending()
+        with suppress(Exception):
+            await close_storage()
+
         # 2) закрываем OAuth сервер
         if oauth_runner is not None:
             with suppress(Exception):
@@ -0,0 +1,25 @@
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import User
+
+from bot.services.user_profile import get_profile
+
+
+class UserProfileMiddleware(BaseMiddleware):
+    """
+    Загружает профиль пользователя (bot.services.user_profile) один раз на апдейт
+    и кладёт в data["profile"] — хендлеры получают его аргументом `profile: UserProfile`.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user is not None and "profile" not in data:
+            data["profile"] = await get_profile(user.id)
+        return await handler(event, data)
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import re
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
@@ -6,11 +7,53 @@ TZ = ZoneInfo("Europe/Berlin")
 
 CAL_TRIGGERS = ("календар", "событ", "встреч", "созвон", "мит", "митап")
 
+# действия с записью (по началу слова; часть элементов — регулярные выражения)
+BOOKING_TRIGGERS = (
+    "запис", "запиш", "перенес", "перенос", "перенест", "отмен", "брон", "забронир",
+    "расписан", "свободн", "окошк", "слот", r"при[её]м(?:а|у|е)?\b",
+    "сдвин", "подвин", "удали", "назнач",
+)
+
+RELATIVE_DAYS = ("сегодня", "завтр", "послезавтр", "недел", "выходн", "утр", "вечер")
+
+WEEKDAYS = ("понедельн", "вторник", r"сред(?:а|у|ы|е|ам)\b", "четверг", "пятниц", "суббот", "воскресен")
+MONTHS = ("январ", "феврал", "март", "апрел", "ма[ейя]", "июн", "июл", "август", "сентябр", "октябр", "ноябр", "декабр")
+
+_WORD_RE = re.compile(
+    r"(?<!\w)(?:" + "|".join(CAL_TRIGGERS + BOOKING_TRIGGERS + RELATIVE_DAYS + WEEKDAYS) + r")"
+)
+
+# выражения даты/времени: 12.05, 12/05/2025, 15:30, «в 15 часов», «через 2 дня», «5 мая»
+_DATE_RE = re.compile(
+    r"\b\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?\b"
+    r"|\b\d{1,2}:\d{2}\b"
+    r"|\b(?:в|к)\s+\d{1,2}\b(?![.,]\d)"
+    r"|\b\d{1,2}\s*(?:час|ч\b)"
+    r"|\bчерез\s+(?:\d+\s*)?(?:минут|час|дн|день|недел|месяц)"
+    r"|\b\d{1,2}\s+(?:" + "|".join(MONTHS) + r")"
+)
+
+# запись/перенос/отмена или день относительно «сейчас» — ответ зависит от клиента и от даты вопроса
+_BOOKING_RE = re.compile(
+    r"(?<!\w)(?:" + "|".join(BOOKING_TRIGGERS + ("сегодня", "завтр", "послезавтр")) + r")"
+)
+
+def has_date_expression(text: str) -> bool:
+    return bool(_DATE_RE.search((text or "").lower()))
+
+def has_booking_intent(text: str) -> bool:
+    return bool(_BOOKING_RE.search((text or "").lower()))
+
 def looks_calendar(text: str) -> bool:
+    """
+    Быстрый локальный классификатор: может ли сообщение быть календарным запросом.
+    Ключевые слова сверяются по началу слова («лимит» не срабатывает на «мит»),
+    плюс явные выражения даты/времени.
+    """
     s = (text or "").lower()
-    return any(t in s for t in CAL_TRIGGERS) or any(
-        k in s for k in ("сегодня", "завтр", "недел", "выходн")
-    )
+    if not s:
+        return False
+    return bool(_WORD_RE.search(s)) or has_date_expression(s)
 
 def parse_range_ru(text: str, tz) -> tuple[datetime, datetime, str]:
     """Вернёт (start, end, label) в TZ пользователя."""
@@ -4,6 +4,7 @@ from typing import Dict, Optional
 from aiogram import Bot, Dispatcher
 from aiogram.exceptions import TelegramConflictError, TelegramUnauthorizedError
 import contextlib
+from bot.services.telegram_api import make_session
 from . import state
 from .worker import bot_worker
 
@@ -17,7 +18,7 @@ async def check_token_free(bot_token: str) -> None:
     Делает один короткий getUpdates и смотрит, есть ли конфликт.
     НИЧЕГО не сохраняем, это чисто диагностика.
     """
-    tmp_bot = Bot(bot_token)
+    tmp_bot = Bot(bot_token, session=make_session())
     try:
         # timeout=0, limit=1 — мгновенный запрос без long polling
         await tmp_bot.get_updates(limit=1, timeout=0)
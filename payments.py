@@ -2,18 +2,19 @@ import os
 import uuid
 from datetime import datetime, timedelta, timezone
 
-from yookassa import Configuration, Payment
-
 YOOKASSA_ACCOUNT_ID = os.getenv("YOOKASSA_ACCOUNT_ID")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
 BASE_URL = os.getenv("BASE_URL", "https://example.com")
 
 
 def _yk_configure():
+    """Настраивает SDK и возвращает yookassa.Payment (SDK импортируется при первом платеже, не на старте)."""
     if not YOOKASSA_ACCOUNT_ID or not YOOKASSA_SECRET_KEY:
         raise RuntimeError("YOOKASSA_ACCOUNT_ID/YOOKASSA_SECRET_KEY не заданы")
+    from yookassa import Configuration, Payment
     Configuration.account_id = str(YOOKASSA_ACCOUNT_ID)
     Configuration.secret_key = str(YOOKASSA_SECRET_KEY)
+    return Payment
 
 
 def _iso_utc(dt: datetime) -> str:
@@ -31,7 +32,7 @@ def create(amount_rub: float, tg_user_id: int) -> tuple[str, str]:
     Создаёт платёж и возвращает (confirmation_url, payment_id).
     TTL = 10 минут.
     """
-    _yk_configure()
+    Payment = _yk_configure()
 
     value = f"{float(amount_rub):.2f}"
     expires_at = _iso_utc(datetime.now(timezone.utc) + timedelta(minutes=10))
@@ -54,13 +55,22 @@ def create(amount_rub: float, tg_user_id: int) -> tuple[str, str]:
     return url, payment.id
 
 
+def fetch_status(payment_id: str) -> str:
+    """
+    Статус платежа в YooKassa: "succeeded" (в т.ч. paid==True), "pending", "waiting_for_capture", "canceled".
+    Блокирующий HTTP-запрос — из asyncio вызывать через asyncio.to_thread.
+    """
+    Payment = _yk_configure()
+    p = Payment.find_one(payment_id)
+    status = getattr(p, "status", None) or "pending"
+    if bool(getattr(p, "paid", False)):
+        return "succeeded"
+    return status
+
+
 def check(payment_id: str) -> bool:
     """
     Возвращает True, если платёж успешно оплачен (paid==True / status=='succeeded').
     В остальных случаях False (waiting_for_capture, pending, canceled, refunded...).
     """
-    _yk_configure()
-    p = Payment.find_one(payment_id)
-    status = getattr(p, "status", None)
-    paid = bool(getattr(p, "paid", False))
-    return paid or status == "succeeded"
+    return fetch_status(payment_id) == "succeeded"
@@ -4,11 +4,10 @@ from __future__ import annotations
 from typing import List, Dict, Any, Optional
 import asyncio
 from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from zoneinfo import ZoneInfo
 
-from googleapiclient.discovery import build
 
-from bot.services.google_oauth import load_user_credentials
+from bot.services.google_oauth import load_user_credentials, api_client_options
 
 DEFAULT_TZ = ZoneInfo("Europe/Berlin")  # можно вынести в .env
 
@@ -31,28 +30,30 @@ async def _svc(user_id: int):
     creds = await load_user_credentials(user_id)
     if creds is None:
         raise RuntimeError("Google OAuth not connected or expired")
+    from googleapiclient.discovery import build  # тяжёлый импорт — только когда нужен календарь
+
     # cache_discovery=False — практичнее для прод-окружений/контейнеров
-    return build("calendar", "v3", credentials=creds, cache_discovery=False)
+    return build("calendar", "v3", credentials=creds, cache_discovery=False,
+                 client_options=api_client_options("calendar/v3/"))
 
 
-async def get_user_timezone_oauth(user_id: int) -> ZoneInfo:
-    """Берём TZ из настроек аккаунта Google; если недоступно — tz процесса."""
-    try:
-        service = await _svc(user_id)
-    except Exception:
-        return datetime.now().astimezone().tzinfo  # fallback
+async def fetch_user_timezone_oauth(user_id: int) -> ZoneInfo:
+    """TZ из настроек аккаунта Google. В отличие от get_user_timezone_oauth — бросает исключение при сбое."""
+    service = await _svc(user_id)
 
     def _get():
         return service.settings().get(setting="timezone").execute()
 
+    tzname = (await asyncio.to_thread(_get)).get("value") or ""
+    return ZoneInfo(tzname)
+
+
+async def get_user_timezone_oauth(user_id: int) -> ZoneInfo:
+    """Берём TZ из настроек аккаунта Google; если недоступно — tz процесса."""
     try:
-        tzname = (await asyncio.to_thread(_get)).get("value") or ""
-        try:
-            return ZoneInfo(tzname)
-        except ZoneInfoNotFoundError:
-            return datetime.now().astimezone().tzinfo
+        return await fetch_user_timezone_oauth(user_id)
     except Exception:
-        return datetime.now().astimezone().tzinfo
+        return datetime.now().astimezone().tzinfo  # fallback
 
 
 async def list_upcoming_events_oauth(
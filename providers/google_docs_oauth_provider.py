@@ -4,8 +4,7 @@ from typing import Dict, Any
 import asyncio
 import re
 
-from googleapiclient.discovery import build
-from bot.services.google_oauth import load_user_credentials
+from bot.services.google_oauth import load_user_credentials, api_client_options
 
 
 def _extract_doc_id(identifier: str) -> str:
@@ -67,11 +66,14 @@ async def get_document_oauth(user_id: int, identifier: str) -> Dict[str, Any]:
         raise RuntimeError("No Google OAuth credentials for this user")
 
     def _fetch() -> Dict[str, Any]:
+        from googleapiclient.discovery import build  # тяжёлый импорт — при первом чтении документа
+
         service = build(
             "docs",
             "v1",
             credentials=creds,
             cache_discovery=False,
+            client_options=api_client_options(),
         )
         document = service.documents().get(documentId=doc_id).execute()
         title = document.get("title", "")
@@ -1,8 +1,6 @@
 from __future__ import annotations
 from typing import Dict, Any, List
 import re
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from config import SERVICE_ACCOUNT_FILE
 
 SCOPES = ['https://www.googleapis.com/auth/documents.readonly']
@@ -21,6 +19,9 @@ def _normalize_document_id(document_id_or_url: str) -> str:
     return m.group(1) if m else s
 
 def _build_docs_service():
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
     creds = service_account.Credentials.from_service_account_file(
         SERVICE_ACCOUNT_FILE, scopes=SCOPES
     )
@@ -3,8 +3,7 @@ from __future__ import annotations
 from typing import Dict, Any, Optional, Tuple, List
 import asyncio
 
-from googleapiclient.discovery import build
-from bot.services.google_oauth import load_user_credentials
+from bot.services.google_oauth import load_user_credentials, api_client_options
 
 
 def _parse_sheet_id_and_range(url_or_id: str) -> tuple[str, Optional[str]]:
@@ -38,8 +37,10 @@ async def get_sheet_as_text_oauth(
     include_empty: bool = False      # включать ли полностью пустые листы в вывод
 ) -> Dict[str, Any]:
     """Читает ВСЕ листы таблицы через OAuth пользователя и собирает плоский текст."""
+    from googleapiclient.discovery import build  # тяжёлый импорт — при первом чтении таблицы
+
     creds = await load_user_credentials(user_id)
-    service = build("sheets", "v4", credentials=creds)
+    service = build("sheets", "v4", credentials=creds, client_options=api_client_options())
 
     sheet_id, rng = _parse_sheet_id_and_range(url_or_id)
 
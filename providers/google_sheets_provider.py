@@ -1,8 +1,6 @@
 from __future__ import annotations
 from typing import Dict, Any, List, Optional
 import re
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from config import SERVICE_ACCOUNT_FILE
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
@@ -22,6 +20,9 @@ def _normalize_spreadsheet_id_and_range(url_or_id: str) -> tuple[str, Optional[s
     return sheet_id, rng
 
 def _build_sheets_service():
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
     creds = service_account.Credentials.from_service_account_file(
         SERVICE_ACCOUNT_FILE, scopes=SCOPES
     )
@@ -0,0 +1,35 @@
+"""
+Отчёт по кэшу ответов (bot/services/answer_cache.py): hit-rate и сэкономленные токены по владельцам.
+Пример: python scripts/answer_cache_report.py
+"""
+import sys, asyncio
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.services.answer_cache import list_owner_stats  # noqa: E402
+from providers.redis_provider import close_redis  # noqa: E402
+
+
+async def main():
+    try:
+        rows = await list_owner_stats()
+    finally:
+        await close_redis()
+    if not rows:
+        print("Статистики пока нет.")
+        return
+    rows.sort(key=lambda r: r[1]["saved_tokens"], reverse=True)
+    print(f"{'owner':>14s}  {'hits':>7s}  {'misses':>7s}  {'hit-rate':>8s}  {'saved tokens':>12s}")
+    total_hits = total_misses = total_saved = 0
+    for owner, st in rows:
+        print(f"{owner:>14s}  {st['hits']:>7d}  {st['misses']:>7d}  {st['hit_rate']:>8.1%}  {st['saved_tokens']:>12d}")
+        total_hits += st["hits"]; total_misses += st["misses"]; total_saved += st["saved_tokens"]
+    total = total_hits + total_misses
+    rate = total_hits / total if total else 0.0
+    print(f"{'ИТОГО':>14s}  {total_hits:>7d}  {total_misses:>7d}  {rate:>8.1%}  {total_saved:>12d}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""
+Бенчмарк подбора событий (bot/calendar_match.py) на синтетическом «большом» календаре.
+Пример: python scripts/bench_calendar_match.py 5000
+"""
+import sys, time, random
+from datetime import datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.calendar_match import EventIndex, MatchQuery, rank_events, confident_choice  # noqa: E402
+
+TZ = ZoneInfo("Europe/Berlin")
+TITLES = [
+    "Стрижка", "Маникюр", "Консультация по ремонту", "Созвон с поставщиком", "Встреча с Ивановым",
+    "Окрашивание волос", "Педикюр", "Разбор заявок", "Планёрка", "Демо для клиента",
+]
+PLACES = ["Офис на Ленина", "Zoom", "Салон", "Кафе «Точка»", None]
+NAMES = ["Иванов", "Петрова", "Сидоров", "Smith", "Кузнецова"]
+
+
+def make_events(n: int) -> list[dict]:
+    rnd = random.Random(42)
+    now = datetime.now(TZ).replace(minute=0, second=0, microsecond=0)
+    out = []
+    for i in range(n):
+        start = now + timedelta(hours=rnd.randint(1, 24 * 14))
+        name = rnd.choice(NAMES)
+        out.append({
+            "id": f"ev{i}",
+            "summary": f"{rnd.choice(TITLES)} — {name}",
+            "location": rnd.choice(PLACES),
+            "attendees": [{"email": f"{name.lower()}@example.com", "displayName": name}],
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": (start + timedelta(hours=1)).isoformat()},
+        })
+    return out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = 2000
+    events = make_events(n)
+    t0 = time.perf_counter()
+    index = EventIndex.build(events, TZ)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    target = next(ev for ev in events[n // 2:] if ev["summary"].startswith("Стрижка"))
+    plans = {
+        "text": {"match": {"query": "стрижку Петровой"}},
+        "text+time": {"match": {"query": "стрижку", "around": target["start"]["dateTime"]}},
+        "attendee": {"match": {"attendee": "Smith", "around": target["start"]["dateTime"]}},
+    }
+    print(f"events={n} index_build={build_ms:.1f}ms terms={len(index.postings)}")
+    for name, plan in plans.items():
+        q = MatchQuery.from_plan(plan, TZ)
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            ranked = rank_events(index, q)
+        per = (time.perf_counter() - t0) * 1000 / rounds
+        top = ranked[0][1]["summary"] if ranked else "-"
+        single = confident_choice(ranked, q) is not None
+        print(f"{name:10s} {per:.3f} ms/query  top={top!r} confident={single}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Бенчмарк памяти диалога (bot/services/memory.py) на растущей таблице chat_memory.
+Латентность записи хода и чтения контекста должна оставаться плоской при росте таблицы.
+Пример: python scripts/bench_chat_memory.py 1000000
+"""
+import os, sys, time, asyncio, statistics, tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# временная БД — до импорта config/memory (DB_PATH читается при импорте)
+TMP_DIR = tempfile.mkdtemp(prefix="bench_mem_")
+os.environ["DB_PATH"] = str(Path(TMP_DIR) / "bench.db")
+# меряем SQLite-слой; MEMORY_HOT_TIER=redis — чтобы прогнать через горячий слой
+os.environ.setdefault("MEMORY_HOT_TIER", "off")
+os.environ.pop("DATABASE_URL", None)
+
+import aiosqlite  # noqa: E402
+from bot.services.migrations import migrate  # noqa: E402
+from bot.services.memory import add_memory_turn, get_memory_history, get_memory_context  # noqa: E402
+from bot.services.storage import DB_PATH  # noqa: E402
+
+CHATS = 10_000
+HOT_OWNER, HOT_CHAT = 1, 424242
+
+
+async def grow_to(target: int) -> None:
+    """Дозаполняет таблицу до target строк «фоновыми» чатами (генерация средствами SQLite)."""
+    async with aiosqlite.connect(DB_PATH) as conn:
+        async with conn.execute("SELECT COUNT(*) FROM chat_memory") as cur:
+            have = (await cur.fetchone())[0]
+        need = target - have
+        if need <= 0:
+            return
+        await conn.execute(
+            """
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            INSERT INTO chat_memory (owner_id, chat_id, role, content)
+            SELECT 1 + n % 50, n % ?, CASE n % 2 WHEN 0 THEN 'user' ELSE 'assistant' END,
+                   'фоновая реплика ' || n
+            FROM seq
+            """,
+            (need, CHATS),
+        )
+        await conn.commit()
+
+
+async def measure(rounds: int) -> tuple[float, float, float]:
+    w, r, c = [], [], []
+    for i in range(rounds):
+        t0 = time.perf_counter()
+        await add_memory_turn(HOT_OWNER, HOT_CHAT, f"вопрос {i}", f"ответ {i}")
+        t1 = time.perf_counter()
+        await get_memory_history(HOT_OWNER, HOT_CHAT, limit=10)
+        t2 = time.perf_counter()
+        await get_memory_context(HOT_OWNER, HOT_CHAT)
+        t3 = time.perf_counter()
+        w.append(t1 - t0); r.append(t2 - t1); c.append(t3 - t2)
+    ms = lambda xs: statistics.median(xs) * 1000  # noqa: E731
+    return ms(w), ms(r), ms(c)
+
+
+async def main():
+    top = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rounds = 200
+    await migrate()
+    sizes = [n for n in (10_000, 100_000, 1_000_000, 10_000_000) if n < top] + [top]
+    print(f"db={DB_PATH}")
+    print(f"{'rows':>10s}  {'turn write':>11s}  {'history':>9s}  {'context':>9s}   (медиана, ms)")
+    for n in sizes:
+        await grow_to(n)
+        wr, rd, ctx = await measure(rounds)
+        print(f"{n:>10d}  {wr:>11.3f}  {rd:>9.3f}  {ctx:>9.3f}")
+
+    async with aiosqlite.connect(DB_PATH) as conn:
+        async with conn.execute(
+            "EXPLAIN QUERY PLAN SELECT role, content FROM chat_memory "
+            "WHERE owner_id = ? AND chat_id = ? ORDER BY id DESC LIMIT 10",
+            (HOT_OWNER, HOT_CHAT),
+        ) as cur:
+            for row in await cur.fetchall():
+                print("plan:", row[-1])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Профиль холодного старта: `python -X importtime -c "import main"` в отдельном процессе.
+Печатает медиану общего времени импорта, топ пакетов по собственному времени (self) и проверяет,
+что тяжёлые опциональные подсистемы (Google-клиенты, yookassa, aiosend, faster-whisper) на старте
+не импортируются — они грузятся лениво / фоновым прогревом в main._warmup.
+Пример: python scripts/bench_importtime.py --runs 5 --top 20
+Код выхода 1 — если какой-то из ленивых модулей снова попал в импорт main.
+"""
+import argparse, os, statistics, subprocess, sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+LAZY_MODULES = (
+    "googleapiclient.discovery",
+    "google_auth_oauthlib",
+    "google.oauth2.credentials",
+    "google.auth.transport.requests",
+    "yookassa",
+    "aiosend",
+    "faster_whisper",
+)
+
+
+def run_once(module: str) -> list[tuple[int, int, str]]:
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "123456789:" + "A" * 35)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(self_us), int(cum_us), name.rstrip()))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--module", default="main")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=20)
+    args = ap.parse_args()
+
+    run_once(args.module)  # прогрев .pyc, чтобы не мерить компиляцию
+    totals, by_pkg = [], defaultdict(list)
+    last: list[tuple[int, int, str]] = []
+    for _ in range(args.runs):
+        last = run_once(args.module)
+        totals.append(next(cum for _, cum, name in last if name.strip() == args.module) / 1000)
+        pkg_self = defaultdict(int)
+        for self_us, _, name in last:
+            pkg_self[name.strip().split(".")[0]] += self_us
+        for pkg, us in pkg_self.items():
+            by_pkg[pkg].append(us / 1000)
+
+    print(f"import {args.module}: median {statistics.median(totals):.0f} ms "
+          f"(min {min(totals):.0f}, max {max(totals):.0f}, runs={args.runs})")
+    print(f"\n{'package':<32s} {'self ms':>8s}")
+    ranked = sorted(by_pkg.items(), key=lambda kv: statistics.median(kv[1]), reverse=True)
+    for pkg, vals in ranked[:args.top]:
+        print(f"{pkg:<32s} {statistics.median(vals):>8.1f}")
+
+    imported = {name.strip() for _, _, name in last}
+    leaked = [m for m in LAZY_MODULES if any(n == m or n.startswith(m + ".") for n in imported)]
+    print()
+    if leaked:
+        print("Импортируются на старте (должны быть ленивыми): " + ", ".join(leaked))
+        sys.exit(1)
+    print("Ленивые подсистемы на старте не импортируются: OK")
+
+
+if __name__ == "__main__":
+    main()
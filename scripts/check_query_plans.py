@@ -0,0 +1,80 @@
+"""
+Проверка планов горячих запросов: на свежей БД (все миграции bot/services/migrations.py)
+прогоняет EXPLAIN QUERY PLAN и падает, если запрос читает таблицу полным сканом или сортирует во временном B-tree.
+Пример: python scripts/check_query_plans.py            # временная БД
+        python scripts/check_query_plans.py --db data/db.db   # планы на боевой схеме (только чтение)
+Код выхода 1 — какой-то горячий запрос потерял индекс.
+"""
+import argparse, asyncio, sqlite3, sys, tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.services.migrations import migrate  # noqa: E402
+
+from bot.services import db, limits, memory, notify, payments, token_wallet, user_profile  # noqa: E402
+
+# (имя, запрос) — константы из самих модулей, т.е. ровно тот SQL, что выполняет код;
+# параметры для EXPLAIN не важны, подставляем NULL
+HOT_QUERIES = [
+    *user_profile.HOT_QUERIES,
+    *limits.HOT_QUERIES,
+    *db.HOT_QUERIES,
+    *memory.HOT_QUERIES,
+    *token_wallet.HOT_QUERIES,
+    *payments.HOT_QUERIES,
+    *notify.HOT_QUERIES,
+]
+
+BAD_MARKERS = ("USE TEMP B-TREE",)
+
+
+def bad_steps(plan: list[str]) -> list[str]:
+    out = []
+    for step in plan:
+        # "SCAN users" — полный скан; "SCAN t USING (COVERING) INDEX" — тоже скан всего индекса
+        if step.startswith("SCAN ") or any(m in step for m in BAD_MARKERS):
+            out.append(step)
+    return out
+
+
+def explain_all(conn: sqlite3.Connection) -> list[tuple[str, list[str], list[str]]]:
+    """[(имя, шаги плана, плохие шаги)] по всем HOT_QUERIES."""
+    out = []
+    for name, sql in HOT_QUERIES:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count("?")).fetchall()
+        plan = [r[3] for r in rows]
+        out.append((name, plan, bad_steps(plan)))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", help="проверить существующую БД (без миграций)")
+    args = ap.parse_args()
+
+    if args.db:
+        db_path = args.db
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    else:
+        db_path = str(Path(tempfile.mkdtemp(prefix="qplan_")) / "plan.db")
+        asyncio.run(migrate(db_path))
+        conn = sqlite3.connect(db_path)
+
+    failed = 0
+    for name, plan, bad in explain_all(conn):
+        status = "FAIL" if bad else "ok"
+        failed += bool(bad)
+        print(f"{status:4s} {name:24s} {' | '.join(plan)}")
+    conn.close()
+
+    print()
+    if failed:
+        print(f"{failed} горячих запросов без подходящего индекса")
+        sys.exit(1)
+    print(f"Все {len(HOT_QUERIES)} горячих запросов идут по индексам: OK")
+
+
+if __name__ == "__main__":
+    main()
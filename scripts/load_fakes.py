@@ -0,0 +1,575 @@
+"""
+Стенд для нагрузочного теста дочерних ботов: в одном aiohttp-сервере поддельные Telegram Bot API
+(getUpdates/sendMessage/getFile...), OpenRouter chat/completions (задержка, ошибки, SSE-стриминг, tool calls)
+и Google (OAuth token, Docs, Sheets, Calendar), плюс генератор трафика — закрытый цикл «сообщение -> ответ»
+в каждом чате каждого бота.
+Бот направляется сюда переменными TELEGRAM_API_URL, OPENROUTER_URL и GOOGLE_API_BASE_URL.
+
+Обычно стенд поднимает scripts/load_test.py отдельным процессом (чтобы стенд не ел CPU и event loop бота).
+Вручную — против настоящего main.py:
+        python scripts/load_fakes.py --port 8099 --llm-ms 800 --llm-sigma 0.4
+        curl -XPOST localhost:8099/_harness/run -d '{"tokens": ["111:AAA..."], "duration": 60}'
+Управление: GET /_harness/health, GET /_harness/stats (счётчики вызовов), POST /_harness/run (прогон, ответ — отчёт JSON).
+"""
+import argparse, asyncio, json, random, time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from aiohttp import web
+
+TZ = ZoneInfo("Europe/Berlin")
+
+FAQ_QUESTIONS = (
+    "Какие у вас цены?",
+    "Как с вами связаться?",
+    "Где вы находитесь?",
+    "Какой у вас график работы?",
+    "Есть ли доставка?",
+)
+CAL_LIST_TEXT = "Покажи мои записи на завтра"
+CAL_CREATE_TEXT = "Запиши меня на стрижку завтра в 15:00"
+DOC_PARAGRAPH = (
+    "Прайс: стрижка — 1500 ₽, окрашивание — от 3500 ₽, укладка — 1200 ₽. "
+    "Работаем ежедневно с 10:00 до 21:00, адрес: ул. Примерная, 1. Доставка косметики по городу — 300 ₽.\n"
+)
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Перцентиль по ближайшему рангу (q — от 0 до 100) уже отсортированного списка."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    vals = sorted(values)
+    return {
+        "n": len(vals),
+        "mean": sum(vals) / len(vals) if vals else None,
+        "p50": percentile(vals, 50),
+        "p95": percentile(vals, 95),
+        "p99": percentile(vals, 99),
+        "max": vals[-1] if vals else None,
+    }
+
+
+@dataclass
+class FakeConfig:
+    llm_ms: float = 800.0           # медиана задержки OpenRouter
+    llm_sigma: float = 0.35         # разброс (логнормальный, sigma); 0 — фиксированная задержка
+    llm_error_rate: float = 0.0     # доля ответов 503
+    llm_reply_chars: int = 400
+    llm_chunks: int = 8             # кусков в SSE-ответе при stream=true
+    llm_ttft_share: float = 0.3     # доля задержки до первого куска при стриминге
+    google_ms: float = 120.0
+    google_sigma: float = 0.3
+    tg_ms: float = 30.0             # задержка методов Bot API (кроме long polling getUpdates)
+    doc_chars: int = 6000
+
+
+def _delay(rng: random.Random, median_ms: float, sigma: float) -> float:
+    if median_ms <= 0:
+        return 0.0
+    return median_ms / 1000 * (rng.lognormvariate(0, sigma) if sigma > 0 else 1.0)
+
+
+def _ok(result: Any) -> web.Response:
+    return web.json_response({"ok": True, "result": result})
+
+
+@dataclass
+class BotBox:
+    """Состояние одного поддельного бота: очередь апдейтов и ожидающие ответа чаты."""
+    token: str
+    updates: List[dict] = field(default_factory=list)
+    next_update_id: int = 1
+    next_message_id: int = 1
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+    polled: asyncio.Event = field(default_factory=asyncio.Event)
+    waiters: Dict[int, asyncio.Future] = field(default_factory=dict)
+
+    @property
+    def bot_id(self) -> int:
+        head = self.token.split(":", 1)[0]
+        return int(head) if head.isdigit() else 1
+
+    def push(self, update: dict) -> None:
+        update["update_id"] = self.next_update_id
+        self.next_update_id += 1
+        self.updates.append(update)
+        self.wakeup.set()
+
+    def message_id(self) -> int:
+        self.next_message_id += 1
+        return self.next_message_id
+
+
+class Fakes:
+    def __init__(self, cfg: FakeConfig, seed: int = 1):
+        self.cfg = cfg
+        self.rng = random.Random(seed)
+        self.bots: Dict[str, BotBox] = {}
+        self.files: Dict[str, bytes] = {}
+        self.events: Dict[str, List[dict]] = {}
+        self.calls: Counter = Counter()
+        self.unmatched_replies = 0
+
+    def box(self, token: str) -> BotBox:
+        b = self.bots.get(token)
+        if b is None:
+            b = self.bots[token] = BotBox(token)
+        return b
+
+    async def _sleep(self, median_ms: float, sigma: float) -> None:
+        d = _delay(self.rng, median_ms, sigma)
+        if d:
+            await asyncio.sleep(d)
+
+    # ---------------- Telegram Bot API ----------------
+
+    async def tg_method(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.method == "POST" else dict(request.query)
+        self.calls[f"telegram.{method}"] += 1
+        box = self.box(token)
+
+        if method == "getUpdates":
+            return _ok(await self._get_updates(box, params))
+        if method == "getMe":
+            return _ok({"id": box.bot_id, "is_bot": True, "first_name": "Load", "username": f"load_{box.bot_id}_bot"})
+
+        await self._sleep(self.cfg.tg_ms, 0.2)
+        if method == "sendMessage":
+            return _ok(self._send_message(box, params))
+        if method == "getFile":
+            file_id = str(params.get("file_id"))
+            data = self.files.get(file_id, b"")
+            return _ok({"file_id": file_id, "file_unique_id": file_id, "file_size": len(data),
+                        "file_path": f"voice/{file_id}.ogg"})
+        # sendChatAction, answerCallbackQuery, editMessage*, deleteWebhook...
+        return _ok(True)
+
+    async def _get_updates(self, box: BotBox, params: dict) -> List[dict]:
+        box.polled.set()
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        if offset:
+            box.updates = [u for u in box.updates if u["update_id"] >= offset]
+        if not box.updates and timeout > 0:
+            box.wakeup.clear()
+            try:
+                await asyncio.wait_for(box.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return box.updates[:limit]
+
+    def _send_message(self, box: BotBox, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        msg = {
+            "message_id": box.message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+            "from": {"id": box.bot_id, "is_bot": True, "first_name": "Load"},
+            "text": params.get("text") or "",
+        }
+        if params.get("reply_markup"):
+            msg["reply_markup"] = json.loads(params["reply_markup"])
+        fut = box.waiters.pop(chat_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result(msg)
+        else:
+            self.unmatched_replies += 1
+        return msg
+
+    async def tg_file(self, request: web.Request) -> web.Response:
+        self.calls["telegram.file"] += 1
+        path = request.match_info["path"]
+        file_id = path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        await self._sleep(self.cfg.tg_ms, 0.2)
+        return web.Response(body=self.files.get(file_id, b""), content_type="audio/ogg")
+
+    # ---------------- OpenRouter ----------------
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        model = payload.get("model") or "?"
+        self.calls["openrouter.chat"] += 1
+        self.calls[f"openrouter.model.{model}"] += 1
+        delay = _delay(self.rng, self.cfg.llm_ms, self.cfg.llm_sigma)
+
+        if self.cfg.llm_error_rate and self.rng.random() < self.cfg.llm_error_rate:
+            self.calls["openrouter.error"] += 1
+            await asyncio.sleep(delay / 4)
+            return web.json_response({"error": {"code": 503, "message": "fake upstream overloaded"}}, status=503)
+
+        messages = payload.get("messages") or []
+        prompt_chars = sum(len(str(m.get("content") or "")) for m in messages)
+        last_user = next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+        content, tool_calls = self._reply_for(last_user, bool(payload.get("tools")))
+        usage = {
+            "prompt_tokens": max(1, prompt_chars // 4),
+            "completion_tokens": max(1, len(content) // 4),
+            "cost": 0.0,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if payload.get("stream"):
+            self.calls["openrouter.stream"] += 1
+            return await self._stream(request, model, content, tool_calls, usage, delay)
+
+        await asyncio.sleep(delay)
+        message: Dict[str, Any] = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return web.json_response({
+            "id": f"gen-{self.rng.getrandbits(40):x}",
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": usage,
+        })
+
+    def _reply_for(self, text: str, with_tools: bool):
+        low = text.lower()
+        if with_tools and ("запиш" in low or "покажи" in low):
+            start = (datetime.now(TZ) + timedelta(days=1)).replace(hour=15, minute=0, second=0, microsecond=0)
+            if "запиш" in low:
+                name, args = "create_event", {
+                    "summary": "Стрижка",
+                    "start": start.isoformat(),
+                    "end": (start + timedelta(hours=1)).isoformat(),
+                }
+                content = "Создать запись «Стрижка» на завтра 15:00?"
+            else:
+                day = start.replace(hour=0)
+                name, args = "list_events", {"start": day.isoformat(), "end": (day + timedelta(days=1)).isoformat()}
+                content = ""
+            call = {"id": f"call_{self.rng.getrandbits(32):x}", "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}}
+            return content, [call]
+        base = f"Ответ на «{text[:60]}». "
+        filler = DOC_PARAGRAPH * (self.cfg.llm_reply_chars // len(DOC_PARAGRAPH) + 1)
+        return (base + filler)[: max(len(base), self.cfg.llm_reply_chars)], []
+
+    async def _stream(self, request, model, content, tool_calls, usage, delay) -> web.StreamResponse:
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await resp.prepare(request)
+        n = max(1, self.cfg.llm_chunks)
+        await asyncio.sleep(delay * self.cfg.llm_ttft_share)
+        gap = delay * (1 - self.cfg.llm_ttft_share) / n
+        step = max(1, len(content) // n + 1)
+        for i in range(0, max(1, len(content)), step):
+            chunk = {"id": "gen-stream", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + step]}}]}
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(gap)
+        final: Dict[str, Any] = {"id": "gen-stream", "model": model, "usage": usage,
+                                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if tool_calls:
+            final["choices"][0]["delta"] = {"tool_calls": [{"index": 0, **c} for c in tool_calls]}
+            final["choices"][0]["finish_reason"] = "tool_calls"
+        await resp.write(f"data: {json.dumps(final, ensure_ascii=False)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    # ---------------- Google ----------------
+
+    async def _google(self, name: str) -> None:
+        self.calls[f"google.{name}"] += 1
+        await self._sleep(self.cfg.google_ms, self.cfg.google_sigma)
+
+    async def google_token(self, request: web.Request) -> web.Response:
+        await self._google("token")
+        return web.json_response({"access_token": f"fake-{self.rng.getrandbits(48):x}",
+                                  "expires_in": 3600, "token_type": "Bearer"})
+
+    async def docs_get(self, request: web.Request) -> web.Response:
+        await self._google("docs.get")
+        text = (DOC_PARAGRAPH * (self.cfg.doc_chars // len(DOC_PARAGRAPH) + 1))[: self.cfg.doc_chars]
+        return web.json_response({
+            "documentId": request.match_info["doc_id"],
+            "title": "Прайс салона",
+            "body": {"content": [{"paragraph": {"elements": [{"textRun": {"content": line + "\n"}}]}}
+                                 for line in text.splitlines()]},
+        })
+
+    async def sheets_get(self, request: web.Request) -> web.Response:
+        await self._google("sheets.get")
+        return web.json_response({
+            "spreadsheetId": request.match_info["sid"],
+            "properties": {"title": "Прайс салона"},
+            "sheets": [{"properties": {"title": "Прайс", "gridProperties": {"rowCount": 100, "columnCount": 3}}}],
+        })
+
+    async def sheets_values(self, request: web.Request) -> web.Response:
+        await self._google("sheets.values")
+        rows = max(1, self.cfg.doc_chars // 40)
+        values = [["Услуга", "Цена", "Длительность"]] + [[f"Услуга {i}", f"{1000 + 10 * i} ₽", "60 мин"]
+                                                          for i in range(1, rows)]
+        return web.json_response({"range": request.match_info["rng"], "majorDimension": "ROWS", "values": values})
+
+    def _calendar(self, cal_id: str) -> List[dict]:
+        evs = self.events.get(cal_id)
+        if evs is None:
+            base = datetime.now(TZ).replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+            evs = self.events[cal_id] = [
+                self._event(f"seed{i}", f"Клиент {i}", base.replace(hour=10 + 2 * i)) for i in range(4)
+            ]
+        return evs
+
+    @staticmethod
+    def _event(eid: str, summary: str, start: datetime, end: Optional[datetime] = None) -> dict:
+        end = end or start + timedelta(hours=1)
+        return {
+            "id": eid, "status": "confirmed", "summary": summary,
+            "htmlLink": f"https://calendar.google.com/event?eid={eid}",
+            "start": {"dateTime": start.isoformat(), "timeZone": TZ.key},
+            "end": {"dateTime": end.isoformat(), "timeZone": TZ.key},
+        }
+
+    async def calendar_setting(self, request: web.Request) -> web.Response:
+        await self._google("calendar.settings")
+        return web.json_response({"kind": "calendar#setting", "id": request.match_info["setting"], "value": TZ.key})
+
+    async def calendar_list(self, request: web.Request) -> web.Response:
+        await self._google("calendar.calendarList")
+        return web.json_response({"items": [{"id": "primary", "summary": "Основной", "primary": True,
+                                             "accessRole": "owner"}]})
+
+    async def events_list(self, request: web.Request) -> web.Response:
+        await self._google("calendar.events.list")
+        return web.json_response({"kind": "calendar#events", "items": self._calendar(request.match_info["cal"])[-10:]})
+
+    async def events_insert(self, request: web.Request) -> web.Response:
+        await self._google("calendar.events.insert")
+        body = await request.json()
+        evs = self._calendar(request.match_info["cal"])
+        ev = {**body, "id": f"ev{self.rng.getrandbits(40):x}", "status": "confirmed"}
+        ev["htmlLink"] = f"https://calendar.google.com/event?eid={ev['id']}"
+        evs.append(ev)
+        del evs[:-50]
+        return web.json_response(ev)
+
+    async def events_patch(self, request: web.Request) -> web.Response:
+        await self._google("calendar.events.patch")
+        body = await request.json()
+        for ev in self._calendar(request.match_info["cal"]):
+            if ev["id"] == request.match_info["eid"]:
+                ev.update(body)
+                return web.json_response(ev)
+        return web.json_response({"error": {"code": 404, "message": "Not Found"}}, status=404)
+
+    async def events_delete(self, request: web.Request) -> web.Response:
+        await self._google("calendar.events.delete")
+        evs = self._calendar(request.match_info["cal"])
+        evs[:] = [ev for ev in evs if ev["id"] != request.match_info["eid"]]
+        return web.Response(status=204)
+
+    # ---------------- генератор трафика ----------------
+
+    def _user(self, chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"u{chat_id}"}
+
+    def _message_update(self, box: BotBox, chat_id: int, **content) -> dict:
+        return {"message": {
+            "message_id": box.message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "User"},
+            "from": self._user(chat_id),
+            **content,
+        }}
+
+    async def _roundtrip(self, box: BotBox, chat_id: int, update: dict, timeout: float):
+        """Кладёт апдейт в очередь бота и ждёт следующий sendMessage в этот чат."""
+        fut = asyncio.get_running_loop().create_future()
+        box.waiters[chat_id] = fut
+        t0 = time.perf_counter()
+        box.push(update)
+        try:
+            msg = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            box.waiters.pop(chat_id, None)
+            return None, time.perf_counter() - t0
+        return msg, time.perf_counter() - t0
+
+    def _pick_kind(self, mix: Dict[str, float]) -> str:
+        r = self.rng.random() * sum(mix.values())
+        for kind, w in mix.items():
+            r -= w
+            if r <= 0:
+                return kind
+        return next(iter(mix))
+
+    def _text(self, faq_share: float) -> str:
+        if self.rng.random() < faq_share:
+            return self.rng.choice(FAQ_QUESTIONS)
+        return (f"Сколько будет стоить заказ на {self.rng.randint(1, 50)} позиций "
+                f"с доставкой к {self.rng.randint(10, 20)}:00?")
+
+    async def _chat_loop(self, box: BotBox, chat_id: int, spec: dict, records: list, stop_at: float) -> None:
+        mix, timeout = spec["mix"], spec["timeout"]
+        think = spec["think_ms"] / 1000
+        while time.perf_counter() < stop_at:
+            kind = self._pick_kind(mix)
+            if kind == "voice":
+                file_id = f"v{self.rng.getrandbits(48):x}"
+                self.files[file_id] = self._text(spec["faq_share"]).encode()
+                update = self._message_update(box, chat_id, voice={
+                    "file_id": file_id, "file_unique_id": file_id, "duration": 4,
+                    "mime_type": "audio/ogg", "file_size": len(self.files[file_id]),
+                })
+            elif kind == "calendar":
+                kind = "calendar_create" if self.rng.random() < 0.5 else "calendar_list"
+                text = CAL_CREATE_TEXT if kind == "calendar_create" else CAL_LIST_TEXT
+                update = self._message_update(box, chat_id, text=text)
+            else:
+                update = self._message_update(box, chat_id, text=self._text(spec["faq_share"]))
+
+            started = time.perf_counter()
+            msg, took = await self._roundtrip(box, chat_id, update, timeout)
+            records.append((kind, started, took, msg is not None))
+            if kind == "voice":
+                self.files.pop(update["message"]["voice"]["file_id"], None)
+
+            # подтверждение календарной записи — кнопкой из ответа, как живой пользователь
+            markup = (msg or {}).get("reply_markup") or {}
+            buttons = [b for row in markup.get("inline_keyboard") or [] for b in row]
+            confirm = next((b["callback_data"] for b in buttons if str(b.get("callback_data", "")).startswith("cal:ok:")), None)
+            if confirm and time.perf_counter() < stop_at:
+                cb = {"callback_query": {
+                    "id": str(self.rng.getrandbits(48)),
+                    "from": self._user(chat_id),
+                    "chat_instance": str(chat_id),
+                    "data": confirm,
+                    "message": msg,
+                }}
+                started = time.perf_counter()
+                reply, took = await self._roundtrip(box, chat_id, cb, timeout)
+                records.append(("calendar_confirm", started, took, reply is not None))
+
+            if think:
+                await asyncio.sleep(self.rng.expovariate(1 / think))
+
+    async def run(self, spec: dict) -> dict:
+        tokens: List[str] = spec["tokens"]
+        spec = {
+            "chats_per_bot": 4, "duration": 30.0, "warmup": 5.0, "think_ms": 500.0, "timeout": 60.0,
+            "faq_share": 0.3, "mix": {"text": 0.7, "voice": 0.15, "calendar": 0.15}, **spec,
+        }
+        boxes = [self.box(t) for t in tokens]
+        # ждём, пока все боты начали polling
+        await asyncio.wait_for(asyncio.gather(*(b.polled.wait() for b in boxes)), spec.get("ready_timeout", 60))
+
+        records: list = []
+        t_start = time.perf_counter()
+        warm_end = t_start + spec["warmup"]
+        stop_at = warm_end + spec["duration"]
+        loops = [
+            asyncio.create_task(self._chat_loop(b, 10_000_000 + i * 1000 + c, spec, records, stop_at))
+            for i, b in enumerate(boxes) for c in range(spec["chats_per_bot"])
+        ]
+        await asyncio.sleep(max(0.0, warm_end - time.perf_counter()))
+        calls_at_warm = Counter(self.calls)
+        unmatched_at_warm = self.unmatched_replies
+        await asyncio.gather(*loops)
+        calls = self.calls - calls_at_warm
+
+        measured = [r for r in records if warm_end <= r[1] < stop_at]
+        by_kind: Dict[str, Any] = {}
+        for kind in sorted({r[0] for r in measured}):
+            rows = [r for r in measured if r[0] == kind]
+            by_kind[kind] = {**summarize([r[2] for r in rows if r[3]]), "timeouts": sum(1 for r in rows if not r[3])}
+        messages = sum(1 for r in measured if r[0] != "calendar_confirm")
+        return {
+            "bots": len(tokens),
+            "chats": len(loops),
+            "window_sec": spec["duration"],
+            "messages": messages,
+            "throughput_msg_per_sec": messages / spec["duration"] if spec["duration"] else None,
+            "e2e": summarize([r[2] for r in measured if r[3]]),
+            "by_kind": by_kind,
+            "upstream_calls": dict(sorted(calls.items())),
+            "upstream_per_message": {k: v / messages for k, v in sorted(calls.items())} if messages else {},
+            "unmatched_replies": self.unmatched_replies - unmatched_at_warm,
+        }
+
+    # ---------------- управление ----------------
+
+    async def h_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True})
+
+    async def h_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": dict(sorted(self.calls.items())), "bots": len(self.bots)})
+
+    async def h_run(self, request: web.Request) -> web.Response:
+        spec = await request.json()
+        if not spec.get("tokens"):
+            return web.json_response({"error": "tokens required"}, status=400)
+        return web.json_response(await self.run(spec))
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get("/_harness/health", self.h_health)
+        app.router.add_get("/_harness/stats", self.h_stats)
+        app.router.add_post("/_harness/run", self.h_run)
+        # Telegram: /bot<token>/<method>, файлы — /file/bot<token>/<path>
+        app.router.add_route("*", "/bot{token}/{method}", self.tg_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.tg_file)
+        # OpenRouter
+        app.router.add_post("/api/v1/chat/completions", self.chat_completions)
+        # Google: OAuth token, Docs v1, Sheets v4, Calendar v3
+        app.router.add_post("/token", self.google_token)
+        app.router.add_get("/v1/documents/{doc_id}", self.docs_get)
+        app.router.add_get("/v4/spreadsheets/{sid}", self.sheets_get)
+        app.router.add_get("/v4/spreadsheets/{sid}/values/{rng}", self.sheets_values)
+        app.router.add_get("/calendar/v3/users/me/settings/{setting}", self.calendar_setting)
+        app.router.add_get("/calendar/v3/users/me/calendarList", self.calendar_list)
+        app.router.add_get("/calendar/v3/calendars/{cal}/events", self.events_list)
+        app.router.add_post("/calendar/v3/calendars/{cal}/events", self.events_insert)
+        app.router.add_patch("/calendar/v3/calendars/{cal}/events/{eid}", self.events_patch)
+        app.router.add_delete("/calendar/v3/calendars/{cal}/events/{eid}", self.events_delete)
+        return app
+
+
+def add_fake_args(ap: argparse.ArgumentParser) -> None:
+    """Параметры поддельных сервисов (общие с scripts/load_test.py)."""
+    d = FakeConfig()
+    ap.add_argument("--llm-ms", type=float, default=d.llm_ms, help="медиана задержки OpenRouter, мс")
+    ap.add_argument("--llm-sigma", type=float, default=d.llm_sigma, help="разброс задержки (логнормальный sigma)")
+    ap.add_argument("--llm-error-rate", type=float, default=d.llm_error_rate, help="доля ответов 503")
+    ap.add_argument("--llm-reply-chars", type=int, default=d.llm_reply_chars)
+    ap.add_argument("--llm-chunks", type=int, default=d.llm_chunks, help="кусков SSE при stream=true")
+    ap.add_argument("--google-ms", type=float, default=d.google_ms, help="медиана задержки Google API, мс")
+    ap.add_argument("--google-sigma", type=float, default=d.google_sigma)
+    ap.add_argument("--tg-ms", type=float, default=d.tg_ms, help="задержка методов Bot API, мс")
+    ap.add_argument("--doc-chars", type=int, default=d.doc_chars, help="размер документа-источника")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(
+        llm_ms=args.llm_ms, llm_sigma=args.llm_sigma, llm_error_rate=args.llm_error_rate,
+        llm_reply_chars=args.llm_reply_chars, llm_chunks=args.llm_chunks,
+        google_ms=args.google_ms, google_sigma=args.google_sigma,
+        tg_ms=args.tg_ms, doc_chars=args.doc_chars,
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--seed", type=int, default=1)
+    add_fake_args(ap)
+    args = ap.parse_args()
+    fakes = Fakes(config_from_args(args), seed=args.seed)
+    web.run_app(fakes.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
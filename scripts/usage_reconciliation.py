@@ -0,0 +1,58 @@
+"""
+Сверка учёта токенов: локальная оценка (bot/services/tokenizer.py) против фактического usage OpenRouter
+по владельцам за месяц. Пример: python scripts/usage_reconciliation.py [YYYY-MM]
+"""
+import sys, asyncio, datetime as dt
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.services.storage import get_storage, close_storage  # noqa: E402
+from bot.services.migrations import migrate  # noqa: E402
+
+SQL = """
+SELECT user_id,
+       COUNT(*),
+       SUM(prompt_tokens + completion_tokens),
+       SUM(CASE WHEN estimated_tokens IS NOT NULL THEN estimated_tokens END),
+       SUM(CASE WHEN estimated_tokens IS NOT NULL THEN prompt_tokens + completion_tokens END),
+       SUM(cached_tokens),
+       SUM(COALESCE(cost, 0))
+FROM llm_usage
+WHERE ts >= ? AND ts < ?
+GROUP BY user_id
+ORDER BY 3 DESC
+"""
+
+
+def _drift(est, actual) -> str:
+    if not est or not actual:
+        return "—"
+    return f"{(est - actual) / actual:+.1%}"
+
+
+async def main():
+    month = sys.argv[1] if len(sys.argv) > 1 else dt.date.today().strftime("%Y-%m")
+    # ts — текст 'YYYY-MM-DD HH:MM:SS': границы месяца сравниваем как строки (работает в SQLite и PostgreSQL)
+    y, m = map(int, month.split("-"))
+    nxt = f"{y + 1}-01" if m == 12 else f"{y}-{m + 1:02d}"
+    await migrate()
+    rows = await get_storage().fetchall(SQL, (f"{month}-01", f"{nxt}-01"))
+    await close_storage()
+    if not rows:
+        print(f"За {month} записей usage нет.")
+        return
+    print(f"Месяц: {month}")
+    print(f"{'owner':>14s}  {'req':>6s}  {'actual':>10s}  {'estimated':>10s}  {'drift':>7s}  {'cached':>8s}  {'cost $':>9s}")
+    tot = [0, 0, 0, 0, 0, 0.0]
+    for user_id, n, actual, est, actual_cmp, cached, cost in rows:
+        actual, est, actual_cmp, cached = int(actual or 0), int(est or 0), int(actual_cmp or 0), int(cached or 0)
+        print(f"{user_id:>14d}  {n:>6d}  {actual:>10d}  {est:>10d}  {_drift(est, actual_cmp):>7s}  {cached:>8d}  {cost:>9.4f}")
+        for i, v in enumerate((n, actual, est, actual_cmp, cached, cost or 0.0)):
+            tot[i] += v
+    print(f"{'ИТОГО':>14s}  {tot[0]:>6d}  {tot[1]:>10d}  {tot[2]:>10d}  {_drift(tot[2], tot[3]):>7s}  {tot[4]:>8d}  {tot[5]:>9.4f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,3 +7,16 @@ CREATE TABLE IF NOT EXISTS chat_memory (
     content    TEXT    NOT NULL,
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
+
+-- все выборки/подрезка идут по (owner_id, chat_id) в порядке id
+CREATE INDEX IF NOT EXISTS idx_chat_memory_owner_chat_id ON chat_memory (owner_id, chat_id, id);
+
+-- rolling summary ранней части диалога; upto_id — последняя свёрнутая реплика chat_memory
+CREATE TABLE IF NOT EXISTS chat_summary (
+    owner_id   INTEGER NOT NULL,
+    chat_id    INTEGER NOT NULL,
+    summary    TEXT    NOT NULL,
+    upto_id    INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner_id, chat_id)
+);
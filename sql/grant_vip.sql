@@ -7,7 +7,8 @@
 PRAGMA foreign_keys = ON;
 
 WITH new_end AS (
-  SELECT datetime('now', printf('+%d years', :years)) AS dt
+  -- локальное время в формате YYYY-MM-DD HH:MM:SS — как пишет бот (bot/services/db.py, DATE_END_FMT)
+  SELECT datetime('now', 'localtime', printf('+%d years', :years)) AS dt
 )
 INSERT INTO users (id, username, subscribe, date_end, state_bot)
 VALUES (
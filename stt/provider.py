@@ -1,21 +1,29 @@
 # stt/provider.py
 from __future__ import annotations
-import os, asyncio
+import os, asyncio, threading
 from typing import Optional
 
 _BACKEND = os.getenv("STT_BACKEND", "faster_whisper").lower()
 
 # ---------- faster-whisper ----------
 _MODEL = None
+_MODEL_LOCK = threading.Lock()  # прогрев в фоне и первая расшифровка не должны грузить модель дважды
 def _fw_get_model():
     global _MODEL
     if _MODEL is None:
-        from faster_whisper import WhisperModel
-        name = os.getenv("WHISPER_MODEL", "small")
-        compute = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
-        _MODEL = WhisperModel(name, device="cpu", compute_type=compute)
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                from faster_whisper import WhisperModel
+                name = os.getenv("WHISPER_MODEL", "small")
+                compute = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+                _MODEL = WhisperModel(name, device="cpu", compute_type=compute)
     return _MODEL
 
+
+async def preload() -> None:
+    """Загрузить модель заранее (фоновый прогрев после старта), не блокируя event loop."""
+    await asyncio.to_thread(_fw_get_model)
+
 def _fw_transcribe_sync(path: str, lang_hint: Optional[str] = "ru") -> str:
     model = _fw_get_model()
     segments, info = model.transcribe(
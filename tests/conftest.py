@@ -0,0 +1,49 @@
+"""
+Общая настройка тестов: временная SQLite вместо DB_PATH, без Redis и без чтения .env.
+Запуск: python -m pytest -q (из корня репозитория);
+тесты на PostgreSQL — только с TEST_DATABASE_URL (фикстура pg_dsn: своя временная база рядом с указанной).
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import dotenv  # noqa: E402
+
+# config.py зовёт load_dotenv(override=True) — боевой .env не должен попасть в тесты (DB_PATH, ключи)
+dotenv.load_dotenv = lambda *args, **kwargs: False
+
+os.environ["DB_PATH"] = str(Path(tempfile.mkdtemp(prefix="tests_")) / "test.db")
+os.environ.pop("DATABASE_URL", None)
+os.environ.setdefault("CAL_PENDING_BACKEND", "memory")
+os.environ.setdefault("MEMORY_HOT_TIER", "off")
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "").strip()
+
+
+@pytest.fixture(scope="module")
+def pg_dsn():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    asyncpg = pytest.importorskip("asyncpg")
+    name = f"test_storage_{uuid.uuid4().hex[:8]}"
+
+    async def admin(sql):
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    asyncio.run(admin(f'CREATE DATABASE "{name}"'))
+    parts = urlsplit(TEST_DATABASE_URL)
+    yield urlunsplit(parts._replace(path=f"/{name}"))
+    asyncio.run(admin(f'DROP DATABASE "{name}"'))
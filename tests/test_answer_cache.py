@@ -0,0 +1,65 @@
+import asyncio
+from collections import OrderedDict
+
+from bot.services.answer_cache import _Scope, is_history_independent, normalize_question
+
+
+def test_booking_and_dated_messages_are_not_cached():
+    assert not is_history_independent("хочу записаться на стрижку завтра в 15")
+    assert not is_history_independent("Запишите на маникюр")
+    assert not is_history_independent("Можно прийти 12.05?")
+    assert not is_history_independent("Есть окошко на сегодня?")
+
+
+def test_general_faq_is_cached():
+    assert is_history_independent("Сколько стоит доставка?")
+    assert is_history_independent("Работаете в воскресенье?")
+
+
+def test_negation_changes_the_key():
+    plain = normalize_question("работаете в воскресенье")
+    negated = normalize_question("не работаете в воскресенье")
+    assert plain != negated
+
+
+def test_negated_question_is_not_a_near_duplicate():
+    scope = _Scope(entries=OrderedDict(), postings={})
+    stored = normalize_question("работаете ли вы по воскресеньям утром после праздников")
+    scope.add(stored)
+    assert scope.nearest(normalize_question("не работаете ли вы по воскресеньям утром после праздников")) is None
+    assert scope.nearest(stored) == stored
+
+
+CLARIFYING_ANSWERS = ["Мужская", "Москва", "Иван", "Оплачу картой", "Наличными", "Для ребенка 5 лет"]
+
+
+def test_clarifying_answers_mid_dialog_are_not_faq():
+    for text in CLARIFYING_ANSWERS:
+        assert not is_history_independent(text, has_history=True), text
+    assert not is_history_independent("Сколько стоит?", has_history=True)
+    assert is_history_independent("Сколько стоит доставка?", has_history=True)
+    assert is_history_independent("Есть ли парковка", has_history=True)
+
+
+def test_clarifying_answer_goes_to_full_dialog_and_is_not_cached(monkeypatch):
+    import hashsss
+    from bot.services import answer_cache
+
+    calls, stored = [], []
+
+    async def fake_completion(payload, owner_id=None, kind="chat"):
+        calls.append((kind, payload["messages"]))
+        return hashsss.LLMReply(text="ok")
+
+    async def fake_store(*args, **kwargs):
+        stored.append(args)
+
+    monkeypatch.setattr(hashsss, "_chat_completion", fake_completion)
+    monkeypatch.setattr(answer_cache, "store", fake_store)
+    history = [("user", "Подберите стрижку"), ("assistant", "Мужская или женская?")]
+
+    for text in CLARIFYING_ANSWERS:
+        asyncio.run(hashsss.answer(text, "", owner_id=1, history=history))
+
+    assert stored == []
+    assert all(kind == "chat" and len(messages) == 4 for kind, messages in calls)
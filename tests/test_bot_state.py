@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+import keyboards
+from bot.services import storage, user_profile
+from bot.services.db import update_user_state
+from bot.services.migrations import migrate
+
+UID = 601
+
+
+def _label(markup):
+    return markup.inline_keyboard[0][0].text
+
+
+class NoStorage:
+    def __getattr__(self, name):
+        raise AssertionError("меню не должно ходить в БД")
+
+
+@pytest.fixture
+def user():
+    async def setup():
+        await migrate()
+        st = storage.get_storage()
+        await st.execute("DELETE FROM users WHERE id = ?", (UID,))
+        await st.execute("INSERT INTO users (id, subscribe, state_bot) VALUES (?, 'subscribe', 'active')", (UID,))
+
+    asyncio.run(setup())
+    user_profile.invalidate_profile(UID)
+    yield UID
+    user_profile.invalidate_profile(UID)
+
+
+def test_menu_label_never_touches_the_db(user, monkeypatch):
+    monkeypatch.setattr(storage, "_STORAGE", NoStorage())
+    assert _label(keyboards.keyboard_sub(user)) == "🤖❌ Бот выключен"  # в кэше нет — «выключен», без I/O
+    assert _label(keyboards.keyboard_sub(user, "active")) == "🤖✅ Бот включен"
+
+
+def test_menu_follows_write_through_state(user, monkeypatch):
+    assert asyncio.run(user_profile.get_bot_state(user)) == "active"
+    assert _label(keyboards.keyboard_sub(user)) == "🤖✅ Бот включен"
+
+    asyncio.run(update_user_state(user, "stop"))
+    monkeypatch.setattr(storage, "_STORAGE", NoStorage())
+    assert _label(keyboards.keyboard_sub(user)) == "🤖❌ Бот выключен"
+    assert asyncio.run(user_profile.get_bot_state(user)) == "stop"
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from bot.calendar_flow import CalendarFlow
+from bot.services.pending_store import MemoryPendingStore
+
+OWNER_A, OWNER_B, CHAT = 101, 202, 555
+
+PLAN = {
+    "action": "create",
+    "event": {"summary": "Стрижка", "start": "2026-10-20T15:00:00+03:00", "end": "2026-10-20T16:00:00+03:00"},
+}
+
+
+def _flow(created):
+    async def create_event_oauth(uid, **kwargs):
+        created.append((uid, kwargs["summary"]))
+        return {"htmlLink": None}
+
+    async def reply(message, text, **kwargs):
+        message.sent.append((text, kwargs.get("reply_markup")))
+
+    return CalendarFlow(
+        default_tz=None,
+        pending=MemoryPendingStore(),
+        parse_range_ru=None,
+        fmt_events=None,
+        reply=reply,
+        get_timezone=None,
+        is_connected=None,
+        looks_calendar=lambda text: True,
+        list_events_between_oauth=None,
+        create_event_oauth=create_event_oauth,
+        update_event_oauth=None,
+        delete_event_oauth=None,
+    )
+
+
+def _callback(data):
+    message = SimpleNamespace(chat=SimpleNamespace(id=CHAT), answer=AsyncMock())
+    return SimpleNamespace(data=data, message=message, answer=AsyncMock())
+
+
+def test_one_engine_serves_owners_without_leaking_pending_actions():
+    created = []
+    flow = _flow(created)
+
+    async def scenario():
+        message = SimpleNamespace(chat=SimpleNamespace(id=CHAT), sent=[])
+        handled, _ = await flow.handle_plan(
+            message=message, text="запиши", bot_reply="", plan=PLAN, uid=OWNER_A, cal_id="primary",
+        )
+        assert handled
+        markup = message.sent[0][1]
+        ok_data = markup.inline_keyboard[0][0].callback_data
+
+        # токен владельца A, нажатый в боте владельца B, — как истёкший
+        foreign = _callback(ok_data)
+        await flow.handle_callback(foreign, owner_id=OWNER_B)
+        foreign.answer.assert_awaited_with("Операция устарела", show_alert=True)
+        assert created == []
+
+        own = _callback(ok_data)
+        await flow.handle_callback(own, owner_id=OWNER_A)
+        token = ok_data.split(":")[2]
+        return await flow.pending.get(token)
+
+    assert asyncio.run(scenario()) is None
+    assert created == [(OWNER_A, "Стрижка")]
@@ -0,0 +1,41 @@
+import asyncio
+
+from bot.calendar_flow import CalendarFlow
+
+
+async def _connected(uid):
+    return True
+
+
+def _flow():
+    return CalendarFlow(
+        default_tz=None,
+        pending=None,
+        parse_range_ru=None,
+        fmt_events=None,
+        reply=None,
+        get_timezone=None,
+        is_connected=_connected,
+        looks_calendar=lambda text: "запиши" in (text or "").lower(),
+        list_events_between_oauth=None,
+        create_event_oauth=None,
+        update_event_oauth=None,
+        delete_event_oauth=None,
+    )
+
+
+HISTORY = [("user", "Запиши меня на завтра"), ("assistant", "На какое время?")]
+
+
+def test_short_followup_inherits_calendar_intent():
+    assert asyncio.run(_flow().should_plan(1, "давай в 15", HISTORY))
+
+
+def test_long_message_is_not_routed_by_previous_turn():
+    text = "а расскажите подробнее, какие у вас есть услуги для детей и сколько они стоят"
+    assert not asyncio.run(_flow().should_plan(1, text, HISTORY))
+
+
+def test_followup_ignores_older_exchanges():
+    history = HISTORY + [("user", "спасибо"), ("assistant", "Пожалуйста!")]
+    assert not asyncio.run(_flow().should_plan(1, "а цены?", history))
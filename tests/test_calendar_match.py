@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from bot.calendar_match import CONFIDENT_SCORE, EventIndex, MatchQuery, confident_choice, rank_events
+
+TZ = ZoneInfo("Europe/Berlin")
+
+
+def _event(eid: str, summary: str, start: datetime) -> dict:
+    return {
+        "id": eid,
+        "summary": summary,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": (start + timedelta(hours=1)).isoformat()},
+    }
+
+
+def _index(*events: dict) -> EventIndex:
+    return EventIndex.build(list(events), TZ)
+
+
+BASE = datetime.now(TZ).replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+
+def test_lone_candidate_with_empty_query_is_not_applied():
+    index = _index(_event("a", "Стрижка — Петрова", BASE))
+    query = MatchQuery.from_plan({"match": {}}, TZ)
+    ranked = rank_events(index, query)
+    assert len(ranked) == 1
+    assert confident_choice(ranked, query) is None
+
+
+def test_lone_weak_candidate_is_not_applied():
+    index = _index(_event("a", "Стрижка — Петрова", BASE))
+    # только время, и то на неделю позже — скор лидера ниже порога
+    query = MatchQuery.from_plan({"match": {"around": (BASE + timedelta(days=7)).isoformat()}}, TZ)
+    ranked = rank_events(index, query)
+    assert ranked and ranked[0][0] < CONFIDENT_SCORE
+    assert confident_choice(ranked, query) is None
+
+
+def test_lone_strong_candidate_is_applied():
+    ev = _event("a", "Стрижка — Петрова", BASE)
+    index = _index(ev, _event("b", "Маникюр — Смирнова", BASE + timedelta(days=2)))
+    query = MatchQuery.from_plan({"match": {"query": "стрижка Петрова", "around": BASE.isoformat()}}, TZ)
+    ranked = rank_events(index, query)
+    assert len(ranked) == 1
+    assert confident_choice(ranked, query) is ev
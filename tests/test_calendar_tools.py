@@ -0,0 +1,42 @@
+import json
+
+from bot.calendar_flow import CalendarFlow, plan_from_tool_call
+from hashsss import LLMReply, ToolCall, _parse_tool_calls
+
+
+def test_update_tool_call_maps_onto_plan():
+    plan = plan_from_tool_call("update_event", {
+        "query": "стрижка", "around": "2026-10-20T15:00:00+03:00", "shift_minutes": 30, "new_location": None,
+    })
+    assert plan == {
+        "action": "update",
+        "needs_confirmation": True,
+        "match": {"query": "стрижка", "around": "2026-10-20T15:00:00+03:00"},
+        "patch": {"shift_minutes": 30},
+    }
+    assert plan_from_tool_call("unknown_tool", {}) is None
+
+
+def test_tool_calls_are_parsed_and_broken_arguments_skipped():
+    message = {"tool_calls": [
+        {"id": "c1", "function": {"name": "delete_event", "arguments": json.dumps({"query": "маникюр"})}},
+        {"id": "c2", "function": {"name": "create_event", "arguments": "{not json"}},
+        {"id": "c3", "function": {"name": "list_events", "arguments": "[1, 2]"}},
+    ]}
+    assert _parse_tool_calls(message) == [ToolCall(name="delete_event", arguments={"query": "маникюр"}, id="c1")]
+
+
+def test_reply_prefers_tool_call_over_text_protocol():
+    reply = LLMReply(
+        text="Отменяю запись.",
+        tool_calls=[ToolCall(name="delete_event", arguments={"query": "маникюр"})],
+    )
+    flow = CalendarFlow.__new__(CalendarFlow)  # parse_reply не трогает зависимости движка
+    text, plan = flow.parse_reply(reply)
+    assert text == "Отменяю запись."
+    assert plan["action"] == "delete" and plan["match"] == {"query": "маникюр"}
+
+
+def test_plain_text_without_marker_has_no_plan():
+    text, plan = CalendarFlow.extract_plan("Мы работаем с 10 до 20.")
+    assert (text, plan) == ("Мы работаем с 10 до 20.", None)
@@ -0,0 +1,25 @@
+import asyncio
+
+import hashsss
+from bot.services import model_router
+from hashsss import LLMReply, Usage
+
+
+def test_cancelled_hedge_prompt_is_billed(monkeypatch):
+    monkeypatch.setattr(model_router, "LLM_HEDGE_MIN_SEC", 0.01)
+    monkeypatch.setattr(model_router, "LLM_HEDGE_MAX_SEC", 0.01)
+    monkeypatch.setattr(hashsss, "MODEL_ROUTER", model_router.ModelRouter(hedge=True))
+    calls = []
+
+    async def fake_post(payload):
+        calls.append(payload["model"])
+        if len(calls) == 1:
+            await asyncio.sleep(5)  # основная модель «висит» — уходит hedge
+        return LLMReply(text="ok", usage=Usage(prompt_tokens=100, completion_tokens=20))
+
+    monkeypatch.setattr(hashsss, "_post_chat", fake_post)
+    reply = asyncio.run(hashsss._chat_completion({"messages": []}, owner_id=None, kind="chat"))
+
+    assert len(calls) == 2
+    assert reply.usage.hedge_tokens == 100
+    assert reply.usage.total_tokens == 220
@@ -0,0 +1,59 @@
+import asyncio
+
+from bot.services import memory
+from bot.services.migrations import migrate
+from hashsss import LLMReply
+
+
+def test_compaction_folds_old_turns_into_summary(monkeypatch):
+    folded = []
+    debited = []
+
+    async def fake_summarize(summary, items, owner_id=None):
+        folded.append((summary, list(items)))
+        return LLMReply(text=f"summary #{len(folded)}")
+
+    async def fake_debit(owner_id, amount, **kwargs):
+        debited.append((owner_id, kwargs["reason"]))
+
+    monkeypatch.setattr(memory, "summarize_dialog", fake_summarize)
+    monkeypatch.setattr(memory, "debit", fake_debit)
+
+    async def scenario():
+        await migrate()
+        await memory.clear_memory(7, 70)
+        for i in range(6):  # 12 реплик > COMPACT_TRIGGER
+            await memory.add_memory_turn(7, 70, f"q{i}", f"a{i}")
+        compacted = await memory.compact_memory(7, 70)
+        again = await memory.compact_memory(7, 70)  # остался только хвост KEEP_RECENT
+        ctx = await memory.get_memory_context(7, 70)
+        raw = await memory.get_memory_history(7, 70, limit=50)
+        return compacted, again, ctx, raw
+
+    compacted, again, ctx, raw = asyncio.run(scenario())
+    assert (compacted, again) == (True, False)
+    old = [turn for i in range(4) for turn in (("user", f"q{i}"), ("assistant", f"a{i}"))]
+    assert folded == [(None, old)]
+    assert ctx.summary == "summary #1"
+    assert ctx.history == [("user", "q4"), ("assistant", "a4"), ("user", "q5"), ("assistant", "a5")]
+    assert raw == ctx.history
+    assert debited == [(7, "memory-summary")]
+
+
+def test_short_dialog_is_not_compacted(monkeypatch):
+    async def boom(*args, **kwargs):
+        raise AssertionError("summarize_dialog не должен вызываться")
+
+    monkeypatch.setattr(memory, "summarize_dialog", boom)
+
+    async def scenario():
+        await migrate()
+        await memory.clear_memory(7, 71)
+        for i in range(3):
+            await memory.add_memory_turn(7, 71, f"q{i}", f"a{i}")
+        return await memory.compact_memory(7, 71), await memory.get_memory_context(7, 71)
+
+    compacted, ctx = asyncio.run(scenario())
+    assert compacted is False
+    assert ctx.summary is None
+    assert len(ctx.history) == 6
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from bot.services import memory, memory_hot
+from bot.services.migrations import migrate
+
+
+class FakeRedis:
+    """Ровно те команды, что нужны memory_hot; eval повторяет _APPEND_LUA."""
+
+    def __init__(self):
+        self.data = {}
+        self.fail_eval = False
+
+    async def eval(self, script, numkeys, list_key, sum_key, hot_max, ttl, *items):
+        assert script == memory_hot._APPEND_LUA
+        if self.fail_eval:
+            raise ConnectionError("redis down")
+        if sum_key not in self.data:
+            return 0
+        self.data[list_key] = (self.data.get(list_key, []) + list(items))[-int(hot_max):]
+        return 1
+
+    async def delete(self, *keys):
+        for k in keys:
+            self.data.pop(k, None)
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+
+class _Pipeline:
+    def __init__(self, redis):
+        self.redis, self.ops = redis, []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.ops.append((name, args))
+
+    async def execute(self):
+        data, out = self.redis.data, []
+        for name, args in self.ops:
+            if name == "get":
+                out.append(data.get(args[0]))
+            elif name == "lrange":
+                out.append(list(data.get(args[0], [])))
+            elif name == "delete":
+                out.append(data.pop(args[0], None))
+            elif name == "rpush":
+                data.setdefault(args[0], []).extend(args[1:])
+            elif name == "set":
+                data[args[0]] = args[1].encode("utf-8")
+        return out
+
+
+@pytest.fixture
+def hot(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(memory_hot, "HOT_BACKEND", "redis")
+    monkeypatch.setattr(memory_hot, "HOT_MAX", 4)
+    monkeypatch.setattr(memory_hot, "get_redis", lambda: fake)
+    monkeypatch.setattr(memory, "_FLUSHER", None)
+    return fake
+
+
+async def _db_rows(owner_id, chat_id):
+    return await memory.get_storage().fetchall(
+        "SELECT role, content FROM chat_memory WHERE owner_id = ? AND chat_id = ? ORDER BY id",
+        (owner_id, chat_id),
+    )
+
+
+def test_reads_hydrate_from_db_then_serve_ring_buffer(hot):
+    async def scenario():
+        await migrate()
+        await memory.clear_memory(8, 80)
+        await memory.add_memory_turn(8, 80, "q0", "a0")  # слой не прогрет — только очередь в БД
+        cold = dict(hot.data)
+        first = await memory.get_memory_context(8, 80)  # промах: flush + прогрев из БД
+        await memory.add_memory_turn(8, 80, "q1", "a1")
+        await memory.add_memory_turn(8, 80, "q2", "a2")
+        in_db_before_flush = await _db_rows(8, 80)
+        second = await memory.get_memory_context(8, 80)
+        await memory.flush_pending()
+        return cold, first, in_db_before_flush, second, await _db_rows(8, 80)
+
+    cold, first, in_db_before_flush, second, in_db = asyncio.run(scenario())
+    assert cold == {}
+    assert first.summary is None
+    assert first.history == [("user", "q0"), ("assistant", "a0")]
+    assert in_db_before_flush == [("user", "q0"), ("assistant", "a0")]
+    # кольцевой буфер держит HOT_MAX последних реплик, БД — всю историю
+    assert second.history == [("user", "q1"), ("assistant", "a1"), ("user", "q2"), ("assistant", "a2")]
+    assert [c for _, c in in_db] == ["q0", "a0", "q1", "a1", "q2", "a2"]
+
+
+def test_failed_hot_append_drops_layer_and_rehydrates(hot):
+    async def scenario():
+        await migrate()
+        await memory.clear_memory(8, 81)
+        await memory.add_memory_turn(8, 81, "q0", "a0")
+        await memory.get_memory_context(8, 81)
+        hot.fail_eval = True
+        await memory.add_memory_turn(8, 81, "q1", "a1")
+        dropped = dict(hot.data)
+        hot.fail_eval = False
+        return dropped, await memory.get_memory_history(8, 81)
+
+    dropped, history = asyncio.run(scenario())
+    assert dropped == {}
+    assert history == [("user", "q0"), ("assistant", "a0"), ("user", "q1"), ("assistant", "a1")]
@@ -0,0 +1,22 @@
+import asyncio
+
+from aiohttp.test_utils import make_mocked_request
+
+from bot.web import oauth_app
+
+
+def _get(headers=None):
+    request = make_mocked_request("GET", "/metrics", headers=headers or {})
+    return asyncio.run(oauth_app.metrics(request))
+
+
+def test_metrics_disabled_without_token(monkeypatch):
+    monkeypatch.setattr(oauth_app, "METRICS_TOKEN", "")
+    assert _get().status == 404
+
+
+def test_metrics_requires_bearer_token(monkeypatch):
+    monkeypatch.setattr(oauth_app, "METRICS_TOKEN", "secret")
+    assert _get().status == 401
+    assert _get({"Authorization": "Bearer wrong"}).status == 401
+    assert _get({"Authorization": "Bearer secret"}).status == 200
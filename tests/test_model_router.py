@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from bot.services import model_router
+from bot.services.llm_scheduler import FairScheduler
+from bot.services.model_router import ModelRouter, UpstreamError
+
+
+async def _weight(owner):
+    return 1.0
+
+
+def _scheduler(**kwargs):
+    params = {"max_concurrency": 1, "max_per_owner": 1, "queue_deadline_sec": 5, "weight_of": _weight}
+    return FairScheduler(**{**params, **kwargs})
+
+
+def test_slot_is_released_during_retry_backoff(monkeypatch):
+    monkeypatch.setattr(model_router, "LLM_RETRIES", 1)
+    sched = _scheduler(max_per_owner=2)
+    order = []
+
+    async def post(payload):
+        order.append("post")
+        if order.count("post") == 1:
+            await asyncio.sleep(0.05)  # за это время в очередь встаёт другой владелец
+            raise UpstreamError(429, "slow down", retry_after=0.05)
+        return "ok"
+
+    async def other():
+        await asyncio.sleep(0.01)
+        async with sched.slot("other"):
+            order.append("other")
+
+    async def main():
+        router = ModelRouter(hedge=False)
+        result, _ = await asyncio.gather(
+            router.complete({}, owner_id=None, kind="chat", post=post, scheduler=sched),
+            other(),
+        )
+        return result
+
+    assert asyncio.run(main()) == "ok"
+    assert order == ["post", "other", "post"]
+    assert sched.stats()["active"] == 0
+
+
+def test_hedge_needs_a_free_slot(monkeypatch):
+    monkeypatch.setattr(model_router, "LLM_HEDGE_MIN_SEC", 0.01)
+    monkeypatch.setattr(model_router, "LLM_HEDGE_MAX_SEC", 0.01)
+    sched = _scheduler()
+    calls = []
+
+    async def post(payload):
+        calls.append(payload["model"])
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    router = ModelRouter(hedge=True)
+    result = asyncio.run(router.complete({}, owner_id=None, kind="chat", post=post, scheduler=sched))
+
+    assert result == "ok"
+    assert len(calls) == 1 and router.hedged == 0
+    assert sched.stats()["active"] == 0
+
+
+def _routes(monkeypatch, models):
+    for plan in ("FREE", "PREMIUM"):
+        monkeypatch.delenv(f"LLM_MODELS_CHAT_{plan}", raising=False)
+    monkeypatch.setenv("LLM_MODELS_CHAT", models)
+    monkeypatch.setattr(model_router, "LLM_RETRIES", 0)
+
+
+def test_falls_back_to_next_model_on_5xx(monkeypatch):
+    _routes(monkeypatch, "m1,m2,m3")
+    calls = []
+
+    async def post(payload):
+        calls.append(payload["model"])
+        if payload["model"] == "m1":
+            raise UpstreamError(502, "bad gateway")
+        return f"answer from {payload['model']}"
+
+    router = ModelRouter(hedge=False)
+    result = asyncio.run(router.complete({}, owner_id=None, kind="chat", post=post))
+
+    assert result == "answer from m2"
+    assert calls == ["m1", "m2"]
+    assert router.fallbacks == 1
+    assert router.stats()["models"]["m1"]["error_rate"] == 1.0
+
+
+def test_client_error_is_not_retried_on_other_models(monkeypatch):
+    _routes(monkeypatch, "m1,m2")
+    calls = []
+
+    async def post(payload):
+        calls.append(payload["model"])
+        raise UpstreamError(400, "bad request")
+
+    router = ModelRouter(hedge=False)
+    with pytest.raises(UpstreamError):
+        asyncio.run(router.complete({}, owner_id=None, kind="chat", post=post))
+    assert calls == ["m1"]
+
+
+def test_rate_limited_model_moves_to_the_end(monkeypatch):
+    _routes(monkeypatch, "m1,m2,m3")
+
+    async def post(payload):
+        if payload["model"] == "m1":
+            raise UpstreamError(429, "slow down", retry_after=60)
+        return "ok"
+
+    async def main():
+        router = ModelRouter(hedge=False)
+        before = await router.candidates(None, "chat")
+        await router.complete({}, owner_id=None, kind="chat", post=post)
+        return before, await router.candidates(None, "chat")
+
+    before, after = asyncio.run(main())
+    assert before == ["m1", "m2", "m3"]
+    assert after == ["m2", "m3", "m1"]
@@ -0,0 +1,78 @@
+import asyncio
+import datetime
+from collections import Counter
+
+import pytest
+
+from bot.services import notify, storage
+from bot.services.migrations import migrate
+from bot.services.storage import PostgresStorage, get_storage
+
+
+@pytest.fixture(autouse=True)
+def _fast_buckets(monkeypatch):
+    monkeypatch.setattr(notify, "NOTIFY_GLOBAL_RATE", 1000.0)
+
+
+class FakeBot:
+    def __init__(self, sent: Counter):
+        self.sent = sent
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.01)  # пока «отправляем», вторая реплика тоже берёт пачку
+        self.sent[text] += 1
+
+
+async def _two_replicas_drain(n: int) -> Counter:
+    for i in range(n):
+        await notify.enqueue(1000 + i, f"msg-{i}", dedupe_key=f"race-{i}")
+    sent: Counter = Counter()
+    a = notify.NotificationDispatcher(FakeBot(sent))
+    b = notify.NotificationDispatcher(FakeBot(sent))
+    await asyncio.gather(a.drain_once(), b.drain_once(), a.drain_once(), b.drain_once())
+    return sent
+
+
+def test_concurrent_drains_send_each_message_once():
+    async def scenario():
+        await migrate()
+        await get_storage().execute("DELETE FROM notify_outbox")
+        sent = await _two_replicas_drain(20)
+        left = await get_storage().fetchall("SELECT status, COUNT(*) FROM notify_outbox GROUP BY status")
+        return sent, left
+
+    sent, left = asyncio.run(scenario())
+    assert sent == Counter({f"msg-{i}": 1 for i in range(20)})
+    assert left == [("sent", 20)]
+
+
+def test_stale_sending_row_is_reclaimed():
+    async def scenario():
+        await migrate()
+        await get_storage().execute("DELETE FROM notify_outbox")
+        await notify.enqueue(2000, "stuck", dedupe_key="stuck")
+        # реплика взяла строку и упала: аренда уже истекла
+        expired = (datetime.datetime.now() - datetime.timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")
+        await get_storage().execute(
+            "UPDATE notify_outbox SET status='sending', next_attempt_at=? WHERE dedupe_key='stuck'", (expired,)
+        )
+        sent: Counter = Counter()
+        await notify.NotificationDispatcher(FakeBot(sent)).drain_once()
+        return sent
+
+    assert asyncio.run(scenario()) == Counter({"stuck": 1})
+
+
+def test_concurrent_drains_on_postgres(pg_dsn, monkeypatch):
+    async def scenario():
+        pg = PostgresStorage(pg_dsn)
+        monkeypatch.setattr(storage, "_STORAGE", pg)
+        try:
+            await migrate(storage=pg)
+            await pg.execute("DELETE FROM notify_outbox")
+            return await _two_replicas_drain(30)
+        finally:
+            await pg.close()
+
+    sent = asyncio.run(scenario())
+    assert sent == Counter({f"msg-{i}": 1 for i in range(30)})
@@ -0,0 +1,71 @@
+import asyncio
+
+from bot.services import payments
+from bot.services.db import get_subscription_until
+from bot.services.migrations import migrate
+from bot.services.storage import get_storage
+
+
+async def _status(payment_id: str) -> str:
+    row = await get_storage().fetchone("SELECT status FROM pending_payments WHERE payment_id=?", (payment_id,))
+    return row[0]
+
+
+def test_webhook_success_after_local_expiry_activates_subscription(monkeypatch):
+    monkeypatch.setattr(payments, "fetch_status", lambda payment_id: "succeeded")
+
+    async def scenario():
+        await migrate()
+        await payments._add_pending("pay-late", 5001, "late_payer")
+        # поллер не дождался оплаты и закрыл платёж локальным таймаутом
+        assert await payments.apply_payment_status("pay-late", "expired") is True
+        assert await _status("pay-late") == "expired"
+        # оплата в последний момент: webhook YooKassa приходит уже после таймаута
+        await payments.handle_webhook_notification(
+            {"type": "notification", "event": "payment.succeeded", "object": {"id": "pay-late"}}
+        )
+        assert await _status("pay-late") == "succeeded"
+        assert await get_subscription_until(5001)
+        # повторное уведомление подписку второй раз не продлевает
+        assert await payments.apply_payment_status("pay-late", "succeeded") is False
+
+    asyncio.run(scenario())
+
+
+def test_canceled_does_not_reopen_expired_payment():
+    async def scenario():
+        await migrate()
+        await payments._add_pending("pay-gone", 5002, None)
+        assert await payments.apply_payment_status("pay-gone", "expired") is True
+        assert await payments.apply_payment_status("pay-gone", "canceled") is False
+        assert await _status("pay-gone") == "expired"
+
+    asyncio.run(scenario())
+
+
+def test_start_yookassa_leaves_no_fsm_state(monkeypatch):
+    from types import SimpleNamespace
+
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    edits = []
+
+    async def fake_edit(message, text, **kwargs):
+        edits.append(text)
+
+    monkeypatch.setattr(payments, "create", lambda amount, user_id: ("https://pay.example/1", "pay-fsm"))
+    monkeypatch.setattr(payments, "_safe_edit_text", fake_edit)
+
+    async def scenario():
+        await migrate()
+        state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=5003, user_id=5003))
+        callback = SimpleNamespace(from_user=SimpleNamespace(id=5003, username="payer"), message=object())
+        await payments.start_yookassa(callback, state, bot=None)
+        assert await _status("pay-fsm") == "pending"
+        assert await state.get_state() is None
+        assert await state.get_data() == {}
+
+    asyncio.run(scenario())
+    assert edits
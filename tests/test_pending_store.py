@@ -0,0 +1,59 @@
+import asyncio
+
+from bot.services import pending_store
+from bot.services.pending_store import MemoryPendingStore, decode_pending, encode_pending
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_store_expires_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pending_store.time, "monotonic", clock)
+
+    async def scenario():
+        store = MemoryPendingStore(slots=8)
+        await store.put("a", {"plan": {"action": "create"}}, ttl=60)
+        await store.put("b", {"plan": {"action": "delete"}}, ttl=600)
+        assert (await store.get("a"))["plan"] == {"action": "create"}
+
+        clock.now += 61
+        assert await store.get("a") is None
+        assert await store.update("a", {"plan": {}}) is False
+        assert await store.pop("a") is None
+        assert len(store) == 1  # «a» вытеснено колесом таймеров, «b» ещё живо
+        assert await store.pop("b") == {"plan": {"action": "delete"}}
+        assert await store.pop("b") is None
+
+    asyncio.run(scenario())
+
+
+def test_update_keeps_original_deadline(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pending_store.time, "monotonic", clock)
+
+    async def scenario():
+        store = MemoryPendingStore()
+        await store.put("t", {"uid": 1}, ttl=60)
+        clock.now += 50
+        assert await store.update("t", {"uid": 2}) is True
+        clock.now += 20  # 70 с от put: продление update не даёт
+        assert await store.get("t") is None
+
+    asyncio.run(scenario())
+
+
+def test_encoding_is_compact():
+    item = {
+        "plan": {"action": "update", "title": None},
+        "uid": 7,
+        "candidates": [{"id": "e1", "summary": "Стрижка", "description": "длинный текст", "start": {"dateTime": "x"}}],
+    }
+    data = decode_pending(encode_pending(item))
+    assert data == {"plan": {"action": "update"}, "uid": 7,
+                    "candidates": [{"id": "e1", "summary": "Стрижка", "start": {"dateTime": "x"}}]}
@@ -0,0 +1,27 @@
+import asyncio
+import importlib.util
+import sqlite3
+from pathlib import Path
+
+from bot.services.migrations import migrate
+
+SCRIPT = Path(__file__).resolve().parents[1] / "scripts" / "check_query_plans.py"
+
+
+def _checker():
+    spec = importlib.util.spec_from_file_location("check_query_plans", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    db_path = str(tmp_path / "plan.db")
+    asyncio.run(migrate(db_path))
+    conn = sqlite3.connect(db_path)
+    try:
+        results = _checker().explain_all(conn)
+    finally:
+        conn.close()
+    assert results
+    assert {name: bad for name, _, bad in results if bad} == {}
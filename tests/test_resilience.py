@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+from bot.services.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    BREAKER_TRANSITIONS,
+    CircuitBreaker,
+    CircuitOpenError,
+    retry_async,
+)
+
+
+class Flaky(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("flaky")
+        self.retry_after = retry_after
+
+
+def _failing(calls, errors):
+    async def fn():
+        calls.append(len(calls))
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    return fn
+
+
+def test_retry_honours_retry_after_and_attempts():
+    calls, pauses = [], []
+
+    async def sleep(delay):
+        pauses.append(delay)
+
+    fn = _failing(calls, [Flaky(retry_after=1.5), Flaky()])
+    result = asyncio.run(retry_async(fn, name="t", attempts=3, retryable=lambda e: True, sleep=sleep))
+
+    assert result == "ok"
+    assert len(calls) == 3
+    assert pauses[0] == 1.5
+    assert 0 <= pauses[1] <= 1.0  # full jitter: base_delay * 2
+
+
+def test_retry_gives_up_when_retry_after_is_too_long_or_attempts_run_out():
+    async def sleep(delay):
+        raise AssertionError("не должны ждать")
+
+    calls = []
+    fn = _failing(calls, [Flaky(retry_after=60)])
+    with pytest.raises(Flaky):
+        asyncio.run(retry_async(fn, name="t", attempts=3, retryable=lambda e: True, max_delay=5, sleep=sleep))
+    assert len(calls) == 1
+
+    calls = []
+    fn = _failing(calls, [Flaky(), Flaky()])
+    with pytest.raises(Flaky):
+        asyncio.run(retry_async(fn, name="t", attempts=3, retryable=lambda e: False, sleep=sleep))
+    assert len(calls) == 1
+
+
+def test_breaker_opens_after_threshold_and_recovers_through_half_open():
+    br = CircuitBreaker("test-breaker", failure_threshold=2, reset_timeout=0.05)
+    calls = []
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(Flaky):
+                await br.call(_failing(calls, [Flaky()]))
+        opened = br.state
+        with pytest.raises(CircuitOpenError):
+            await br.call(_failing(calls, []))  # запрос к upstream не уходит
+        sent_while_open = len(calls)
+        time.sleep(0.06)
+        result = await br.call(_failing(calls, []))  # пробный запрос в half-open
+        return opened, sent_while_open, result
+
+    opened, sent_while_open, result = asyncio.run(scenario())
+    assert opened == OPEN
+    assert sent_while_open == 2
+    assert result == "ok" and br.state == CLOSED
+    assert BREAKER_TRANSITIONS[("test-breaker", OPEN, HALF_OPEN)] == 1
+    assert BREAKER_TRANSITIONS[("test-breaker", HALF_OPEN, CLOSED)] == 1
+
+
+def test_failed_probe_reopens_breaker():
+    br = CircuitBreaker("test-probe", failure_threshold=3, reset_timeout=0.0)
+    for _ in range(3):
+        br.record_failure()
+    assert br.allow()  # reset_timeout прошёл — один пробный запрос
+    assert br.state == HALF_OPEN and not br.allow()
+    br.record_failure()
+    assert br.state == OPEN
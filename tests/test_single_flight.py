@@ -0,0 +1,42 @@
+import asyncio
+
+from bot.services.single_flight import single_flight
+
+
+def test_identical_calls_share_one_upstream_call():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "doc"
+
+    async def main():
+        return await asyncio.gather(*(single_flight("doc:1", fetch, distributed=False) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["doc"] * 5
+    assert len(calls) == 1
+
+
+def test_waiter_survives_cancelled_leader():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return f"answer-{len(calls)}"
+
+    async def main():
+        leader = asyncio.create_task(single_flight("llm:q", fetch, distributed=False))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(single_flight("llm:q", fetch, distributed=False)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        return leader.cancelled(), results
+
+    leader_cancelled, results = asyncio.run(main())
+    assert leader_cancelled
+    # один из ожидающих стал новым лидером, второй дождался его результата
+    assert results == ["answer-2", "answer-2"]
+    assert len(calls) == 2
@@ -0,0 +1,88 @@
+import asyncio
+import datetime
+
+import pytest
+
+from bot.services import subscription
+from bot.services.db import normalize_ts
+from bot.services.migrations import migrate
+from bot.services.storage import get_storage
+
+USERS = (501, 502, 503)
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    out = {"stopped": [], "notified": []}
+
+    async def fake_stop_bot(token):
+        out["stopped"].append(token)
+
+    async def fake_enqueue(chat_id, text, dedupe_key=None):
+        out["notified"].append(chat_id)
+
+    monkeypatch.setattr(subscription, "stop_bot", fake_stop_bot)
+    monkeypatch.setattr(subscription, "enqueue", fake_enqueue)
+    return out
+
+
+async def _users(*rows):
+    await migrate()
+    st = get_storage()
+    await st.execute(f"DELETE FROM users WHERE id IN ({','.join('?' * len(USERS))})", USERS)
+    await st.executemany(
+        "INSERT INTO users (id, subscribe, date_end, bot_token, state_bot) VALUES (?, 'subscribe', ?, ?, ?)",
+        [(uid, normalize_ts(end), f"token-{uid}", state) for uid, end, state in rows],
+    )
+
+
+async def _subscribed():
+    rows = await get_storage().fetchall(
+        f"SELECT id FROM users WHERE subscribe='subscribe' AND id IN ({','.join('?' * len(USERS))}) ORDER BY id",
+        USERS,
+    )
+    return [r[0] for r in rows]
+
+
+def test_expire_due_stops_active_bots_and_notifies(sent):
+    now = datetime.datetime.now()
+
+    async def scenario():
+        await _users(
+            (501, now - datetime.timedelta(hours=1), "active"),
+            (502, now - datetime.timedelta(minutes=1), "stop"),
+            (503, now + datetime.timedelta(days=1), "active"),
+        )
+        expired = await subscription.ExpiryScheduler().expire_due()
+        return expired, await _subscribed()
+
+    expired, left = asyncio.run(scenario())
+    assert expired == 2
+    assert left == [503]
+    assert sent["stopped"] == ["token-501"]
+    assert sorted(sent["notified"]) == [501, 502]
+
+
+def test_scheduler_wakes_up_for_a_rescheduled_expiry(sent):
+    now = datetime.datetime.now().replace(microsecond=0)
+    soon = now + datetime.timedelta(seconds=1)
+
+    async def scenario():
+        await _users((503, now + datetime.timedelta(minutes=30), "active"))
+        sched = subscription.ExpiryScheduler()
+        task = asyncio.create_task(sched.run())
+        try:
+            await asyncio.sleep(0.2)  # heap загружен, ближайшее истечение — через полчаса
+            await get_storage().execute("UPDATE users SET date_end = ? WHERE id = 503", (normalize_ts(soon),))
+            sched.schedule(503, soon)
+            before = await _subscribed()
+            await asyncio.sleep(1.5)
+            return before, await _subscribed()
+        finally:
+            task.cancel()
+
+    before, after = asyncio.run(scenario())
+    assert before == [503]
+    assert after == []
+    assert sent["stopped"] == ["token-503"]
+    assert sent["notified"] == [503]
@@ -0,0 +1,21 @@
+import ipaddress
+
+from bot.web.oauth_app import client_ip
+
+YOOKASSA = "185.71.76.1"
+CADDY = "172.18.0.5"
+
+
+def test_direct_connection_ignores_forwarded_headers():
+    ip = client_ip("203.0.113.7", {"X-Real-IP": YOOKASSA, "X-Forwarded-For": YOOKASSA})
+    assert ip == ipaddress.ip_address("203.0.113.7")
+
+
+def test_proxy_real_ip_is_used():
+    assert client_ip(CADDY, {"X-Real-IP": YOOKASSA}) == ipaddress.ip_address(YOOKASSA)
+
+
+def test_proxy_forwarded_for_takes_rightmost_untrusted_hop():
+    # левый адрес подставил сам клиент, правый дописал Caddy
+    headers = {"X-Forwarded-For": f"{YOOKASSA}, 198.51.100.9"}
+    assert client_ip(CADDY, headers) == ipaddress.ip_address("198.51.100.9")